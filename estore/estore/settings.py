@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -36,17 +37,20 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
-    'django.contrib.staticfiles',
+    'store.apps.StoreStaticFilesConfig',
     'django.contrib.humanize',
     'store',
 ]
 
 MIDDLEWARE = [
+    # first, so that its timings cover the whole request
+    'store.performance.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # request.user from the user cache (see store/auth.py)
+    'store.auth.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -55,7 +59,8 @@ ROOT_URLCONF = 'estore.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # the Django template engine, with render timing for the performance middleware
+        'BACKEND': 'store.performance.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -77,12 +82,153 @@ WSGI_APPLICATION = 'estore.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# Database profile, STORE_DB_PROFILE in the environment:
+#   tuned           - WAL journal (readers don't wait for writers, writers don't wait for readers),
+#                     synchronous=NORMAL (safe with WAL; no fsync per commit), 64 MB page cache, memory
+#                     mapped reads, write-locking transactions (see store/backends/sqlite3) and
+#                     persistent connections, checked before reuse
+#   basic (default) - Django's defaults: rollback journal, a new connection per request
+# The journal mode is stored in the database file, so the tuned profile is for deployments: turning it on
+# rewrites the header of the db.sqlite3 bundled with the repository.
+STORE_DB_PROFILE = os.environ.get('STORE_DB_PROFILE', 'basic')
+
+def sqlite_database(name, profile, **pragmas):
+    if profile == 'basic':
+        return {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name}
+    return {
+        'ENGINE': 'store.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'cache_size': -64000,
+                'mmap_size': 256 * 1024 * 1024,
+                'temp_store': 'MEMORY',
+                **pragmas,
+            },
+        },
+    }
+
 DATABASES = {
+    'default': sqlite_database(BASE_DIR / 'db.sqlite3', STORE_DB_PROFILE),
+}
+
+# Read replica for the catalog (see store/routers.py): STORE_DB_REPLICA is the path of a copy of the
+# database kept up to date by replication (e.g. Litestream). Its connections are read only; it may lag
+# behind, reads that fill version keyed caches are made on the primary.
+STORE_DB_REPLICA = os.environ.get('STORE_DB_REPLICA', '')
+STORE_DB_READ_ALIAS = None
+if STORE_DB_REPLICA:
+    DATABASES['replica'] = {**sqlite_database(STORE_DB_REPLICA, STORE_DB_PROFILE, query_only='ON'), 'TEST': {'MIRROR': 'default'}}
+    STORE_DB_READ_ALIAS = 'replica'
+
+DATABASE_ROUTERS = ['store.routers.CatalogReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# local memory is per process - use a shared backend when running several workers: STORE_REDIS_URL in
+# the environment (e.g. redis://127.0.0.1:6379/0) puts every cache below in Redis (needs the redis package)
+STORE_REDIS_URL = os.environ.get('STORE_REDIS_URL', '')
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'estore',
+    },
+    # guest carts (see store/carts.py); these are the only copy of a guest's cart, so in production this
+    # should be a shared cache (Redis, Memcached) that all workers see and that does not evict too eagerly
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'estore-carts',
+        'TIMEOUT': 60 * 60 * 24 * 14,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # sessions (see SESSION_ENGINE); also kept in the database, so evictions only cost a database read
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'estore-sessions',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
 }
+if STORE_REDIS_URL:
+    for alias, options in CACHES.items():
+        CACHES[alias] = {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': STORE_REDIS_URL,
+            'KEY_PREFIX': options['LOCATION'],
+            **({'TIMEOUT': options['TIMEOUT']} if 'TIMEOUT' in options else {}),
+        }
+
+# Sessions (STORE_SESSIONS in the environment): 'cached_db' reads sessions from the 'sessions' cache and
+# writes them through to the database, which is read only when the cache misses; 'db' reads the
+# django_session table on every request. Cached sessions are the default with a shared cache only: a
+# logout or session flush in one worker does not reach the local memory caches of the others.
+STORE_SESSIONS = os.environ.get('STORE_SESSIONS', 'cached_db' if STORE_REDIS_URL else 'db')
+SESSION_ENGINE = 'django.contrib.sessions.backends.%s' % STORE_SESSIONS
+SESSION_CACHE_ALIAS = 'sessions'
+
+# seconds a logged in user is served from the cache (store/auth.py); 0 reads auth_user on every request.
+# Off without a shared cache, for the same reason as cached sessions (logouts, password changes)
+STORE_USER_CACHE_TIMEOUT = 60 * 5 if STORE_REDIS_URL else 0
+
+# seconds a cached cart badge count lives before it is recomputed (it is also invalidated on every cart change)
+STORE_CART_COUNT_TIMEOUT = 60 * 60
+
+# cache alias holding the carts of visitors who are not logged in
+STORE_GUEST_CART_CACHE = 'carts'
+
+# minutes the stock of a logged in customer's cart lines stays held for them (store/inventory.py);
+# `manage.py release_reservations` puts expired holds back
+STORE_RESERVATION_MINUTES = 15
+
+# seconds a cached category menu lives in the shared cache (a category change bumps its version right away)
+STORE_CATEGORY_MENU_TIMEOUT = 60 * 60 * 24
+
+# full page cache of the catalog pages (home, categories, category listing) for anonymous visitors,
+# and the product card fragments used on those pages; both are invalidated when the catalog changes
+STORE_PAGE_CACHE = True
+STORE_PAGE_CACHE_TIMEOUT = 60 * 10
+STORE_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+# conditional GET (ETag / Last-Modified) for the product and category pages (store/conditional.py);
+# browsers revalidate them after STORE_CATALOG_MAX_AGE seconds, shared caches in front of the app may keep
+# the pages of anonymous visitors for STORE_CATALOG_SHARED_MAX_AGE seconds
+STORE_CONDITIONAL_PAGES = True
+STORE_CATALOG_MAX_AGE = 0
+STORE_CATALOG_SHARED_MAX_AGE = 60
+
+# catalog listing (shop and category pages): products per page and lifetime of cached facet counts
+STORE_CATALOG_PAGE_SIZE = 12
+STORE_FACETS_TIMEOUT = 60 * 10
+
+# product search ranks at most this many of the newest matching products (see store/search.py)
+STORE_SEARCH_CANDIDATES = 2000
+
+# related products shown on the product detail page, precomputed by `manage.py refresh_recommendations`
+STORE_RELATED_PRODUCTS = 8
+
+# serve the catalog pages with the async views of store/async_views.py (enabled by estore/asgi.py)
+STORE_ASYNC_VIEWS = os.environ.get('STORE_ASYNC_VIEWS', '') == '1'
+
+# per request instrumentation (store/performance.py): Server-Timing header, requests slower than this
+# many milliseconds are logged with their slowest queries, statements repeated this many times in one
+# request are logged as likely N+1 queries
+STORE_SERVER_TIMING = True
+STORE_SLOW_REQUEST_MS = 500
+STORE_DUPLICATE_QUERY_THRESHOLD = 5
+
+# order history: orders per page, and latest orders shown on the profile page
+STORE_ORDERS_PAGE_SIZE = 20
+STORE_PROFILE_RECENT_ORDERS = 5
+
+# admin changelists: counts stop at this many rows, unfiltered lists of bigger tables show an estimate
+STORE_ADMIN_COUNT_LIMIT = 10000
 
 
 # Password validation
@@ -120,12 +266,26 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.0/howto/static-files/
 
 STATIC_URL = 'static/'
-STATICFILES_DIR = [BASE_DIR / 'estore/static']
-STATIC_ROOT = BASE_DIR / 'static'
+STATICFILES_DIRS = [BASE_DIR / 'static']
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic writes content hashed names and precompressed .gz/.br copies (see store/storage.py);
+# hashed names only exist after collectstatic, so the development server keeps the plain storage
+if not DEBUG:
+    STATICFILES_STORAGE = 'store.storage.CompressedManifestStaticFilesStorage'
 
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'static/media'
 
+# static and media served by django itself (store/serving.py) when there is no web server in front;
+# non hashed files (all media) are cached for STORE_SERVE_MAX_AGE seconds and then revalidated
+STORE_SERVE_FILES = True
+STORE_SERVE_MAX_AGE = 60 * 60
+
+# resized JPEG/WebP copies of product and category images (see store/images.py)
+STORE_IMAGE_DERIVATIVES_ON_SAVE = True
+STORE_IMAGE_WORKERS = 2
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
@@ -14,13 +14,22 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+from django.urls import path, re_path, include
 from django.conf import settings
+from store import serving
+
+# media and (collected) static files, served with caching headers when there is no web server in front
+# (under runserver with DEBUG on, /static/ is answered by the staticfiles app before reaching these)
+file_urlpatterns = []
+if settings.STORE_SERVE_FILES:
+    file_urlpatterns = [
+        re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), serving.serve, {'document_root': settings.MEDIA_ROOT, 'max_age': settings.STORE_SERVE_MAX_AGE}),
+        re_path(r'^%s(?P<path>.*)$' % settings.STATIC_URL.lstrip('/'), serving.serve, {'document_root': settings.STATIC_ROOT, 'max_age': settings.STORE_SERVE_MAX_AGE}),
+    ]
 
 # link to store app urls as well as to where our media is kept
-urlpatterns = [
+urlpatterns = file_urlpatterns + [
     path('admin/', admin.site.urls),
     path('', include('store.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
     
@@ -1,11 +1,65 @@
+import datetime
+
+from django.conf import settings
 from django.contrib import admin
-from store.models import Address, Category, Product, Cart, Order
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Max, Q
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from store.models import Address, Category, Product, Cart, Order, OrderLine, SalesRollup
+from store.sales import sales_report
+from store.search import WORD_RE, search_filter
+
+# Changelists of the big tables (products, carts, orders) stay fast whatever the table size:
+# - FK columns come from the same query as the rows (list_select_related)
+# - FK fields are edited with autocomplete widgets instead of a <select> of every row of the related table
+# - search only uses indexed lookups (exact SKU/username, the product full text index)
+# - pagination doesn't count the whole table, see EstimatedCountPaginator
+
+
+# Row count without a table scan: PostgreSQL's planner statistics, elsewhere the highest primary key
+# (an overestimate by the number of deleted rows)
+def estimated_count(model):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return row[0]
+    return model._base_manager.aggregate(max_id=Max('pk'))['max_id'] or 0
+
+
+# Unfiltered changelists of large tables show an estimated count; other counts stop at
+# STORE_ADMIN_COUNT_LIMIT rows (pages past it are not linked), so a broad filter or search costs at
+# most that many index entries rather than a full COUNT(*)
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        limit = settings.STORE_ADMIN_COUNT_LIMIT
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model)
+            if estimate > limit:
+                return estimate
+        return queryset.order_by()[:limit + 1].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # no "N results (M total)": that is a second COUNT(*) of the whole table
+    show_full_result_count = False
+
 
 class AddressAdmin(admin.ModelAdmin):
     list_display = ('user', 'location', 'street_address', 'city', 'state')
+    list_select_related = ('user',)
     list_filter = ('city', 'state')
     list_per_page = 10
     search_fields = ('location', 'street_address', 'city', 'state')
+    autocomplete_fields = ('user',)
 
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('title', 'slug', 'category_image', 'is_active', 'is_featured', 'updated_at')
@@ -15,30 +69,111 @@ class CategoryAdmin(admin.ModelAdmin):
     search_fields = ('title', 'description')
     prepopulated_fields = {'slug' : ('title',)}
 
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ('title', 'slug', 'category', 'product_image', 'is_active', 'is_featured', 'updated_at')
-    list_editable = ('slug', 'category', 'is_active', 'is_featured')
+# The category is changed on the product page (an editable category column renders the category list once per row)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ('title', 'sku', 'slug', 'category', 'product_image', 'stock', 'is_active', 'is_featured', 'updated_at')
+    list_editable = ('slug', 'stock', 'is_active', 'is_featured')
+    list_select_related = ('category',)
     list_filter = ('category', 'is_active', 'is_featured')
     list_per_page = 10
-    search_fields = ('title', 'category', 'short_description')
+    search_fields = ('sku',)    # see get_search_results
+    search_help_text = "An exact SKU, or words of the title, descriptions or category"
+    autocomplete_fields = ('category',)
     prepopulated_fields = {'slug' : ('title',)}
 
-class CartAdmin(admin.ModelAdmin):
+    # the stock changes with every cart add and checkout while the form is open, so it is only written
+    # when it was edited here (setting a new level); other changes save the other fields
+    def save_model(self, request, obj, form, change):
+        if change and 'stock' not in form.changed_data:
+            obj.save(update_fields=[field.name for field in obj._meta.concrete_fields if not field.primary_key and field.name != 'stock'])
+        else:
+            super().save_model(request, obj, form, change)
+
+    # exact SKU or the full text index (also used by the product autocomplete of the cart and order admins)
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        q = Q(sku=search_term)
+        if WORD_RE.search(search_term):
+            q |= search_filter(search_term)
+        return queryset.filter(q), False
+
+class CartAdmin(LargeTableAdmin):
     list_display = ('user', 'product', 'quantity', 'created_at')
     list_editable = ('quantity',)
+    list_select_related = ('user', 'product')
     list_filter = ('created_at',)
     list_per_page = 20
-    search_fields = ('user', 'product')
+    search_fields = ('user__username__exact', 'product__sku__exact')
+    search_help_text = "An exact username or product SKU"
+    autocomplete_fields = ('user', 'product')
+
+# Order lines are what was sold at checkout, shown on the order page but never edited
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    fields = ('product', 'category', 'title', 'unit_price', 'quantity', 'line_total')
+    readonly_fields = fields
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
-class OrderAdmin(admin.ModelAdmin):
-    list_display = ('user', 'product', 'quantity', 'status', 'ordered_date')
-    list_editable = ('quantity', 'status')
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'total', 'status', 'ordered_date')
+    list_editable = ('status',)
+    list_select_related = ('user',)
     list_filter = ('status', 'ordered_date')
     list_per_page = 20
-    search_fields = ('user', 'product')
+    search_fields = ('user__username__exact', 'lines__product__sku__exact')
+    search_help_text = "An exact username or product SKU"
+    autocomplete_fields = ('user', 'address')
+    readonly_fields = ('total',)
+    inlines = (OrderLineInline,)
+
+# Sales dashboard: the Sales changelist shows revenue per day, category and status over the last
+# `days` days (?days=, 30 by default), read from the sales rollups only (see sales.py)
+class SalesRollupAdmin(admin.ModelAdmin):
+    PERIODS = (7, 30, 90, 365)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        try:
+            days = max(1, min(int(request.GET.get('days', 30)), 3660))
+        except ValueError:
+            days = 30
+        end = timezone.now().astimezone(datetime.timezone.utc).date()
+        start = end - datetime.timedelta(days=days - 1)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts' : self.model._meta,
+            'title' : "Sales",
+            'days' : days,
+            'periods' : self.PERIODS,
+            'start' : start,
+            'end' : end,
+            'report' : sales_report(start, end),
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, 'admin/store/sales_dashboard.html', context)
 
 admin.site.register(Address, AddressAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Cart, CartAdmin)
 admin.site.register(Order, OrderAdmin)
+admin.site.register(SalesRollup, SalesRollupAdmin)
@@ -1,6 +1,21 @@
 from django.apps import AppConfig
+from django.contrib.staticfiles.apps import StaticFilesConfig
 
 
 class StoreConfig(AppConfig):
+    default = True
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        # connect the signal handlers (cache invalidation, image derivatives)
+        from . import signals
+        # time the queries of every request for the performance middleware (store/performance.py)
+        from django.db.backends.signals import connection_created
+        from .performance import install_query_recorder
+        connection_created.connect(install_query_recorder)
+
+
+# Uploaded media lives under static/media but is not a static asset, keep it out of collectstatic
+class StoreStaticFilesConfig(StaticFilesConfig):
+    ignore_patterns = StaticFilesConfig.ignore_patterns + ['media']
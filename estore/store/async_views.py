@@ -0,0 +1,67 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404
+from django.shortcuts import render
+
+from store.models import Category, Product
+from .cache import cache_anonymous_page
+from .catalog import catalog_page, catalog_query
+from .conditional import category_page_state, conditional_page, product_page_state
+from .context_preprocessors import aload_context
+
+# Async versions of the read-only catalog views, used instead of the ones in views.py when
+# STORE_ASYNC_VIEWS is on (estore/asgi.py turns it on for ASGI deployments).
+# Querysets are evaluated here with the async ORM, never lazily from the templates, and the navbar
+# context is loaded ahead of rendering, since the ORM cannot be used from the event loop.
+
+
+# Home Page
+@cache_anonymous_page('home')
+async def home(request):
+    categories = [c async for c in Category.objects.filter(is_active=True, is_featured=True)[:3]]
+    products = [p async for p in Product.objects.filter(is_active=True, is_featured=True)[:8]]
+    context = {
+        "categories" : categories,
+        "products" : products,
+    }
+    await aload_context(request)
+    return render(request, "store/index.html", context)
+
+# Detail Page for a specific Product based on slug, with its precomputed related products
+@conditional_page('product-detail', product_page_state)
+async def detail(request, slug):
+    try:
+        product = await Product.objects.select_related('category').aget(slug=slug)
+    except Product.DoesNotExist:
+        raise Http404("No such product")
+    limit = settings.STORE_RELATED_PRODUCTS
+    related_products = [r.related async for r in product.recommendations.filter(related__is_active=True).select_related('related')[:limit]]
+    if not related_products:
+        related_products = [p async for p in Product.objects.exclude(id=product.id).filter(is_active=True, category=product.category).order_by('-created_at', '-id')[:limit]]
+    context = {
+        "product" : product,
+        "related_products" : related_products,
+    }
+    await aload_context(request)
+    return render(request, "store/detail.html", context)
+
+# Display all active categories in our eStore
+@cache_anonymous_page('all-categories')
+async def all_categories(request):
+    categories = [c async for c in Category.objects.filter(is_active=True)]
+    await aload_context(request)
+    return render(request, "store/categories.html", {'categories' : categories})
+
+# Display the products of a specific category, a page at a time
+@conditional_page('category-products', category_page_state)
+@cache_anonymous_page('category-products', query=catalog_query)
+async def category_products(request, slug):
+    try:
+        category = await Category.objects.aget(slug=slug)
+    except Category.DoesNotExist:
+        raise Http404("No such category")
+    # the page and its facets take several dependent queries, run together in one thread hop
+    context = await sync_to_async(catalog_page)(request, category)
+    context["category"] = category
+    await aload_context(request)
+    return render(request, "store/category_products.html", context)
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+from .cache import get_cached_user, set_cached_user
+
+# request.user from the user cache (see cache.py) instead of an auth_user query per request.
+# A cached user is only used for a session whose auth hash (derived from the password) still matches
+# it, exactly like django.contrib.auth.get_user() checks it; anything else - no cached user, a hash that
+# doesn't match, STORE_USER_CACHE_TIMEOUT = 0 - goes through get_user(), which also flushes sessions
+# that are no longer valid.
+
+
+def get_user(request):
+    session = request.session
+    user_id = session.get(SESSION_KEY)
+    if not settings.STORE_USER_CACHE_TIMEOUT or user_id is None or session.get(BACKEND_SESSION_KEY) not in settings.AUTHENTICATION_BACKENDS:
+        return auth.get_user(request)
+    user = get_cached_user(user_id)
+    if user is not None and constant_time_compare(session.get(HASH_SESSION_KEY, ''), user.get_session_auth_hash()):
+        return user
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        set_cached_user(user)
+    return user
+
+
+def get_request_user(request):
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = get_user(request)
+    return request._cached_user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_request_user(request))
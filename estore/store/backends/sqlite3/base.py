@@ -0,0 +1,23 @@
+from django.db.backends.sqlite3 import base
+
+# Django's SQLite backend plus two DATABASES OPTIONS it doesn't have before Django 5.1:
+#   'transaction_mode': 'IMMEDIATE' - atomic blocks take the write lock when they begin. A plain (deferred)
+#       BEGIN reads first and upgrades to a writer at its first write, which fails straight away with
+#       "database is locked" if another connection wrote in between; an immediate one waits for the lock
+#       (up to the 'timeout' option) instead.
+#   'pragmas': {name: value} - PRAGMAs run on every new connection (journal mode, cache size, ...)
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.transaction_mode = params.pop('transaction_mode', None)
+        self.pragmas = params.pop('pragmas', {})
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute('PRAGMA %s = %s' % (name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN %s' % self.transaction_mode if self.transaction_mode else 'BEGIN')
@@ -0,0 +1,266 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.http import HttpResponse
+
+from .models import Cart, Category
+from .routers import primary_reads
+
+# Caching helpers for data that is rendered on every page (navbar) and for whole catalog pages
+
+# Cart badge - number of lines in a user's cart, cached per user so rendering the navbar does not
+# cost a COUNT query. Every view that changes a cart calls invalidate_cart_count() afterwards.
+CART_COUNT_KEY = 'store:cart-count:%s'
+
+
+def get_cart_count(user_id):
+    key = CART_COUNT_KEY % user_id
+    count = cache.get(key)
+    if count is None:
+        count = Cart.objects.filter(user_id=user_id).count()
+        cache.set(key, count, settings.STORE_CART_COUNT_TIMEOUT)
+    return count
+
+
+async def aget_cart_count(user_id):
+    key = CART_COUNT_KEY % user_id
+    count = await cache.aget(key)
+    if count is None:
+        count = await Cart.objects.filter(user_id=user_id).acount()
+        await cache.aset(key, count, settings.STORE_CART_COUNT_TIMEOUT)
+    return count
+
+
+def invalidate_cart_count(user_id):
+    cache.delete(CART_COUNT_KEY % user_id)
+
+
+# Guest carts - the cart of a visitor who is not logged in is a {product id: quantity} dict kept in the
+# STORE_GUEST_CART_CACHE cache under a random token stored in their session, so carting does not write
+# to the database (see store/carts.py). The token survives the session key change on login.
+GUEST_CART_KEY = 'store:guest-cart:%s'
+GUEST_CART_SESSION_KEY = 'store_guest_cart'
+
+
+def get_guest_cart(token):
+    return caches[settings.STORE_GUEST_CART_CACHE].get(GUEST_CART_KEY % token) or {}
+
+
+def set_guest_cart(token, lines):
+    caches[settings.STORE_GUEST_CART_CACHE].set(GUEST_CART_KEY % token, lines)
+
+
+def delete_guest_cart(token):
+    caches[settings.STORE_GUEST_CART_CACHE].delete(GUEST_CART_KEY % token)
+
+
+async def aget_guest_cart(token):
+    return await caches[settings.STORE_GUEST_CART_CACHE].aget(GUEST_CART_KEY % token) or {}
+
+
+# Logged in users - the User row behind a session, cached for STORE_USER_CACHE_TIMEOUT seconds so that
+# requests don't read auth_user (see store/auth.py). Dropped when the user is saved (password change,
+# deactivation, ...) or deleted and when they log out (see signals.py).
+USER_KEY = 'store:user:%s'
+
+
+def get_cached_user(user_id):
+    return cache.get(USER_KEY % user_id)
+
+
+def set_cached_user(user):
+    cache.set(USER_KEY % user.pk, user, settings.STORE_USER_CACHE_TIMEOUT)
+
+
+def invalidate_user(user_id):
+    cache.delete(USER_KEY % user_id)
+
+
+# Versions - cached data derived from a table is keyed by a version number that is bumped whenever the
+# table changes, so stale entries are never read again and simply expire. The version itself lives in
+# the shared cache; it starts from the current time so a version lost to eviction never goes backwards.
+VERSION_KEY = 'store:version:%s'
+
+
+def get_version(name):
+    key = VERSION_KEY % name
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+async def aget_version(name):
+    key = VERSION_KEY % name
+    version = await cache.aget(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not await cache.aadd(key, version, None):
+            version = await cache.aget(key, version)
+    return version
+
+
+def bump_version(name):
+    key = VERSION_KEY % name
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(key, version, None)
+        return version
+
+
+# Category menu - the active categories shown in the navbar. Served from a process local copy while
+# the 'categories' version is unchanged, then from the shared cache, and only then from the database.
+CATEGORY_MENU_KEY = 'store:category-menu:%s'
+_local_category_menu = {'version': None, 'items': None}
+
+
+def get_category_menu():
+    global _local_category_menu
+    version = get_version('categories')
+    local = _local_category_menu
+    if local['version'] == version:
+        return local['items']
+    key = CATEGORY_MENU_KEY % version
+    items = cache.get(key)
+    if items is None:
+        with primary_reads():
+            items = list(Category.objects.filter(is_active=True).values('id', 'title', 'slug'))
+        cache.set(key, items, settings.STORE_CATEGORY_MENU_TIMEOUT)
+    # replace the whole dict so concurrent threads never see a version paired with the wrong items
+    _local_category_menu = {'version': version, 'items': items}
+    return items
+
+
+# the same for async views, with the async cache API and ORM
+async def aget_category_menu():
+    global _local_category_menu
+    version = await aget_version('categories')
+    local = _local_category_menu
+    if local['version'] == version:
+        return local['items']
+    key = CATEGORY_MENU_KEY % version
+    items = await cache.aget(key)
+    if items is None:
+        with primary_reads():
+            items = [item async for item in Category.objects.filter(is_active=True).values('id', 'title', 'slug')]
+        await cache.aset(key, items, settings.STORE_CATEGORY_MENU_TIMEOUT)
+    _local_category_menu = {'version': version, 'items': items}
+    return items
+
+
+# Hit/miss counters kept in the shared cache so every worker reports into the same numbers
+STATS_KEY = 'store:stats:%s:%s'
+STATS_NAMES = ('page', 'fragment')
+
+
+def record(name, outcome):
+    key = STATS_KEY % (name, outcome)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def get_stats():
+    stats = {}
+    for name in STATS_NAMES:
+        hits = cache.get(STATS_KEY % (name, 'hit'), 0)
+        misses = cache.get(STATS_KEY % (name, 'miss'), 0)
+        stats[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+    return stats
+
+
+# Full page cache for anonymous visitors - the rendered response is stored under the page name, the
+# requested path and the 'catalog' version (bumped whenever a Product or Category changes), so a catalog
+# change makes every cached page unreachable at once. Logged in users and guests with a cart always get
+# a fresh render since their navbar shows their cart; responses that set cookies or are not 200 are
+# never stored.
+PAGE_KEY = 'store:page:%s:%s:%s'
+
+
+# whether the page may come from / go to the cache; resolving request.user and the session may query
+# the database, so async views call this through sync_to_async
+def _cacheable_request(request):
+    if not settings.STORE_PAGE_CACHE or request.method != 'GET' or request.user.is_authenticated:
+        return False
+    # guests with a cart see it in the navbar too
+    return GUEST_CART_SESSION_KEY not in request.session
+
+
+# the path and the query string as `query` normalizes it; pages without a `query` take no parameters, so
+# arbitrary query strings can't fill the cache with copies of a page
+def _page_path(request, query):
+    path = '%s?%s' % (request.path, query(request) if query else '')
+    return hashlib.md5(path.encode()).hexdigest()
+
+
+def _cached_response(cached):
+    record('page', 'hit')
+    content, content_type = cached
+    response = HttpResponse(content, content_type=content_type)
+    response['X-Page-Cache'] = 'hit'
+    return response
+
+
+# the rendered page if it can be stored, None otherwise
+def _cacheable_response(request, response):
+    response['X-Page-Cache'] = 'miss'
+    # a page that used the csrf token gets a cookie from the csrf middleware later on
+    uses_csrf = request.META.get('CSRF_COOKIE_NEEDS_UPDATE') or request.META.get('CSRF_COOKIE_USED')
+    if response.status_code != 200 or response.cookies or uses_csrf or response.streaming:
+        return None
+    if hasattr(response, 'render') and callable(response.render):
+        response.render()
+    return (response.content, response['Content-Type'])
+
+
+def cache_anonymous_page(name, query=None):
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _async_wrapped_view(request, *args, **kwargs):
+                if not await sync_to_async(_cacheable_request)(request):
+                    return await view_func(request, *args, **kwargs)
+                key = PAGE_KEY % (await aget_version('catalog'), name, _page_path(request, query))
+                cached = await cache.aget(key)
+                if cached is not None:
+                    return _cached_response(cached)
+                record('page', 'miss')
+                with primary_reads():
+                    response = await view_func(request, *args, **kwargs)
+                page = _cacheable_response(request, response)
+                if page is not None:
+                    await cache.aset(key, page, settings.STORE_PAGE_CACHE_TIMEOUT)
+                return response
+            return _async_wrapped_view
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if not _cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+            key = PAGE_KEY % (get_version('catalog'), name, _page_path(request, query))
+            cached = cache.get(key)
+            if cached is not None:
+                return _cached_response(cached)
+            record('page', 'miss')
+            with primary_reads():
+                response = view_func(request, *args, **kwargs)
+            page = _cacheable_response(request, response)
+            if page is not None:
+                cache.set(key, page, settings.STORE_PAGE_CACHE_TIMEOUT)
+            return response
+        return _wrapped_view
+    return decorator
@@ -0,0 +1,211 @@
+import uuid
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from .cache import (GUEST_CART_SESSION_KEY, aget_cart_count, aget_guest_cart, delete_guest_cart,
+                    get_cart_count, get_guest_cart, invalidate_cart_count, set_guest_cart)
+from .inventory import OutOfStock, release, reserve
+from .models import Cart, Product
+
+# Cart storage backends. Views work on whatever get_cart() returns:
+#   DatabaseCart - a logged in user's cart, the Cart table (every change is one conditional statement)
+#   GuestCart    - a visitor's cart, a {product id: quantity} dict in the guest cart cache; no database
+#                  writes while browsing, merged into the Cart table when the visitor logs in
+# Both expose the same methods; line ids are Cart ids for the first and product ids for the second.
+# Adding more of a product with tracked stock than there is raises inventory.OutOfStock; a logged in
+# user's cart holds the units it has (inventory.reserve), a guest cart is only checked against the stock.
+
+
+def get_cart(request):
+    if request.user.is_authenticated:
+        return DatabaseCart(request.user)
+    return GuestCart(request.session)
+
+
+# for async views: the lazy request.user and the session are loaded from the database on first use
+async def aget_cart(request):
+    return await sync_to_async(get_cart)(request)
+
+
+class DatabaseCart:
+    def __init__(self, user):
+        self.user = user
+
+    def add(self, product_id, quantity=1):
+        stock = Product.objects.filter(id=product_id).values_list('stock', flat=True).first()
+        if stock is None:
+            added = Cart.objects.add_product(self.user, product_id, quantity)
+        else:
+            with transaction.atomic():
+                added = Cart.objects.add_product(self.user, product_id, quantity)
+                if added:
+                    reserve(self.user, int(product_id), quantity)
+        invalidate_cart_count(self.user.id)
+        return added
+
+    # A change of a line of the cart (a CartQuerySet method) together with the matching change of the
+    # units held for it, hold(product id), for products with tracked stock
+    def _change(self, line_id, change, hold):
+        product = Cart.objects.filter(id=line_id, user=self.user).values_list('product_id', 'product__stock').first()
+        if product is None:
+            return False
+        product_id, stock = product
+        if stock is None:
+            return change(self.user, line_id)
+        with transaction.atomic():
+            changed = change(self.user, line_id)
+            if changed:
+                hold(product_id)
+        return changed
+
+    def increment(self, line_id):
+        return self._change(line_id, Cart.objects.increment, lambda product_id: reserve(self.user, product_id, 1))
+
+    def decrement(self, line_id):
+        changed = self._change(line_id, Cart.objects.decrement, lambda product_id: release(self.user, product_id, 1))
+        invalidate_cart_count(self.user.id)
+        return changed
+
+    def remove(self, line_id):
+        removed = self._change(line_id, Cart.objects.remove, lambda product_id: release(self.user, product_id))
+        invalidate_cart_count(self.user.id)
+        return removed
+
+    # cart lines with their products and line totals, in one joined query
+    def lines(self):
+        return Cart.objects.filter(user=self.user).with_line_totals()
+
+    def line(self, line_id=None, product_id=None):
+        lookup = {'id': line_id} if line_id is not None else {'product_id': product_id}
+        return self.lines().filter(**lookup).first()
+
+    def totals(self, shipping_cost):
+        return Cart.objects.filter(user=self.user).totals(shipping_cost)
+
+    def count(self):
+        return get_cart_count(self.user.id)
+
+    async def acount(self):
+        return await aget_cart_count(self.user.id)
+
+
+class GuestCart:
+    def __init__(self, session):
+        self.session = session
+        self.token = session.get(GUEST_CART_SESSION_KEY)
+        self._lines = None
+
+    def _load(self):
+        return get_guest_cart(self.token) if self.token else {}
+
+    def _save(self, quantities):
+        if not self.token:
+            # the only session write of a guest cart, on the first product added
+            self.token = uuid.uuid4().hex
+            self.session[GUEST_CART_SESSION_KEY] = self.token
+        set_guest_cart(self.token, quantities)
+        self._lines = None
+
+    # guests hold no stock, their carts are only kept within it
+    def _check_stock(self, product_id, quantity):
+        product = Product.objects.filter(id=product_id, is_active=True).values_list('title', 'stock').first()
+        if product is None:
+            return False
+        title, stock = product
+        if stock is not None and stock < quantity:
+            raise OutOfStock([(product_id, title, quantity, stock)])
+        return True
+
+    def add(self, product_id, quantity=1):
+        product_id = int(product_id)
+        quantities = self._load()
+        if not self._check_stock(product_id, quantities.get(product_id, 0) + quantity):
+            return False
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+        self._save(quantities)
+        return True
+
+    def increment(self, line_id):
+        quantities = self._load()
+        if line_id not in quantities or not self._check_stock(line_id, quantities[line_id] + 1):
+            return False
+        quantities[line_id] += 1
+        self._save(quantities)
+        return True
+
+    # the last one of a product removes the line
+    def decrement(self, line_id):
+        quantities = self._load()
+        if line_id not in quantities:
+            return False
+        if quantities[line_id] > 1:
+            quantities[line_id] -= 1
+        else:
+            del quantities[line_id]
+        self._save(quantities)
+        return True
+
+    def remove(self, line_id):
+        quantities = self._load()
+        if quantities.pop(line_id, None) is None:
+            return False
+        self._save(quantities)
+        return True
+
+    # unsaved Cart instances (id = product id) so templates render guest and user carts alike;
+    # products that were deactivated since they were carted are left out
+    def lines(self):
+        if self._lines is None:
+            quantities = self._load()
+            products = Product.objects.in_bulk(list(quantities)) if quantities else {}
+            self._lines = []
+            for product_id, quantity in quantities.items():
+                product = products.get(product_id)
+                if product is None or not product.is_active:
+                    continue
+                line = Cart(id=product_id, product=product, quantity=quantity)
+                line.line_total = quantity * product.price
+                self._lines.append(line)
+        return self._lines
+
+    def line(self, line_id=None, product_id=None):
+        line_id = int(product_id) if line_id is None else line_id
+        return next((line for line in self.lines() if line.id == line_id), None)
+
+    def totals(self, shipping_cost):
+        lines = self.lines()
+        cart_cost = sum((line.line_total for line in lines), Decimal(0))
+        return {
+            'cart_cost': cart_cost,
+            'total_cost': cart_cost + shipping_cost,
+            'shipping_cost': shipping_cost,
+            'line_count': len(lines),
+        }
+
+    def count(self):
+        return len(self._load())
+
+    async def acount(self):
+        return len(await aget_guest_cart(self.token)) if self.token else 0
+
+
+# Move a guest cart into the logged in user's cart, adding up quantities of products that were in both
+# and holding their stock like any other add. Runs when the visitor logs in (see signals.py) and again at
+# checkout. Lines there isn't enough stock for are kept without a hold: logging in never fails, and
+# checkout reports the shortage.
+def merge_guest_cart(session, user):
+    token = session.pop(GUEST_CART_SESSION_KEY, None)
+    if not token:
+        return 0
+    cart = DatabaseCart(user)
+    merged = 0
+    for product_id, quantity in get_guest_cart(token).items():
+        try:
+            merged += cart.add(product_id, quantity)
+        except OutOfStock:
+            merged += Cart.objects.add_product(user, product_id, quantity)
+    delete_guest_cart(token)
+    invalidate_cart_count(user.id)
+    return merged
@@ -0,0 +1,181 @@
+import base64
+from urllib.parse import urlencode
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils.dateparse import parse_datetime
+
+from .cache import get_category_menu, get_version
+from .models import Product
+from .routers import primary_reads
+
+# Catalog listing for the shop and category pages: filters (category, price range), facet counts and
+# keyset pagination. Pages are cut with a cursor on (created_at, id) instead of an OFFSET, so page N
+# seeks straight to its first row in the (category, -created_at, -id) index like page 1 does.
+
+# price range facet buckets, (from, to) with to exclusive; None is unbounded
+PRICE_RANGES = (
+    (None, Decimal(25)),
+    (Decimal(25), Decimal(50)),
+    (Decimal(50), Decimal(100)),
+    (Decimal(100), Decimal(200)),
+    (Decimal(200), None),
+)
+PRICE_BOUNDS = sorted({bound for bucket in PRICE_RANGES for bound in bucket if bound is not None})
+
+
+def parse_price(value):
+    try:
+        price = Decimal(value)
+    except (TypeError, InvalidOperation):
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+# Price filters are snapped outwards to the bucket bounds (a minimum down, a maximum up), so there are a
+# handful of filters - and of facet counts cached per filter - whatever the query string says
+def parse_min_price(value):
+    price = parse_price(value)
+    return None if price is None else max((bound for bound in PRICE_BOUNDS if bound <= price), default=None)
+
+
+def parse_max_price(value):
+    price = parse_price(value)
+    return None if price is None else min((bound for bound in PRICE_BOUNDS if bound >= price), default=None)
+
+
+# Cursors are opaque to the client: the (created_at, id) of the row the page starts after/before
+# (or another date field for listings not ordered by creation date, see store/orders.py)
+def encode_cursor(obj, field='created_at'):
+    value = '%s|%d' % (getattr(obj, field).isoformat(), obj.id)
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, product_id = value.split('|')
+        created_at = parse_datetime(created_at)
+        product_id = int(product_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return (created_at, product_id) if created_at else None
+
+
+def filter_products(category=None, min_price=None, max_price=None):
+    products = Product.objects.filter(is_active=True)
+    if category is not None:
+        products = products.filter(category=category)
+    else:
+        products = products.filter(category__is_active=True)
+    if min_price is not None:
+        products = products.filter(price__gte=min_price)
+    if max_price is not None:
+        products = products.filter(price__lt=max_price)
+    return products
+
+
+# One page of products (or any rows, ordered by `field` then id), newest first. `after` continues past
+# the last row of the previous page, `before` goes back from the first row of the next page;
+# page_size + 1 rows are read to tell whether there is a page beyond.
+def paginate(products, after=None, before=None, page_size=None, field='created_at'):
+    page_size = page_size or settings.STORE_CATALOG_PAGE_SIZE
+    after = decode_cursor(after) if after else None
+    before = decode_cursor(before) if before else None
+
+    if before:
+        # walk the index upwards from the cursor, then flip the rows back to newest first
+        created_at, product_id = before
+        rows = list(products.filter(**{field + '__gte': created_at}).exclude(**{field: created_at, 'id__lte': product_id})
+                    .order_by(field, 'id')[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if after:
+            created_at, product_id = after
+            products = products.filter(**{field + '__lte': created_at}).exclude(**{field: created_at, 'id__gte': product_id})
+        rows = list(products.order_by('-' + field, '-id')[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_previous = after is not None
+
+    return {
+        'products': rows,
+        'has_next': has_next and bool(rows),
+        'has_previous': has_previous and bool(rows),
+        'next_cursor': encode_cursor(rows[-1], field) if rows else None,
+        'previous_cursor': encode_cursor(rows[0], field) if rows else None,
+    }
+
+
+# Facet counts - products per category under the current price filter and products per price range
+# under the current category filter. Counting is proportional to the category size, so the counts
+# are cached under the catalog version (bumped on every Product/Category change).
+FACETS_KEY = 'store:facets:%s:%s:%s:%s'
+
+
+def facet_counts(category=None, min_price=None, max_price=None):
+    key = FACETS_KEY % (get_version('catalog'), category.id if category else '', min_price, max_price)
+    facets = cache.get(key)
+    if facets is not None:
+        return facets
+
+    with primary_reads():
+        per_category = dict(
+            filter_products(None, min_price, max_price).order_by().values_list('category').annotate(count=Count('id'))
+        )
+        categories = [dict(item, count=per_category.get(item['id'], 0)) for item in get_category_menu()]
+
+        buckets = {}
+        for i, (low, high) in enumerate(PRICE_RANGES):
+            condition = Q()
+            if low is not None:
+                condition &= Q(price__gte=low)
+            if high is not None:
+                condition &= Q(price__lt=high)
+            buckets['range_%d' % i] = Count('id', filter=condition)
+        counts = filter_products(category).order_by().aggregate(**buckets)
+    price_ranges = [
+        {'min': low, 'max': high, 'count': counts['range_%d' % i]}
+        for i, (low, high) in enumerate(PRICE_RANGES)
+    ]
+
+    facets = {'categories': categories, 'price_ranges': price_ranges}
+    cache.set(key, facets, settings.STORE_FACETS_TIMEOUT)
+    return facets
+
+
+# The query string of a listing as catalog_page reads it - snapped prices, the cursor that is used if it
+# is valid - for the page cache key (see cache_anonymous_page); other parameters don't change the page
+def catalog_query(request):
+    params = [
+        ('min_price', parse_min_price(request.GET.get('min_price'))),
+        ('max_price', parse_max_price(request.GET.get('max_price'))),
+    ]
+    for name in ('before', 'after'):
+        cursor = request.GET.get(name)
+        if cursor and decode_cursor(cursor):
+            params.append((name, cursor))
+            break
+    return urlencode([(name, value) for name, value in params if value is not None])
+
+
+# Everything the catalog listing template needs, from the request's query string
+def catalog_page(request, category=None):
+    min_price = parse_min_price(request.GET.get('min_price'))
+    max_price = parse_max_price(request.GET.get('max_price'))
+    products = filter_products(category, min_price, max_price)
+    page = paginate(products, after=request.GET.get('after'), before=request.GET.get('before'))
+    facets = facet_counts(category, min_price, max_price)
+
+    if category is not None:
+        total = next((c['count'] for c in facets['categories'] if c['id'] == category.id), 0)
+    else:
+        total = sum(c['count'] for c in facets['categories'])
+
+    # query string of the active filters, kept on pagination links
+    filters = '&'.join('%s=%s' % (name, value) for name, value in (('min_price', min_price), ('max_price', max_price)) if value is not None)
+    return dict(page, facets=facets, total=total, min_price=min_price, max_price=max_price, filters=filters)
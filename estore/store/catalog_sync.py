@@ -0,0 +1,239 @@
+import csv
+import itertools
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .cache import bump_version
+from .models import Category, Product
+from .search import optimize_search_index
+
+# Bulk catalog sync keyed by SKU, for `manage.py import_products` / `export_products`.
+# Both directions stream: exports read the table with a server side iterator, imports read the file
+# a batch at a time, so memory use does not depend on the size of the catalog. Every import batch is
+# one query for the products already stored under its SKUs and one upsert of the new and changed rows,
+# in its own transaction; unchanged rows are not written at all.
+# Categories are referenced by slug.
+
+FIELDS = ('sku', 'title', 'slug', 'category', 'short_description', 'detail_description', 'price', 'is_active', 'is_featured')
+FORMATS = ('csv', 'jsonl')
+
+# written rows after which the search index segments are merged
+OPTIMIZE_AFTER = 10000
+
+# values of a new product for the fields an import row leaves out (slug defaults to the title slugified)
+DEFAULTS = {'short_description': '', 'detail_description': None, 'is_active': True, 'is_featured': False}
+REQUIRED = ('title', 'category', 'price')
+SKU_LENGTH = Product._meta.get_field('sku').max_length
+UPSERT_COLUMNS = ['category_id' if field == 'category' else field for field in FIELDS]
+
+TRUE = {'1', 'true', 'yes', 'y', 't'}
+FALSE = {'0', 'false', 'no', 'n', 'f', ''}
+
+
+# Format from a file name, csv unless it ends in .jsonl/.ndjson
+def guess_format(path):
+    return 'jsonl' if str(path).lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+# (line number, row dict) of every product in a CSV (with a header) or JSON lines file; a JSON line that
+# does not parse comes as (line number, ValueError), for import_rows to report it with the invalid rows
+def read_rows(file, format):
+    if format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for number, line in enumerate(file, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, ValueError("invalid JSON: %s" % e)
+
+
+def export_rows(queryset=None, batch_size=2000):
+    queryset = Product.objects.all() if queryset is None else queryset
+    columns = ['category__slug' if field == 'category' else field for field in FIELDS]
+    for values in queryset.order_by('id').values_list(*columns).iterator(chunk_size=batch_size):
+        yield dict(zip(FIELDS, values))
+
+
+# Returns the number of rows written
+def write_rows(file, rows, format):
+    count = 0
+    if format == 'csv':
+        writer = csv.writer(file)
+        writer.writerow(FIELDS)
+        for count, row in enumerate(rows, 1):
+            writer.writerow(['' if row[field] is None else int(row[field]) if isinstance(row[field], bool) else row[field] for field in FIELDS])
+    else:
+        for count, row in enumerate(rows, 1):
+            file.write(json.dumps({field: str(value) if isinstance(value, Decimal) else value for field, value in row.items()}) + '\n')
+    return count
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE:
+        return True
+    if text in FALSE:
+        return False
+    raise ValueError("not a boolean: %r" % value)
+
+
+def parse_price(value):
+    try:
+        price = Decimal(str(value).strip()).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError("not a price: %r" % value)
+    if price < 0 or price >= 10 ** 6:
+        raise ValueError("price out of range: %s" % price)
+    return price
+
+
+# Field values of a product after applying an import row to what is stored (None for a new product).
+# Raises ValueError for rows that cannot be imported.
+def clean_row(row, stored, categories):
+    values = dict(stored) if stored else dict(DEFAULTS)
+    for field in FIELDS[1:]:
+        if field not in row:
+            continue
+        value = row[field]
+        if field == 'category':
+            if value not in categories:
+                raise ValueError("unknown category %r" % value)
+            values['category_id'] = categories[value]
+        elif field == 'price':
+            values['price'] = parse_price(value)
+        elif field in ('is_active', 'is_featured'):
+            values[field] = parse_bool(value)
+        elif field == 'detail_description':
+            values[field] = value or None
+        elif field == 'short_description':
+            values[field] = value or ''
+        else:
+            values[field] = str(value or '').strip()
+    if stored is None:
+        missing = [field for field in REQUIRED if not row.get(field)]
+        if missing:
+            raise ValueError("new product without %s" % ', '.join(missing))
+    if not values['title']:
+        raise ValueError("empty title")
+    values['slug'] = values.get('slug') or slugify(values['title'])[:200]
+    return values
+
+
+# {field: (old, new)} of the fields an import changes
+def changes(stored, values):
+    return {field: (stored[field], value) for field, value in values.items() if stored[field] != value}
+
+
+class BatchResult:
+    def __init__(self, number):
+        self.number = number
+        self.rows = 0
+        self.created = []       # skus
+        self.updated = []       # (sku, {field: (old, new)})
+        self.unchanged = 0
+        self.errors = []        # (line number, sku, message)
+        self.seconds = 0.0
+
+    @property
+    def written(self):
+        return len(self.created) + len(self.updated)
+
+    @property
+    def rate(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+# Insert or update products (field value dicts) in one transaction, with a plain executemany of
+# INSERT .. ON CONFLICT (sku) DO UPDATE: bulk_create(update_conflicts=True) splits a batch into
+# statements of a few dozen rows on SQLite and spends more time building them than running them.
+def upsert(products):
+    ops = connection.ops
+    table = Product._meta.db_table
+    columns = UPSERT_COLUMNS + ['created_at', 'updated_at']
+    sql = 'INSERT INTO %s (%s) VALUES (%s)%s' % (
+        ops.quote_name(table), ', '.join(ops.quote_name(column) for column in columns), ', '.join(['%s'] * len(columns)),
+        ops.on_conflict_suffix_sql([Product._meta.get_field(column) for column in columns], OnConflict.UPDATE,
+                                   [column for column in columns if column not in ('sku', 'created_at')], ['sku']),
+    )
+    now = ops.adapt_datetimefield_value(timezone.now())
+    rows = [
+        [ops.adapt_decimalfield_value(values['price'], 8, 2) if column == 'price' else values[column] for column in UPSERT_COLUMNS] + [now, now]
+        for values in products
+    ]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+# Import (line number, row) pairs `batch_size` at a time, yielding a BatchResult per batch.
+# With dry_run nothing is written; the results tell what an import would create and change.
+def import_rows(rows, batch_size=2000, dry_run=False):
+    categories = dict(Category.objects.values_list('slug', 'id'))
+    written = 0
+    rows = iter(rows)
+    for number in itertools.count(1):
+        start = time.perf_counter()
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        result = BatchResult(number)
+        result.rows = len(batch)
+
+        # the last row of a sku in the batch wins (one statement cannot upsert a row twice)
+        latest = {}
+        for line, row in batch:
+            if isinstance(row, ValueError):
+                result.errors.append((line, '', str(row)))
+                continue
+            if not isinstance(row, dict):
+                result.errors.append((line, '', "not an object: %s" % json.dumps(row)[:50]))
+                continue
+            sku = str(row.get('sku') or '').strip()
+            if not sku or len(sku) > SKU_LENGTH:
+                result.errors.append((line, sku, "missing sku" if not sku else "sku longer than %d characters" % SKU_LENGTH))
+            else:
+                latest[sku] = (line, row)
+        stored = {
+            values['sku']: values
+            for values in Product.objects.filter(sku__in=list(latest)).values(*UPSERT_COLUMNS)
+        }
+        products = []
+        for sku, (line, row) in latest.items():
+            try:
+                values = clean_row(row, stored.get(sku), categories)
+            except ValueError as e:
+                result.errors.append((line, sku, str(e)))
+                continue
+            values['sku'] = sku
+            if sku not in stored:
+                result.created.append(sku)
+            else:
+                changed = changes(stored[sku], values)
+                if not changed:
+                    result.unchanged += 1
+                    continue
+                result.updated.append((sku, changed))
+            products.append(values)
+
+        if products and not dry_run:
+            upsert(products)
+            written += len(products)
+            # bulk writes bypass the post_save signals that invalidate cached catalog pages; bumped
+            # per batch so that the pages show what is committed even if a later batch fails
+            bump_version('catalog')
+        result.seconds = time.perf_counter() - start
+        yield result
+
+    if written >= OPTIMIZE_AFTER:
+        optimize_search_index()
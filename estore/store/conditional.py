@@ -0,0 +1,128 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .cache import GUEST_CART_SESSION_KEY, get_version
+from .carts import get_cart
+from .models import Category, Product
+from .routers import primary_reads
+
+# Conditional GET and HTTP caching for the product and category pages.
+#
+# Responses carry a (weak) ETag and a Last-Modified date, and a request that sends them back
+# (If-None-Match / If-Modified-Since) while the page is unchanged is answered 304 Not Modified without
+# running the view. Last-Modified is the newest updated_at of the rows the page is about: the product and
+# its category, or the category and its products. The ETag covers the rest of the page as well: the
+# 'catalog' version (related products, facets and the category menu come from other rows, and every catalog
+# change bumps it), the query string, the logged in user and what the navbar shows the visitor. Browsers
+# and proxies send both validators and If-None-Match takes precedence, so Last-Modified alone is only
+# trusted by clients that ignore ETags.
+# The timestamps take one query and are cached under the catalog version, so a 304 usually costs no
+# database query at all.
+#
+# Anonymous visitors without a cart all get the same page, which a shared cache in front of the app (CDN,
+# reverse proxy) may serve for STORE_CATALOG_SHARED_MAX_AGE seconds; pages of logged in users and guests
+# with a cart are private. Browsers revalidate after STORE_CATALOG_MAX_AGE seconds.
+STATE_KEY = 'store:page-state:%s:%s:%s'
+
+
+# (product updated_at, category updated_at) of a product detail page, None for an unknown product
+def product_page_state(slug):
+    return Product.objects.filter(slug=slug).values_list('updated_at', 'category__updated_at').first()
+
+
+# (category updated_at, newest product updated_at) of a category listing, None for an unknown category;
+# the newest product is a single seek on product_category_updated_idx
+def category_page_state(slug):
+    newest = Product.objects.filter(category=OuterRef('pk')).order_by('-updated_at').values('updated_at')[:1]
+    return Category.objects.filter(slug=slug).annotate(products_updated_at=Subquery(newest)).values_list('updated_at', 'products_updated_at').first()
+
+
+def _personal(request):
+    return request.user.is_authenticated or GUEST_CART_SESSION_KEY in request.session
+
+
+# (etag, last modified timestamp, personal) of the requested page, None when the page has no state
+# (unknown product or category - the view raises the 404). Resolving request.user and the session may
+# query the database, so async views call this through sync_to_async.
+def _validators(request, name, page_state, args, kwargs):
+    version = get_version('catalog')
+    key = STATE_KEY % (version, name, hashlib.md5(repr((args, sorted(kwargs.items()))).encode()).hexdigest())
+    state = cache.get(key)
+    if state is None:
+        with primary_reads():
+            state = page_state(*args, **kwargs) or ()
+        cache.set(key, state, settings.STORE_PAGE_CACHE_TIMEOUT)
+    timestamps = [timestamp for timestamp in state if timestamp is not None]
+    if not timestamps:
+        return None
+
+    personal = _personal(request)
+    # the user, so that another user logging in from the same browser doesn't get their page
+    viewer = 'user:%s' % request.user.pk if request.user.is_authenticated else 'guest'
+    if personal:
+        viewer += ':%d' % get_cart(request).count()
+    parts = [name, request.get_full_path(), version, viewer] + [timestamp.isoformat() for timestamp in timestamps]
+    etag = 'W/"%s"' % hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+    return etag, int(max(timestamps).timestamp()), personal
+
+
+def _cache_headers(request, response, personal):
+    # a page that used the csrf token gets a cookie from the csrf middleware later on
+    uses_csrf = request.META.get('CSRF_COOKIE_NEEDS_UPDATE') or request.META.get('CSRF_COOKIE_USED')
+    if personal or response.cookies or uses_csrf:
+        patch_cache_control(response, private=True, max_age=settings.STORE_CATALOG_MAX_AGE)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.STORE_CATALOG_MAX_AGE,
+                            s_maxage=settings.STORE_CATALOG_SHARED_MAX_AGE)
+    patch_vary_headers(response, ('Cookie',))
+
+
+def _finish(request, response, validators):
+    etag, last_modified, personal = validators
+    if response.status_code in (200, 304):
+        if not response.has_header('ETag'):
+            response['ETag'] = etag
+        if not response.has_header('Last-Modified'):
+            response['Last-Modified'] = http_date(last_modified)
+        _cache_headers(request, response, personal)
+    return response
+
+
+# Conditional GET for a page whose state `page_state` (a function of the view arguments) returns;
+# see above. Goes outside cache_anonymous_page, so that a 304 does not even read the cached page.
+def conditional_page(name, page_state):
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _async_wrapped_view(request, *args, **kwargs):
+                if not settings.STORE_CONDITIONAL_PAGES or request.method not in ('GET', 'HEAD'):
+                    return await view_func(request, *args, **kwargs)
+                validators = await sync_to_async(_validators)(request, name, page_state, args, kwargs)
+                if validators is None:
+                    return await view_func(request, *args, **kwargs)
+                response = get_conditional_response(request, etag=validators[0], last_modified=validators[1])
+                if response is None:
+                    response = await view_func(request, *args, **kwargs)
+                return _finish(request, response, validators)
+            return _async_wrapped_view
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if not settings.STORE_CONDITIONAL_PAGES or request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+            validators = _validators(request, name, page_state, args, kwargs)
+            if validators is None:
+                return view_func(request, *args, **kwargs)
+            response = get_conditional_response(request, etag=validators[0], last_modified=validators[1])
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+            return _finish(request, response, validators)
+        return _wrapped_view
+    return decorator
@@ -1,19 +1,31 @@
-from .models import Category, Cart
+from .cache import aget_category_menu, get_category_menu
+from .carts import aget_cart, get_cart
+from .performance import timed
 
+# Navbar data for every page. Context processors run synchronously and the ORM cannot be used from the
+# event loop, so async views (store/async_views.py) load it ahead of rendering with aload_context().
 
+
+@timed
 def store_menu(request):
-    categories = Category.objects.filter(is_active=True)
+    store_context = getattr(request, 'store_context', None)
     context = {
-        'categories_menu': categories,
+        'categories_menu': store_context['categories_menu'] if store_context else get_category_menu(),
     }
     return context
 
+@timed
 def cart_menu(request):
-    if request.user.is_authenticated:
-        cart_items= Cart.objects.filter(user=request.user)
-        context = {
-            'cart_items': cart_items,
-        }
-    else:
-        context = {}
-    return context
\ No newline at end of file
+    store_context = getattr(request, 'store_context', None)
+    context = {
+        'cart_count': store_context['cart_count'] if store_context else get_cart(request).count(),
+    }
+    return context
+
+@timed
+async def aload_context(request):
+    cart = await aget_cart(request)
+    request.store_context = {
+        'categories_menu': await aget_category_menu(),
+        'cart_count': await cart.acount(),
+    }
@@ -0,0 +1,64 @@
+import os
+
+from django.conf import settings
+
+# The derivative files themselves, see images.py. The pool workers run generate_derivatives; they are
+# started with 'spawn' and import this module without setting Django up, so it must not import models
+# (or anything else that needs the app registry) - only settings, which configure themselves lazily.
+
+DERIVATIVES_DIR = 'derivatives'
+
+# variant name -> width in pixels (images are never upscaled)
+VARIANTS = {
+    'thumb': 160,
+    'card': 400,
+    'large': 800,
+}
+
+FORMATS = (
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+)
+
+
+def derivative_name(name, variant, ext):
+    stem = os.path.splitext(name)[0]
+    return '%s/%s-%dw.%s' % (DERIVATIVES_DIR, stem, VARIANTS[variant], ext)
+
+
+def derivative_path(name, variant, ext):
+    return os.path.join(settings.MEDIA_ROOT, derivative_name(name, variant, ext))
+
+
+# Create every derivative of one original (a name relative to MEDIA_ROOT) that is missing or older than
+# the original; returns the number of files written. Runs inside the pool workers, so it only takes
+# plain strings and imports Pillow lazily.
+def generate_derivatives(name, force=False):
+    from PIL import Image, ImageOps
+
+    source = os.path.join(settings.MEDIA_ROOT, name)
+    if not os.path.exists(source):
+        return 0
+    source_mtime = os.path.getmtime(source)
+
+    written = 0
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'L'):
+            original = original.convert('RGB')
+        for variant, width in VARIANTS.items():
+            resized = None
+            for ext, image_format, options in FORMATS:
+                target = derivative_path(name, variant, ext)
+                if not force and os.path.exists(target) and os.path.getmtime(target) >= source_mtime:
+                    continue
+                if resized is None:
+                    resized = original.copy()
+                    resized.thumbnail((width, width * 4), Image.LANCZOS)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # write to a temporary name first so a page never links a half written file
+                tmp = target + '.tmp'
+                resized.save(tmp, image_format, **options)
+                os.replace(tmp, target)
+                written += 1
+    return written
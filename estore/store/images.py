@@ -0,0 +1,82 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import bump_version, get_version
+from .derivatives import FORMATS, VARIANTS, derivative_name, derivative_path, generate_derivatives
+
+# Image derivatives - resized JPEG and WebP copies of the uploaded product and category images.
+# The originals are megabytes large while the pages show them at a few hundred pixels, so templates
+# pick the smallest variant that fits instead of the original (see the picture tag in store_tags.py).
+#
+# A derivative of media/product/backpack.jpg at 400px wide is stored as
+# media/derivatives/product/backpack-400w.webp (and .jpg). Generation runs in a process pool, either
+# after a model is saved or in bulk through `manage.py build_image_derivatives`; the files and the worker
+# are in derivatives.py.
+# Which derivatives exist is cached per image under the 'images' version, so rendering does not look at
+# the disk. Writing derivatives bumps it, and the 'catalog' version too, since pages and product cards
+# rendered in the meantime link the original.
+
+logger = logging.getLogger('store.images')
+VARIANTS_KEY = 'store:image-variants:%s:%s'
+
+
+# {ext: derivative name} of the derivatives of `name` at `variant` that exist
+def available_variants(name, variant):
+    key = VARIANTS_KEY % (get_version('images'), hashlib.md5(name.encode()).hexdigest())
+    found = cache.get(key)
+    if found is None:
+        found = {
+            (each, ext): derivative_name(name, each, ext)
+            for each in VARIANTS for ext, _, _ in FORMATS if os.path.exists(derivative_path(name, each, ext))
+        }
+        cache.set(key, found, settings.STORE_FRAGMENT_CACHE_TIMEOUT)
+    return {ext: derivative for (each, ext), derivative in found.items() if each == variant}
+
+
+# Derivatives were written: forget which ones were missing and re-render what linked the originals
+def derivatives_written():
+    bump_version('images')
+    bump_version('catalog')
+
+
+# A pool of worker processes for generate_derivatives. The workers are spawned, not forked: forking a
+# process with threads (the dev server, threaded WSGI servers) can deadlock the child, and 'spawn' is the
+# default on macOS and Windows anyway. Spawned workers start from a fresh interpreter without Django set
+# up, which is why the worker lives in derivatives.py.
+def new_executor(max_workers=None):
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+# Process pool used to generate derivatives off the request path; created on first use
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = new_executor(settings.STORE_IMAGE_WORKERS)
+    return _executor
+
+
+# called in the parent process when a scheduled job is over
+def _derivatives_done(name, future):
+    try:
+        written = future.result()
+    except Exception:
+        logger.exception("Generating the derivatives of %s failed", name)
+        return
+    if written:
+        derivatives_written()
+
+
+def schedule_derivatives(name):
+    if name and settings.STORE_IMAGE_DERIVATIVES_ON_SAVE:
+        future = get_executor().submit(generate_derivatives, name)
+        future.add_done_callback(partial(_derivatives_done, name))
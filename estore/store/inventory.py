@@ -0,0 +1,149 @@
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+# Inventory. Product.stock is the number of units that can still be sold (None: not tracked, no limit).
+# Stock only ever changes with conditional statements - UPDATE .. SET stock = stock - n WHERE stock >= n -
+# so concurrent buyers can never take more than there is, whatever the isolation level.
+#
+# Units in a logged in customer's cart are held for them: taken off the stock when carted and recorded
+# in a StockReservation that expires STORE_RESERVATION_MINUTES after the last change of the line.
+# `manage.py release_reservations` (run every minute or so) puts the units of expired reservations back,
+# a batch at a time. Checkout (views.place_order) turns the reservations of the cart into the sale and
+# takes whatever isn't held - expired and released holds, guest cart lines merged at checkout - in one
+# conditional UPDATE of all the products; if any line is short, nothing is sold.
+
+
+class OutOfStock(Exception):
+    # shortages: [(product id, title, units wanted, units available)]
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(', '.join(self.messages()))
+
+    def messages(self):
+        return [
+            "%s is sold out" % title if not available else "Only %d of %s left" % (available, title)
+            for _, title, _, available in self.shortages
+        ]
+
+
+def expiry():
+    return timezone.now() + datetime.timedelta(minutes=settings.STORE_RESERVATION_MINUTES)
+
+
+# CASE product id WHEN .. THEN n .. END for {product id: n}
+def per_product(quantities):
+    return Case(*[When(id=product_id, then=Value(n)) for product_id, n in quantities.items()], output_field=IntegerField())
+
+
+# Take {product id: units} of tracked products off the stock in one statement, or raise OutOfStock and
+# take nothing. Must run in a transaction: on a shortage the rows that were updated are only undone by
+# rolling it back.
+def take_stock(quantities):
+    quantities = {product_id: n for product_id, n in quantities.items() if n > 0}
+    if not quantities:
+        return
+    amount = per_product(quantities)
+    # untracked products match too (and stay NULL), so only real shortages fall short of the count
+    taken = (Product.objects.filter(Q(stock__isnull=True) | Q(stock__gte=amount), id__in=quantities)
+             .update(stock=F('stock') - amount))
+    if taken < len(quantities):
+        raise OutOfStock([
+            (product_id, title, quantities[product_id], stock)
+            for product_id, title, stock in Product.objects.filter(id__in=quantities).values_list('id', 'title', 'stock')
+            if stock is not None and stock < quantities[product_id]
+        ])
+
+
+def return_stock(quantities):
+    quantities = {product_id: n for product_id, n in quantities.items() if n > 0}
+    if quantities:
+        amount = per_product(quantities)
+        Product.objects.filter(id__in=quantities, stock__isnull=False).update(stock=F('stock') + amount)
+
+
+# Hold `quantity` more units of a product with tracked stock for a customer (a cart add)
+def reserve(user, product_id, quantity):
+    with transaction.atomic():
+        take_stock({product_id: quantity})
+        reservations = StockReservation.objects.filter(user=user, product_id=product_id)
+        if reservations.update(quantity=F('quantity') + quantity, expires_at=expiry()):
+            return
+        try:
+            with transaction.atomic():
+                StockReservation.objects.create(user=user, product_id=product_id, quantity=quantity, expires_at=expiry())
+        except IntegrityError:
+            # reserved by a concurrent request in the meantime
+            reservations.update(quantity=F('quantity') + quantity, expires_at=expiry())
+
+
+# Give back up to `quantity` (all when None) held units of a product (a cart line decremented or removed)
+def release(user, product_id, quantity=None):
+    with transaction.atomic():
+        reservation = StockReservation.objects.select_for_update().filter(user=user, product_id=product_id).first()
+        if reservation is None:
+            return
+        released = reservation.quantity if quantity is None else min(quantity, reservation.quantity)
+        if released == reservation.quantity:
+            reservation.delete()
+        else:
+            StockReservation.objects.filter(id=reservation.id).update(quantity=F('quantity') - released)
+        return_stock({product_id: released})
+
+
+# Remove a customer's reservations of the given products (all when None) and return {product id: units
+# held}; part of the checkout transaction. Locked first so that the sweeper, which skips locked rows,
+# can't release them at the same time (on databases with row locks; SQLite runs one write transaction at
+# a time).
+def claim_reservations(user, product_ids=None):
+    reservations = StockReservation.objects.select_for_update().filter(user=user)
+    if product_ids is not None:
+        reservations = reservations.filter(product_id__in=product_ids)
+    held = list(reservations.values_list('id', 'product_id', 'quantity'))
+    if held:
+        StockReservation.objects.filter(id__in=[reservation_id for reservation_id, _, _ in held]).delete()
+    return {product_id: quantity for _, product_id, quantity in held}
+
+
+# Sell `lines` ({product id: units} of the tracked products of a cart): the units held for the customer
+# count first, the rest is taken off the stock. Raises OutOfStock for lines that can't be filled.
+def sell(user, lines):
+    held = claim_reservations(user, list(lines))
+    take_stock({product_id: units - held.get(product_id, 0) for product_id, units in lines.items()})
+    # held for more than the cart has now (e.g. a line edited in the admin): the rest goes back
+    return_stock({product_id: units - lines[product_id] for product_id, units in held.items()})
+
+
+# Give back everything held for a customer (their account is deleted, which deletes the reservations)
+def release_all(user):
+    with transaction.atomic():
+        return_stock(claim_reservations(user))
+
+
+# Put the units of expired reservations back, `batch_size` reservations per transaction. Returns
+# (reservations, units) released.
+def release_expired(batch_size=1000, now=None):
+    now = now or timezone.now()
+    reservations = units = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                StockReservation.objects.select_for_update(skip_locked=True).filter(expires_at__lte=now)
+                .order_by('expires_at').values_list('id', 'product_id', 'quantity')[:batch_size]
+            )
+            if not batch:
+                break
+            quantities = defaultdict(int)
+            for _, product_id, quantity in batch:
+                quantities[product_id] += quantity
+            StockReservation.objects.filter(id__in=[reservation_id for reservation_id, _, _ in batch]).delete()
+            return_stock(quantities)
+        reservations += len(batch)
+        units += sum(quantities.values())
+    return reservations, units
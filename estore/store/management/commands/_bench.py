@@ -0,0 +1,252 @@
+# Shared helpers for the benchmark management commands.
+# Benchmarks run against a throwaway test database (the same one `manage.py test` would create)
+# so they never touch the data in db.sqlite3.
+import itertools
+import random
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection, transaction
+from django.db.models import Max
+from django.db.models.constants import OnConflict
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from store.models import STATUS_CHOICES, Address, Cart, Category, Order, OrderLine, Product
+
+
+# Create a fresh test database for the duration of the block and destroy it afterwards. Pass a file
+# `name` for concurrent writers: SQLite's shared in-memory test database locks whole tables.
+@contextmanager
+def test_database(verbosity=0, name=None):
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    if name:
+        connection.settings_dict['TEST']['NAME'] = name
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+# Run fn `repeat` times and return the list of durations in milliseconds
+def timed(fn, repeat=1):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# One line summary of a list of millisecond samples
+def summarize(samples):
+    return "mean {:8.2f} ms  p50 {:8.2f} ms  p99 {:8.2f} ms".format(
+        statistics.mean(samples), percentile(samples, 50), percentile(samples, 99))
+
+
+# Minimal catalog used by the benchmarks: one category and `count` products
+def make_products(count, prefix='bench'):
+    category, _ = Category.objects.get_or_create(
+        slug='%s-category' % prefix,
+        defaults={'title': 'Bench', 'is_active': True, 'is_featured': True},
+    )
+    Product.objects.bulk_create([
+        Product(category=category, title='%s product %d' % (prefix, i), slug='%s-product-%d' % (prefix, i),
+                sku='%s-%d' % (prefix, i), short_description='Benchmark product', price=Decimal('9.99'),
+                is_active=True, is_featured=True)
+        for i in range(count)
+    ])
+    return list(Product.objects.filter(category=category))
+
+
+def make_user(username='bench', password='bench-password'):
+    user = User.objects.create_user(username=username, password=password)
+    address = Address.objects.create(user=user, location='Home', street_address='1 Bench St', city='Bench', state='BE')
+    return user, address
+
+
+WORDS = ('black white red blue green leather canvas cotton wool denim silk classic vintage modern slim '
+         'relaxed casual formal sport running hiking winter summer kids mens womens shoe sneaker boot '
+         'sandal shirt turtleneck sweater jacket coat dress skirt jeans cap hat scarf backpack bag '
+         'headphones watch belt wallet converse oxford loafer hoodie').split()
+
+SYLLABLES = 'ka lo mi ra ven tor sel dar quin bre zu fal mon tek gor vis pra lu nex sha'.split()
+
+
+# A catalog vocabulary: the common descriptive words plus `size` made up brand/model names, so that
+# like in a real catalog most words are rare and a few are very frequent
+def vocabulary(rng, size=20000):
+    names = set()
+    while len(names) < size:
+        names.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(names)
+
+
+def sentence(rng, words, names, rare=0.5):
+    return ' '.join(rng.choice(names) if rng.random() < rare else rng.choice(WORDS) for _ in range(words))
+
+
+# Insert `rows` (tuples of database values for `columns`) with a plain executemany, `batch_size` rows
+# at a time, in one transaction. Building model instances for bulk_create costs more than the insert
+# itself at millions of rows.
+def insert_rows(model, columns, rows, batch_size=5000, ignore_conflicts=False):
+    on_conflict = OnConflict.IGNORE if ignore_conflicts else None
+    sql = '%s %s (%s) VALUES (%s)%s' % (
+        connection.ops.insert_statement(on_conflict=on_conflict), connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(column) for column in columns), ', '.join(['%s'] * len(columns)),
+        connection.ops.on_conflict_suffix_sql([], on_conflict, [], []),
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        for batch in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+            cursor.executemany(sql, batch)
+
+
+def db_datetime(value):
+    return connection.ops.adapt_datetimefield_value(value)
+
+
+def db_money(value):
+    return connection.ops.adapt_decimalfield_value(value, 12, 2)
+
+
+# Catalog of `count` products spread over `categories` categories with random descriptive text,
+# bulk inserted in batches
+def make_catalog(count, categories=50, batch_size=5000, seed=0, prefix='catalog'):
+    rng = random.Random(seed)
+    names = vocabulary(rng)
+    Category.objects.bulk_create([
+        Category(title='%s %d' % (rng.choice(WORDS).title(), i), slug='%s-category-%d' % (prefix, i), is_active=True, is_featured=i < 3)
+        for i in range(categories)
+    ])
+    category_ids = list(Category.objects.filter(slug__startswith='%s-category-' % prefix).values_list('id', flat=True))
+    now = db_datetime(timezone.now())
+    insert_rows(Product, (
+        'category_id', 'title', 'slug', 'sku', 'short_description', 'detail_description', 'price', 'is_active',
+        'is_featured', 'created_at', 'updated_at',
+    ), (
+        (category_ids[i % len(category_ids)], sentence(rng, 3, names).title(), '%s-product-%d' % (prefix, i),
+         '%s-%d' % (prefix.upper(), i), sentence(rng, 10, names, 0.7), sentence(rng, 25, names, 0.7),
+         '%d.%02d' % divmod(rng.randint(100, 50000), 100), rng.random() > 0.05, rng.random() < 0.01, now, now)
+        for i in range(count)
+    ), batch_size)
+    return names
+
+
+# `count` customers with one address each, all with the same password (hashing it per user would
+# dominate the run time)
+def make_users(count, batch_size=5000, prefix='customer', password='password'):
+    password = make_password(password)
+    now = db_datetime(timezone.now())
+    insert_rows(User, ('username', 'password', 'first_name', 'last_name', 'email', 'is_superuser', 'is_staff', 'is_active', 'date_joined'), (
+        ('%s-%d' % (prefix, i), password, '', '', '', False, False, True, now) for i in range(count)
+    ), batch_size)
+    user_ids = list(User.objects.filter(username__startswith='%s-' % prefix).values_list('id', flat=True))
+    insert_rows(Address, ('user_id', 'location', 'street_address', 'city', 'state'), (
+        (user_id, 'Home', '%d Synthetic St' % user_id, 'Springfield', 'ST') for user_id in user_ids
+    ), batch_size)
+    return user_ids
+
+
+# `count` cart lines of random customers and active products (a product at most once per cart)
+def make_carts(count, user_ids, product_ids, batch_size=5000, seed=0):
+    rng = random.Random(seed)
+    now = db_datetime(timezone.now())
+    insert_rows(Cart, ('user_id', 'product_id', 'quantity', 'created_at', 'updated_at'), (
+        (rng.choice(user_ids), rng.choice(product_ids), rng.randint(1, 3), now, now) for _ in range(count)
+    ), batch_size, ignore_conflicts=True)
+
+
+# `count` orders of random customers, placed over the past `days` days, of one to three products each
+# with a few popular products making up much of the sales, like a real shop. Orders are numbered here
+# so that their lines can be inserted along with them, `batch_size` orders at a time.
+def make_orders(count, user_ids, product_ids, batch_size=5000, seed=0, days=365):
+    rng = random.Random(seed)
+    addresses = dict(Address.objects.filter(user_id__in=user_ids).values_list('user_id', 'id'))
+    products = {
+        product_id: (category_id, title, price)
+        for product_id, category_id, title, price in Product.objects.filter(id__in=product_ids).values_list('id', 'category_id', 'title', 'price')
+    }
+    popular = product_ids[:max(1, len(product_ids) // 50)]
+    now = timezone.now()
+    statuses = [status for status, _ in STATUS_CHOICES]
+    next_id = (Order.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+    for start in range(0, count, batch_size):
+        orders, lines = [], []
+        for order_id in range(next_id + start, next_id + min(count, start + batch_size)):
+            user_id = rng.choice(user_ids)
+            total = 0
+            for product_id in rng.sample(product_ids, min(len(product_ids), rng.choice((1, 1, 1, 2, 3)))):
+                if rng.random() < 0.3:
+                    product_id = rng.choice(popular)
+                category_id, title, price = products[product_id]
+                quantity = rng.randint(1, 3)
+                total += price * quantity
+                lines.append((order_id, product_id, category_id, title, db_money(price), quantity, db_money(price * quantity)))
+            orders.append((order_id, user_id, addresses[user_id], rng.choice(statuses), db_money(total),
+                           db_datetime(now - timedelta(seconds=rng.randint(0, days * 86400)))))
+        insert_rows(Order, ('id', 'user_id', 'address_id', 'status', 'total', 'ordered_date'), iter(orders), batch_size)
+        insert_rows(OrderLine, ('order_id', 'product_id', 'category_id', 'title', 'unit_price', 'quantity', 'line_total'), iter(lines), batch_size)
+
+
+# A complete store: catalog, customers with addresses, carts and order history, all or nothing
+@transaction.atomic
+def make_dataset(users, categories, products, carts, orders, batch_size=5000, seed=0, prefix='synthetic'):
+    make_catalog(products, categories=categories, batch_size=batch_size, seed=seed, prefix=prefix)
+    user_ids = make_users(users, batch_size=batch_size, prefix=prefix)
+    product_ids = list(Product.objects.filter(slug__startswith='%s-product-' % prefix, is_active=True).values_list('id', flat=True))
+    if user_ids and product_ids:
+        make_carts(carts, user_ids, product_ids, batch_size=batch_size, seed=seed)
+        make_orders(orders, user_ids, product_ids, batch_size=batch_size, seed=seed)
+    return user_ids, product_ids
+
+
+# Session cookie of a logged in user, for requests made without the test client
+def login_cookie(user):
+    session = SessionStore()
+    session.update({SESSION_KEY: str(user.pk), BACKEND_SESSION_KEY: settings.AUTHENTICATION_BACKENDS[0],
+                    HASH_SESSION_KEY: user.get_session_auth_hash()})
+    session.save()
+    return '%s=%s' % (settings.SESSION_COOKIE_NAME, session.session_key)
+
+
+# One GET request through a WSGI application, as a WSGI server would make it.
+# Returns (status code, milliseconds).
+def wsgi_get(application, path, cookie=''):
+    path, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'testserver', 'HTTP_COOKIE': cookie,
+        'wsgi.input': BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0),
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    status = []
+    start = time.perf_counter()
+    response = application(environ, lambda s, headers, exc_info=None: status.append(s))
+    try:
+        for _ in response:
+            pass
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    return int(status[0].split()[0]), (time.perf_counter() - start) * 1000
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.sales import BACKFILL_BATCH_SIZE, backfill
+
+
+# Rebuild the sales rollups from the whole order history: once after deploying them, and after bulk
+# changes to orders made with QuerySet.update() (which the incremental updates don't see)
+#   python manage.py backfill_sales_rollups --batch-size 500000
+class Command(BaseCommand):
+    help = "Recompute the sales rollups (per day, category and status) from all orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE, help="orders read and summed per batch")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        def progress(counted):
+            if options['verbosity'] > 1:
+                self.stdout.write("%d orders, %.0f orders/s" % (counted, counted / (time.perf_counter() - start)))
+
+        orders, rows = backfill(options['batch_size'], progress)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS("%d orders summed into %d rollup rows in %.1f s (%.0f orders/s)" % (
+            orders, rows, elapsed, orders / elapsed if elapsed else 0)))
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.models import Category, Product
+from ._bench import login_cookie, make_catalog, make_user, percentile, test_database, wsgi_get
+
+MODES = {
+    # name: (STORE_ASYNC_VIEWS, handler)
+    'wsgi': ('0', 'wsgi'),
+    'asgi': ('1', 'asgi'),
+    'asgi-sync-views': ('0', 'asgi'),
+}
+
+
+# Catalog pages (home, categories, category listings, product details) under concurrent load: the WSGI
+# handler with the sync views on a thread pool, as a threaded WSGI server runs it, against the ASGI handler
+# with the async views on one event loop. Each mode runs in its own process (the views are picked when the
+# urls are loaded) on its own throwaway test database; requests are made by a logged in customer so
+# they are not answered from the anonymous page cache.
+#   python manage.py bench_asgi --requests 5000 --concurrency 64
+class Command(BaseCommand):
+    help = "Benchmark the catalog pages served by the WSGI (sync views) and ASGI (async views) handlers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--modes', default='wsgi,asgi,asgi-sync-views', help="comma separated: %s" % ', '.join(MODES))
+        parser.add_argument('--run', choices=sorted(MODES), help="run a single mode in this process (used internally)")
+
+    def handle(self, *args, **options):
+        if options['run']:
+            self.stdout.write(json.dumps(run(options['run'], options)))
+            return
+
+        self.stdout.write("%d requests, %d concurrent, %d products" % (options['requests'], options['concurrency'], options['products']))
+        for mode in options['modes'].split(','):
+            async_views, _ = MODES[mode]
+            command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_asgi', '--run', mode]
+            for name in ('requests', 'concurrency', 'products'):
+                command += ['--%s' % name, str(options[name])]
+            output = subprocess.run(command, env=dict(os.environ, STORE_ASYNC_VIEWS=async_views), check=True,
+                                    capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            self.stdout.write("%-16s %8.1f req/s  p50 %7.2f ms  p99 %7.2f ms  errors %d" % (
+                mode, result['rps'], result['p50'], result['p99'], result['errors']))
+
+
+def run(mode, options):
+    with test_database():
+        make_catalog(options['products'], categories=20)
+        user, _ = make_user()
+        cookie = login_cookie(user)
+
+        categories = list(Category.objects.values_list('slug', flat=True))
+        products = list(Product.objects.filter(is_active=True).values_list('slug', flat=True)[:500])
+        paths = []
+        for i in range(options['requests']):
+            kind = i % 4
+            if kind == 0:
+                paths.append('/')
+            elif kind == 1:
+                paths.append('/categories/')
+            elif kind == 2:
+                paths.append('/%s/' % categories[i % len(categories)])
+            else:
+                paths.append('/product/%s/' % products[i % len(products)])
+
+        _, handler = MODES[mode]
+        serve = run_wsgi if handler == 'wsgi' else run_asgi
+        # warm up templates, caches and connections before measuring
+        serve(paths[:options['concurrency']], cookie, options['concurrency'])
+        start = time.perf_counter()
+        samples, errors = serve(paths, cookie, options['concurrency'])
+        elapsed = time.perf_counter() - start
+        return {'rps': len(paths) / elapsed, 'p50': percentile(samples, 50), 'p99': percentile(samples, 99), 'errors': errors}
+
+
+def run_wsgi(paths, cookie, concurrency):
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+
+    def request(path):
+        status, ms = wsgi_get(application, path, cookie)
+        return ms, status == 200
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(request, paths))
+    return [ms for ms, _ in results], sum(1 for _, ok in results if not ok)
+
+
+def run_asgi(paths, cookie, concurrency):
+    from django.core.asgi import get_asgi_application
+    application = get_asgi_application()
+
+    async def request(path, semaphore):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        async with semaphore:
+            start = time.perf_counter()
+            await application(scope, receive, send)
+            return (time.perf_counter() - start) * 1000, status == [200]
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(request(path, semaphore) for path in paths))
+
+    results = asyncio.run(main())
+    return [ms for ms, _ in results], sum(1 for _, ok in results if not ok)
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from store.models import Cart, Order, OrderLine
+from store.views import place_order
+from ._bench import make_products, make_user, summarize, test_database, timed
+
+
+# Original checkout loop (a product lookup, an insert and a delete per cart line), kept for comparison
+def legacy_place_order(user, address):
+    order = Order.objects.create(user=user, address=address)
+    for cart_item in Cart.objects.filter(user=user):
+        product = cart_item.product
+        OrderLine(order=order, product=product, category_id=product.category_id, title=product.title, unit_price=product.price,
+                  quantity=cart_item.quantity, line_total=product.price * cart_item.quantity).save()
+        order.total += product.price * cart_item.quantity
+        cart_item.delete()
+    order.save()
+
+
+# Checkout latency and query count vs. cart size, run against a throwaway test database
+#   python manage.py bench_checkout --sizes 1 10 100 --repeat 20
+class Command(BaseCommand):
+    help = "Benchmark checkout latency and query count for different cart sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1, 10, 100])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        sizes = options['sizes']
+        repeat = options['repeat']
+        with test_database():
+            products = make_products(max(sizes))
+            user, address = make_user()
+            client = Client()
+            client.force_login(user)
+            url = '%s?address=%d' % (reverse('store:checkout'), address.id)
+
+            def fill_cart(size):
+                Cart.objects.bulk_create([Cart(user=user, product=product) for product in products[:size]])
+
+            for size in sizes:
+                for label, run in (
+                    ('legacy', lambda: legacy_place_order(user, address)),
+                    ('bulk', lambda: place_order(user, address)),
+                    ('view', lambda: client.get(url)),
+                ):
+                    samples = []
+                    for _ in range(repeat):
+                        fill_cart(size)
+                        samples += timed(run)
+                    fill_cart(size)
+                    with CaptureQueriesContext(connection) as queries:
+                        run()
+                    self.stdout.write("{:>4} lines  {:<6} {:>4} queries  {}".format(
+                        size, label, len(queries), summarize(samples)))
@@ -0,0 +1,120 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from store.models import Address, Category, Product
+from ._bench import login_cookie, make_dataset, percentile, test_database, wsgi_get
+
+MODES = {
+    # name: (STORE_DB_PROFILE, catalog reads from a replica alias)
+    'basic': ('basic', False),
+    'tuned': ('tuned', False),
+    'tuned-replica': ('tuned', True),
+}
+
+
+# Catalog readers against checkout writers on a file database: `--readers` threads browse catalog
+# pages while `--writers` threads add to cart and check out, for `--seconds`, through the WSGI handler.
+# Compares the database profiles of settings.py (basic: rollback journal, new connection per request;
+# tuned: WAL, pragmas, immediate transactions, persistent connections) and the catalog replica routing
+# (here the "replica" is the primary's file opened by separate read only connections). Each mode runs
+# in its own process on its own throwaway database.
+#   python manage.py bench_database --readers 8 --writers 4 --seconds 15
+class Command(BaseCommand):
+    help = "Benchmark catalog read throughput under concurrent checkouts for each database profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--modes', default=','.join(MODES), help="comma separated: %s" % ', '.join(MODES))
+        parser.add_argument('--run', choices=sorted(MODES), help="run a single mode in this process (used internally)")
+        parser.add_argument('--database', help="database file of the single mode (used internally)")
+
+    def handle(self, *args, **options):
+        if options['run']:
+            self.stdout.write(json.dumps(run(options)))
+            return
+
+        self.stdout.write("%d readers, %d writers, %.0f s, %d products" % (
+            options['readers'], options['writers'], options['seconds'], options['products']))
+        for mode in options['modes'].split(','):
+            profile, replica = MODES[mode]
+            with tempfile.TemporaryDirectory() as tmp:
+                database = str(Path(tmp) / 'bench.sqlite3')
+                env = dict(os.environ, STORE_DB_PROFILE=profile, STORE_DB_REPLICA=database if replica else '')
+                command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_database', '--run', mode, '--database', database]
+                for name in ('readers', 'writers', 'seconds', 'products'):
+                    command += ['--%s' % name, str(options[name])]
+                output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            self.stdout.write("%-14s reads %7.1f/s  p50 %7.2f ms  p99 %8.2f ms  errors %4d | checkouts %6.1f/s  p99 %8.2f ms  errors %4d" % (
+                mode, result['read_rps'], result['read_p50'], result['read_p99'], result['read_errors'],
+                result['write_rps'], result['write_p99'], result['write_errors']))
+
+
+def run(options):
+    with test_database(name=options['database']):
+        readers, writers = options['readers'], options['writers']
+        make_dataset(readers + writers, 20, options['products'], 0, 0, prefix='bench')
+        users = list(User.objects.filter(username__startswith='bench-').order_by('id'))
+        addresses = dict(Address.objects.values_list('user_id', 'id'))
+        categories = list(Category.objects.values_list('slug', flat=True))
+        products = list(Product.objects.filter(is_active=True).values_list('id', 'slug')[:1000])
+        cookies = [login_cookie(user) for user in users]
+
+        from django.core.wsgi import get_wsgi_application
+        application = get_wsgi_application()
+        stop = threading.Event()
+
+        def reader(i):
+            samples, errors, n = [], 0, i
+            while not stop.is_set():
+                n += 1
+                kind = n % 3
+                path = '/' if kind == 0 else '/%s/' % categories[n % len(categories)] if kind == 1 else '/product/%s/' % products[n % len(products)][1]
+                status, ms = wsgi_get(application, path, cookies[i])
+                samples.append(ms)
+                errors += status != 200
+            connections.close_all()
+            return samples, errors
+
+        def writer(i):
+            cookie, address_id = cookies[readers + i], addresses[users[readers + i].id]
+            samples, errors, n = [], 0, i
+            while not stop.is_set():
+                n += 1
+                start = time.perf_counter()
+                added, _ = wsgi_get(application, '/add-to-cart/?prod_id=%d' % products[n % len(products)][0], cookie)
+                checked_out, _ = wsgi_get(application, '/checkout/?address=%d' % address_id, cookie)
+                samples.append((time.perf_counter() - start) * 1000)
+                errors += added >= 400 or checked_out >= 400
+            connections.close_all()
+            return samples, errors
+
+        with ThreadPoolExecutor(max_workers=readers + writers) as executor:
+            futures = [executor.submit(reader, i) for i in range(readers)] + [executor.submit(writer, i) for i in range(writers)]
+            time.sleep(options['seconds'])
+            stop.set()
+            results = [future.result() for future in futures]
+
+        reads = [ms for samples, _ in results[:readers] for ms in samples]
+        writes = [ms for samples, _ in results[readers:] for ms in samples]
+        return {
+            'read_rps': len(reads) / options['seconds'], 'read_p50': percentile(reads, 50), 'read_p99': percentile(reads, 99),
+            'read_errors': sum(errors for _, errors in results[:readers]),
+            'write_rps': len(writes) / options['seconds'], 'write_p99': percentile(writes, 99),
+            'write_errors': sum(errors for _, errors in results[readers:]),
+        }
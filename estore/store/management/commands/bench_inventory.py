@@ -0,0 +1,113 @@
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Sum
+
+from store.carts import DatabaseCart
+from store.inventory import OutOfStock
+from store.models import Address, Cart, Order, OrderLine, Product, StockReservation
+from store.views import place_order
+from ._bench import make_products, make_users, percentile, test_database
+
+MODES = ('naive', 'reserved')
+
+
+# Check-then-write checkout, kept for comparison: the stock is read, checked and written back
+# decremented by the application, so buyers who read it at the same time all get the same unit
+def naive_buy(user, address, product, quantity):
+    stock = Product.objects.filter(id=product.id).values_list('stock', flat=True).get()
+    if stock < quantity:
+        raise OutOfStock([(product.id, product.title, quantity, stock)])
+    with transaction.atomic():
+        Product.objects.filter(id=product.id).update(stock=stock - quantity)
+        order = Order.objects.create(user=user, address=address, total=product.price * quantity)
+        OrderLine.objects.create(order=order, product=product, title=product.title, unit_price=product.price,
+                                 quantity=quantity, line_total=product.price * quantity)
+
+
+# The store's path: the cart add holds the units (conditional update), checkout sells them
+def reserved_buy(user, address, product, quantity):
+    DatabaseCart(user).add(product.id, quantity)
+    place_order(user, address)
+
+
+# Flash sale contention: `--buyers` threads, each a logged in customer, keep buying `--quantity` units of
+# one hot product with `--stock` units until it is sold out (or `--attempts` each), on a file database
+# with the configured profile. Reports the units sold against the stock - anything over it was oversold -
+# and the checkout throughput and latency, for the naive check-then-write checkout and the store's
+# reservations and conditional updates. Without overselling, sold + left + held is the stock.
+#   python manage.py bench_inventory --buyers 64 --stock 500
+class Command(BaseCommand):
+    help = "Benchmark checkouts of many buyers competing for one product and check for overselling"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=32)
+        parser.add_argument('--stock', type=int, default=200)
+        parser.add_argument('--quantity', type=int, default=1, help="units per purchase")
+        parser.add_argument('--attempts', type=int, default=100, help="purchases tried per buyer at most")
+        parser.add_argument('--modes', default=','.join(MODES), help="comma separated: %s" % ', '.join(MODES))
+
+    def handle(self, *args, **options):
+        modes = options['modes'].split(',')
+        if set(modes) - set(MODES):
+            raise CommandError("Unknown modes: %s" % ', '.join(sorted(set(modes) - set(MODES))))
+        self.stdout.write("%d buyers, %d units in stock, %d per purchase" % (options['buyers'], options['stock'], options['quantity']))
+        with tempfile.TemporaryDirectory() as tmp, test_database(name=str(Path(tmp) / 'bench.sqlite3')):
+            product = make_products(1, prefix='hot')[0]
+            user_ids = make_users(options['buyers'], prefix='buyer')
+            buyers = [(address.user, address) for address in Address.objects.filter(user_id__in=user_ids).select_related('user')]
+            for mode in modes:
+                result = run(mode, product, buyers, options)
+                self.stdout.write(
+                    "{mode:<9} sold {sold:>5}/{stock}  oversold {oversold:>4}  left {left:>4}  held {held:>4}  "
+                    "{rps:7.1f} checkouts/s  p50 {p50:7.2f} ms  p99 {p99:8.2f} ms  sold out {sold_out:>5}  errors {errors}".format(
+                        mode=mode, stock=options['stock'], **result))
+
+
+def run(mode, product, buyers, options):
+    OrderLine.objects.all().delete()
+    Order.objects.all().delete()
+    Cart.objects.all().delete()
+    StockReservation.objects.all().delete()
+    Product.objects.filter(id=product.id).update(stock=options['stock'])
+    buy = naive_buy if mode == 'naive' else reserved_buy
+    quantity = options['quantity']
+    start_line = threading.Barrier(len(buyers))
+
+    def buyer(user, address):
+        samples, sold_out, errors = [], 0, 0
+        start_line.wait()
+        for _ in range(options['attempts']):
+            start = time.perf_counter()
+            try:
+                buy(user, address, product, quantity)
+            except OutOfStock:
+                sold_out += 1
+                break
+            except Exception:
+                errors += 1
+                continue
+            samples.append((time.perf_counter() - start) * 1000)
+        connections.close_all()
+        return samples, sold_out, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(buyers)) as executor:
+        results = list(executor.map(lambda buyer_: buyer(*buyer_), buyers))
+    elapsed = time.perf_counter() - start
+
+    samples = [ms for result, _, _ in results for ms in result]
+    sold = OrderLine.objects.filter(product=product).aggregate(units=Sum('quantity'))['units'] or 0
+    return {
+        'sold': sold, 'oversold': max(0, sold - options['stock']),
+        'left': Product.objects.filter(id=product.id).values_list('stock', flat=True).get(),
+        # in the carts of buyers whose checkout failed
+        'held': StockReservation.objects.filter(product=product).aggregate(units=Sum('quantity'))['units'] or 0,
+        'rps': len(samples) / elapsed, 'p50': percentile(samples, 50), 'p99': percentile(samples, 99),
+        'sold_out': sum(sold_out for _, sold_out, _ in results), 'errors': sum(errors for _, _, errors in results),
+    }
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from store.search import icontains_search, optimize_search_index, search_products
+from ._bench import make_catalog, summarize, test_database, timed
+
+
+# FTS5 search vs. the naive icontains filters on a synthetic catalog in a throwaway test database
+#   python manage.py bench_search --products 500000
+class Command(BaseCommand):
+    help = "Benchmark full text product search against icontains filtering"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--limit', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with test_database():
+            self.stdout.write("Generating %d products..." % options['products'])
+            names = make_catalog(options['products'])
+            optimize_search_index()
+            # common words, rare brand/model names, partially typed words and mixes of them
+            queries = ['converse', 'black leather boot', 'win', names[100], names[200][:4], 'kids %s' % names[300], 'vintage wool coat']
+            for query in queries:
+                fts = timed(lambda: search_products(query, limit=options['limit']), options['repeat'])
+                naive = timed(lambda: list(icontains_search(query)[:options['limit']]), options['repeat'])
+                self.stdout.write("%-20s fts5     %s" % (query, summarize(fts)))
+                self.stdout.write("%-20s icontains %s" % ('', summarize(naive)))
@@ -0,0 +1,53 @@
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from store.performance import collect
+from ._bench import make_products, make_user, summarize, test_database, timed
+
+MODES = {
+    # name: (SESSION_ENGINE, STORE_USER_CACHE_TIMEOUT)
+    'db': ('django.contrib.sessions.backends.db', 0),
+    'cached_db': ('django.contrib.sessions.backends.cached_db', 0),
+    'cached_db+user': ('django.contrib.sessions.backends.cached_db', 300),
+}
+
+
+# Queries and latency per request of a logged in customer for each way of loading the session and
+# request.user: sessions in the database, sessions in the cache (falling back to the database) and
+# additionally the user from the user cache. Run against a throwaway test database.
+#   python manage.py bench_sessions --repeat 200
+class Command(BaseCommand):
+    help = "Benchmark the session and authenticated user loading per request"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--modes', default=','.join(MODES), help="comma separated: %s" % ', '.join(MODES))
+
+    def handle(self, *args, **options):
+        with test_database():
+            products = make_products(50)
+            user, _ = make_user()
+            paths = [
+                reverse('store:all-categories'),
+                reverse('store:category-products', args=[products[0].category.slug]),
+                reverse('store:product-detail', args=[products[0].slug]),
+                reverse('store:cart'),
+                reverse('store:profile'),
+            ]
+            for mode in options['modes'].split(','):
+                engine, user_timeout = MODES[mode]
+                with override_settings(SESSION_ENGINE=engine, STORE_USER_CACHE_TIMEOUT=user_timeout):
+                    for alias in ('default', 'sessions'):
+                        caches[alias].clear()
+                    client = Client()
+                    client.force_login(user)
+                    for path in paths:
+                        # first request warms the session, user and page caches
+                        client.get(path)
+                        with collect() as stats:
+                            client.get(path)
+                        samples = timed(lambda: client.get(path), options['repeat'])
+                        self.stdout.write("{:<15} {:<28} {:>3} queries  {}".format(
+                            mode, path, len(stats.queries), summarize(samples)))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.derivatives import generate_derivatives
+from store.images import derivatives_written, new_executor
+from store.models import Category, Product
+
+
+# Backfill the resized image variants for every product and category image
+#   python manage.py build_image_derivatives --workers 4
+class Command(BaseCommand):
+    help = "Generate thumbnail, responsive JPEG and WebP variants of product and category images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: one per CPU)")
+        parser.add_argument('--force', action='store_true', help="regenerate variants that are already up to date")
+
+    def handle(self, *args, **options):
+        names = set(Product.objects.exclude(product_image='').exclude(product_image=None).values_list('product_image', flat=True))
+        names |= set(Category.objects.exclude(category_image='').exclude(category_image=None).values_list('category_image', flat=True))
+        names = sorted(names)
+
+        start = time.perf_counter()
+        written = 0
+        with new_executor(options['workers']) as executor:
+            for name, count in zip(names, executor.map(generate_derivatives, names, [options['force']] * len(names))):
+                written += count
+                if options['verbosity'] > 1:
+                    self.stdout.write("%s: %d files" % (name, count))
+        if written:
+            derivatives_written()
+        self.stdout.write(self.style.SUCCESS("%d images, %d derivative files written in %.1fs" % (len(names), written, time.perf_counter() - start)))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.catalog_sync import FORMATS, export_rows, guess_format, write_rows
+from store.models import Product
+
+
+# Write the catalog (or one category of it) as CSV or JSON lines, streamed from the database:
+#   python manage.py export_products products.csv
+#   python manage.py export_products --format jsonl --category shoes > shoes.jsonl
+class Command(BaseCommand):
+    help = "Export products, keyed by SKU, to a CSV or JSON lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="output file, - for stdout (the default)")
+        parser.add_argument('--format', choices=FORMATS, help="default: from the file extension, csv for stdout")
+        parser.add_argument('--category', help="only the products of the category with this slug")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        queryset = Product.objects.all()
+        if options['category']:
+            queryset = queryset.filter(category__slug=options['category'])
+        start = time.perf_counter()
+        rows = export_rows(queryset, options['batch_size'])
+        if path == '-':
+            count = write_rows(self.stdout, rows, format)
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as file:
+                count = write_rows(file, rows, format)
+        elapsed = time.perf_counter() - start
+        # stderr, so the summary does not end up in an export written to stdout
+        self.stderr.write("Exported %d products in %.1f s (%.0f rows/s)" % (count, elapsed, count / elapsed if elapsed else 0),
+                          style_func=self.style.SUCCESS)
+
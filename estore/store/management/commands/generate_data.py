@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from store.search import optimize_search_index
+from ._bench import make_dataset
+
+
+# Fill the configured database with a synthetic store: categories, products, customers with an
+# address each, carts and a year of orders, bulk inserted in batches. Run it again with another
+# --prefix to add more data next to an earlier run.
+#   python manage.py generate_data --users 100000 --products 1000000 --orders 2000000
+class Command(BaseCommand):
+    help = "Generate a synthetic dataset (customers, catalog, carts, orders) in the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--carts', type=int, default=2000, help="cart lines")
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='synthetic', help="prefix of the generated usernames, slugs and SKUs")
+
+    def handle(self, *args, **options):
+        if options['categories'] < 1:
+            raise CommandError("At least one category is needed")
+        start = time.perf_counter()
+        try:
+            user_ids, product_ids = make_dataset(
+                options['users'], options['categories'], options['products'], options['carts'], options['orders'],
+                batch_size=options['batch_size'], seed=options['seed'], prefix=options['prefix'],
+            )
+        except IntegrityError as e:
+            raise CommandError("%s - was the data generated before? Use another --prefix" % e)
+        # merge the search index segments written by the product inserts
+        optimize_search_index()
+        elapsed = time.perf_counter() - start
+        rows = options['categories'] + options['products'] + 2 * len(user_ids) + options['carts'] + options['orders']
+        self.stdout.write(self.style.SUCCESS("Generated %d customers, %d products (%d active), %d cart lines and %d orders "
+                                             "in %.1f s (%.0f rows/s)" % (
+            len(user_ids), options['products'], len(product_ids), options['carts'], options['orders'],
+            elapsed, rows / elapsed)))
@@ -0,0 +1,76 @@
+import csv
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog_sync import FIELDS, FORMATS, guess_format, import_rows, read_rows
+
+
+# Create and update products from a CSV or JSON lines file, matched on SKU (the columns of
+# export_products; rows of existing products may leave out the columns that do not change).
+# --dry-run writes nothing and prints what would change instead.
+#   python manage.py import_products nightly.csv --batch-size 5000
+#   python manage.py import_products nightly.jsonl --dry-run
+class Command(BaseCommand):
+    help = "Import products from a CSV or JSON lines file, creating or updating them by SKU"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="input file, - for stdin")
+        parser.add_argument('--format', choices=FORMATS, help="default: from the file extension, csv for stdin")
+        parser.add_argument('--batch-size', type=int, default=2000, help="rows per query and transaction")
+        parser.add_argument('--dry-run', action='store_true', help="report the changes without writing them")
+        parser.add_argument('--max-errors', type=int, default=20, help="invalid rows listed in the output")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        try:
+            file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(e)
+
+        totals = {'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'errors': 0}
+        errors = []
+        start = time.perf_counter()
+        with file:
+            if format == 'csv':
+                self.check_header(file)
+            for result in import_rows(read_rows(file, format), options['batch_size'], options['dry_run']):
+                totals['rows'] += result.rows
+                totals['created'] += len(result.created)
+                totals['updated'] += len(result.updated)
+                totals['unchanged'] += result.unchanged
+                totals['errors'] += len(result.errors)
+                errors += result.errors[:options['max_errors'] - len(errors)]
+                if options['dry_run']:
+                    self.print_diff(result)
+                self.stdout.write("batch %d: %d rows, %d created, %d updated, %d unchanged, %d errors in %.2f s (%.0f rows/s)" % (
+                    result.number, result.rows, len(result.created), len(result.updated), result.unchanged,
+                    len(result.errors), result.seconds, result.rate))
+        elapsed = time.perf_counter() - start
+
+        for line, sku, message in errors:
+            self.stderr.write("line %d %s: %s" % (line, sku, message))
+        summary = "%s%d rows in %.1f s (%.0f rows/s): %d created, %d updated, %d unchanged, %d errors" % (
+            "Dry run, nothing written. " if options['dry_run'] else "", totals['rows'], elapsed,
+            totals['rows'] / elapsed if elapsed else 0, totals['created'], totals['updated'], totals['unchanged'], totals['errors'])
+        self.stdout.write(self.style.WARNING(summary) if totals['errors'] else self.style.SUCCESS(summary))
+
+    def check_header(self, file):
+        if file.seekable():
+            header = file.readline()
+            file.seek(0)
+            columns = set(next(csv.reader([header]), []))
+            if 'sku' not in columns:
+                raise CommandError("The CSV header has no sku column")
+            unknown = columns - set(FIELDS)
+            if unknown:
+                raise CommandError("Unknown columns: %s" % ', '.join(sorted(unknown)))
+
+    def print_diff(self, result):
+        for sku in result.created:
+            self.stdout.write("+ %s" % sku)
+        for sku, changed in result.updated:
+            for field, (old, new) in changed.items():
+                self.stdout.write("~ %s %s: %r -> %r" % (sku, field, old, new))
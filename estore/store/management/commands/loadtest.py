@@ -0,0 +1,112 @@
+import logging
+import random
+import statistics
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+from contextlib import nullcontext
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+
+from store.models import Category, Product
+from ._bench import login_cookie, make_dataset, percentile, test_database, wsgi_get
+
+ROUTES = ('home', 'category', 'detail', 'add-to-cart', 'cart', 'checkout', 'orders')
+
+
+# Load test of the shop through the real URL routes and middleware (the WSGI handler, as a threaded
+# WSGI server runs it). Each virtual user is a logged in customer going through a shopping session,
+# home -> category -> product -> add to cart -> cart -> checkout -> order history, `--iterations` times;
+# `--concurrency` of them run at once. Reports throughput and latency percentiles per route.
+# By default it runs on a throwaway test database filled like generate_data does; --existing runs it
+# against the configured database instead (checkouts place real orders there).
+#   python manage.py loadtest --concurrency 16 --virtual-users 64 --iterations 5
+class Command(BaseCommand):
+    help = "Drive concurrent shopping sessions through the store's URL routes and report latency percentiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--virtual-users', type=int, default=32)
+        parser.add_argument('--iterations', type=int, default=3, help="shopping sessions per virtual user")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--existing', action='store_true', help="use the configured database and its data")
+        # size of the generated dataset (ignored with --existing)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--orders', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp, \
+                nullcontext() if options['existing'] else test_database(name=str(Path(tmp) / 'loadtest.sqlite3')):
+            if not options['existing']:
+                self.stdout.write("Generating %d customers, %d products, %d orders..." % (
+                    options['users'], options['products'], options['orders']))
+                make_dataset(options['users'], options['categories'], options['products'], 0, options['orders'],
+                             seed=options['seed'])
+            results, elapsed = run(options)
+        self.report(results, elapsed, options)
+
+    def report(self, results, elapsed, options):
+        self.stdout.write("%d virtual users x %d sessions, %d concurrent: %d requests in %.1f s, %.1f req/s" % (
+            options['virtual_users'], options['iterations'], options['concurrency'], len(results), elapsed,
+            len(results) / elapsed))
+        by_route = defaultdict(list)
+        for route, status, ms in results:
+            by_route[route].append((status, ms))
+        self.stdout.write("{:<12} {:>7} {:>6} {:>9} {:>9} {:>9} {:>9}".format('route', 'count', 'errors', 'mean', 'p50', 'p90', 'p99'))
+        for route in ROUTES + ('all',):
+            rows = [(status, ms) for _, status, ms in results] if route == 'all' else by_route[route]
+            if not rows:
+                continue
+            samples = [ms for _, ms in rows]
+            errors = sum(1 for status, _ in rows if status >= 400)
+            self.stdout.write("{:<12} {:>7} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                route, len(rows), errors, statistics.mean(samples),
+                percentile(samples, 50), percentile(samples, 90), percentile(samples, 99)))
+
+
+def run(options):
+    users = list(User.objects.filter(address__isnull=False).distinct().prefetch_related('address_set')[:options['virtual_users']])
+    categories = list(Category.objects.filter(is_active=True).values_list('slug', flat=True))
+    products = list(Product.objects.filter(is_active=True, category__is_active=True).values_list('id', 'slug', 'category__slug')[:5000])
+    if not users or not products:
+        raise CommandError("The load test needs customers with an address and active products, see generate_data")
+    sessions = [(login_cookie(user), user.address_set.all()[0].id, random.Random(options['seed'] + i))
+                for i, user in enumerate(users)]
+
+    application = get_wsgi_application()
+    # errors are counted in the report; their tracebacks and slow request warnings only with -v 2
+    if options['verbosity'] < 2:
+        for name in ('django.request', 'store.performance'):
+            logging.getLogger(name).setLevel(logging.CRITICAL)
+
+    def shop(session):
+        cookie, address_id, rng = session
+        results = []
+
+        def get(route, path):
+            status, ms = wsgi_get(application, path, cookie)
+            results.append((route, status, ms))
+
+        for _ in range(options['iterations']):
+            product_id, slug, category = rng.choice(products)
+            get('home', '/')
+            get('category', '/%s/' % (category if rng.random() < 0.8 else rng.choice(categories)))
+            get('detail', '/product/%s/' % slug)
+            get('add-to-cart', '/add-to-cart/?prod_id=%d' % product_id)
+            get('cart', '/cart/')
+            get('checkout', '/checkout/?address=%d' % address_id)
+            get('orders', '/orders/')
+        return results
+
+    # one request per virtual user first, to load templates and fill the caches
+    with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+        list(executor.map(lambda session: wsgi_get(application, '/', session[0]), sessions[:options['concurrency']]))
+        start = time.perf_counter()
+        results = [result for session_results in executor.map(shop, sessions) for result in session_results]
+    return results, time.perf_counter() - start
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.recommendations import refresh_recommendations
+
+
+# Refresh the related products shown on the product pages from the order history, e.g. from cron:
+#   python manage.py refresh_recommendations          (only products affected by orders since the last run)
+#   python manage.py refresh_recommendations --full   (every active product)
+class Command(BaseCommand):
+    help = "Precompute the related products (bought together / same category) of every product"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="recompute every active product instead of the ones affected by new orders")
+        parser.add_argument('--limit', type=int, default=None, help="related products kept per product (default: STORE_RELATED_PRODUCTS)")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        products, rows = refresh_recommendations(full=options['full'], limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS("%d products refreshed, %d related products written in %.1fs" % (products, rows, time.perf_counter() - start)))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.inventory import release_expired
+
+
+# Put the stock held by expired cart reservations back on sale, e.g. from cron every minute:
+#   python manage.py release_reservations
+#   python manage.py release_reservations --every 30   (keep running, one sweep every 30 seconds)
+class Command(BaseCommand):
+    help = "Release the stock of expired cart reservations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="reservations released per transaction")
+        parser.add_argument('--every', type=float, default=0, help="sweep again every N seconds instead of exiting")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            reservations, units = release_expired(options['batch_size'])
+            if reservations or options['verbosity'] > 1:
+                self.stdout.write(self.style.SUCCESS("%d expired reservations released, %d units back in stock in %.2fs" % (
+                    reservations, units, time.perf_counter() - start)))
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:13
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+# merge duplicate (user, product) cart lines into the oldest one before adding the unique constraint
+def merge_duplicate_cart_lines(apps, schema_editor):
+    Cart = apps.get_model('store', 'Cart')
+    duplicates = (Cart.objects.values('user_id', 'product_id')
+                  .annotate(lines=Count('id'), keep_id=Min('id'), quantity=Sum('quantity'))
+                  .filter(lines__gt=1))
+    for duplicate in duplicates:
+        Cart.objects.filter(id=duplicate['keep_id']).update(quantity=duplicate['quantity'])
+        Cart.objects.filter(user_id=duplicate['user_id'], product_id=duplicate['product_id']).exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_alter_product_sku'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='slug',
+            field=models.SlugField(max_length=100, unique=True, verbose_name='Category Slug'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at'], name='category_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-ordered_date'], name='order_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_featured', True)), fields=['-created_at'], name='product_featured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category', '-created_at'], name='product_category_active_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_cart_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_cart_user_product'),
+        ),
+    ]
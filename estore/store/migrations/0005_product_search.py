@@ -0,0 +1,87 @@
+from django.db import migrations
+
+# Full text index of the products (store/search.py) - an SQLite FTS5 table whose rowid is the product id,
+# kept in sync by triggers so bulk inserts/updates that skip model signals are indexed too.
+# Other database backends skip this migration and search falls back to icontains filters.
+
+FTS_TABLE = '''
+CREATE VIRTUAL TABLE store_product_fts USING fts5(
+    title, short_description, detail_description, category_title,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+'''
+
+TRIGGERS = [
+    '''
+    CREATE TRIGGER store_product_fts_insert AFTER INSERT ON store_product BEGIN
+        INSERT INTO store_product_fts (rowid, title, short_description, detail_description, category_title)
+        SELECT new.id, new.title, new.short_description, coalesce(new.detail_description, ''), c.title
+        FROM store_category c WHERE c.id = new.category_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER store_product_fts_update AFTER UPDATE OF title, short_description, detail_description, category_id ON store_product BEGIN
+        DELETE FROM store_product_fts WHERE rowid = old.id;
+        INSERT INTO store_product_fts (rowid, title, short_description, detail_description, category_title)
+        SELECT new.id, new.title, new.short_description, coalesce(new.detail_description, ''), c.title
+        FROM store_category c WHERE c.id = new.category_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER store_product_fts_delete AFTER DELETE ON store_product BEGIN
+        DELETE FROM store_product_fts WHERE rowid = old.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER store_category_fts_update AFTER UPDATE OF title ON store_category BEGIN
+        UPDATE store_product_fts SET category_title = new.title
+        WHERE rowid IN (SELECT id FROM store_product WHERE category_id = new.id);
+    END
+    ''',
+]
+
+# default ranking (ORDER BY rank) is bm25 with these column weights: title, short_description,
+# detail_description, category_title
+RANK = '''
+INSERT INTO store_product_fts (store_product_fts, rank) VALUES ('rank', 'bm25(10.0, 4.0, 1.0, 2.0)')
+'''
+
+BACKFILL = '''
+INSERT INTO store_product_fts (rowid, title, short_description, detail_description, category_title)
+SELECT p.id, p.title, p.short_description, coalesce(p.detail_description, ''), c.title
+FROM store_product p JOIN store_category c ON c.id = p.category_id
+'''
+
+DROP = [
+    'DROP TRIGGER IF EXISTS store_category_fts_update',
+    'DROP TRIGGER IF EXISTS store_product_fts_delete',
+    'DROP TRIGGER IF EXISTS store_product_fts_update',
+    'DROP TRIGGER IF EXISTS store_product_fts_insert',
+    'DROP TABLE IF EXISTS store_product_fts',
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in [FTS_TABLE, RANK] + TRIGGERS + [BACKFILL]:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
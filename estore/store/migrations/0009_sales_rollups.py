@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_order_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Day (UTC)')),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Accepted', 'Accepted'), ('Packed', 'Packed'), ('On The Way', 'On The Way'), ('Delivered', 'Delivered'), ('Cancelled', 'Cancelled')], max_length=50)),
+                ('orders', models.IntegerField(default=0, verbose_name='Orders')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Units')),
+                ('revenue_cents', models.BigIntegerField(default=0, verbose_name='Revenue (cents)')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.category', verbose_name='Category')),
+            ],
+            options={
+                'verbose_name': 'Sales',
+                'verbose_name_plural': 'Sales',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='salesrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'category', 'status'), name='unique_sales_rollup'),
+        ),
+    ]
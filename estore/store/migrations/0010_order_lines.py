@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Total'),
+        ),
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=150, verbose_name='Product Title')),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=8, verbose_name='Unit Price')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Quantity')),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Line Total')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='store.order', verbose_name='Order')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='store.product', verbose_name='Product')),
+            ],
+            options={
+                'ordering': ('order_id', 'id'),
+            },
+        ),
+        # nullable until 0012 drops them, so that unapplying 0011 can fill them in again
+        migrations.AlterField(
+            model_name='order',
+            name='product',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='store.product', verbose_name='Product'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='quantity',
+            field=models.PositiveIntegerField(null=True, verbose_name='Quantity'),
+        ),
+    ]
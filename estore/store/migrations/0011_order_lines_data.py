@@ -0,0 +1,56 @@
+from django.db import migrations
+from django.db.migrations.exceptions import IrreversibleError
+from django.db.models import Count, DecimalField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+# Every existing order row (one product each) becomes an order with a single line under the same id, so
+# order numbers customers have seen stay valid. Old rows have no price of their own: the lines get the
+# product's current price, the same price the sales rollups were computed with.
+# Orders are converted BATCH_SIZE ids at a time: one read, one bulk insert of the lines and one update
+# of the order totals per batch.
+
+BATCH_SIZE = 10000
+
+
+def batches(Order):
+    max_id = Order.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    for start in range(0, max_id, BATCH_SIZE):
+        yield Order.objects.filter(id__gt=start, id__lte=start + BATCH_SIZE)
+
+
+def orders_to_lines(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    OrderLine = apps.get_model('store', 'OrderLine')
+    for orders in batches(Order):
+        OrderLine.objects.bulk_create([
+            OrderLine(order_id=order_id, product_id=product_id, title=title, unit_price=price, quantity=quantity, line_total=price * quantity)
+            for order_id, product_id, title, price, quantity in
+            orders.filter(product__isnull=False).values_list('id', 'product_id', 'product__title', 'product__price', 'quantity')
+        ], batch_size=1000)
+        totals = OrderLine.objects.filter(order_id=OuterRef('id')).order_by().values('order_id').annotate(total=Sum('line_total')).values('total')
+        money = DecimalField(max_digits=12, decimal_places=2)
+        orders.update(total=Coalesce(Subquery(totals, output_field=money), Value(0, output_field=money)))
+
+
+# Back to one row per product: only possible while every order still has a single line of an existing product
+def lines_to_orders(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    OrderLine = apps.get_model('store', 'OrderLine')
+    if OrderLine.objects.values('order_id').annotate(count=Count('id')).filter(count__gt=1).exists() or \
+            OrderLine.objects.filter(product__isnull=True).exists():
+        raise IrreversibleError("Orders with several lines or deleted products cannot be converted back to one row per product")
+    for orders in batches(Order):
+        lines = OrderLine.objects.filter(order_id=OuterRef('id'))
+        orders.update(product_id=Subquery(lines.values('product_id')[:1]), quantity=Subquery(lines.values('quantity')[:1]))
+    OrderLine.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_order_lines'),
+    ]
+
+    operations = [
+        migrations.RunPython(orders_to_lines, lines_to_orders),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_inventory'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-updated_at'], name='product_category_updated_idx'),
+        ),
+    ]
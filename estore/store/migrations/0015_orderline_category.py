@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:36
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+import django.db.models.deletion
+
+# Existing lines get the category their product is in now, the category the sales rollups counted them
+# in so far; lines of deleted products stay without one. BATCH_SIZE order ids per UPDATE.
+
+BATCH_SIZE = 10000
+
+
+def copy_categories(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    OrderLine = apps.get_model('store', 'OrderLine')
+    category = Product.objects.filter(id=OuterRef('product_id')).values('category_id')[:1]
+    max_id = OrderLine.objects.aggregate(max_id=Max('order_id'))['max_id'] or 0
+    for start in range(0, max_id, BATCH_SIZE):
+        OrderLine.objects.filter(order_id__gt=start, order_id__lte=start + BATCH_SIZE, product__isnull=False) \
+            .update(category_id=Subquery(category))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_product_category_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderline',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='store.category', verbose_name='Category'),
+        ),
+        migrations.RunPython(copy_categories, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 # django models give the basic structure of the tables in the database and the
 # relationship between the tables
 
@@ -25,7 +28,7 @@ class Address(models.Model):
 # is_featured lets us hide the product category from the home page
 class Category(models.Model):
     title = models.CharField(max_length=50, verbose_name="Category Title")
-    slug = models.CharField(max_length=100, verbose_name="Category Slug")
+    slug = models.SlugField(max_length=100, unique=True, verbose_name="Category Slug")
     description = models.TextField(blank=True, verbose_name="Category Description")
     category_image = models.ImageField(upload_to="category", blank=True, null=True, verbose_name="Category Image")
     is_active = models.BooleanField(verbose_name="Is Active?")
@@ -36,6 +39,12 @@ class Category(models.Model):
     class Meta:
         verbose_name_plural = "Categories"
         ordering = ('-created_at', )
+        # menu/categories pages list active categories and home the active featured ones, newest first.
+        # A partial index since boolean filters are plain column tests that a composite index can't seek on;
+        # featured categories are read by walking it in order until 3 are found
+        indexes = [
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True), name='category_active_idx'),
+        ]
 
     # Image property - implemented with try except block to prevent page from crashing if a product image is missing
     # @property   
@@ -62,6 +71,9 @@ class Product(models.Model):
     detail_description = models.TextField(blank=True, null=True, verbose_name="Detail Description")
     product_image = models.ImageField(upload_to="product", blank=True, null=True)
     price = models.DecimalField(max_digits=8, decimal_places=2)
+    # units that can still be sold, not counting the ones held in carts (see inventory.py); empty for
+    # products whose stock isn't tracked
+    stock = models.PositiveIntegerField(null=True, blank=True, verbose_name="Stock")
     is_active = models.BooleanField(verbose_name="Is Active?")
     is_featured = models.BooleanField(verbose_name="Is Featured?")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created Date")
@@ -70,6 +82,17 @@ class Product(models.Model):
     class Meta:
         verbose_name_plural = "Products"
         ordering = ('-created_at', )
+        # home lists active featured products, the shop lists all active products and category pages and
+        # related products the active products of one category; all of them newest first. The shop and
+        # category listings are paginated with a (created_at, id) cursor, hence id in those indexes
+        # (partial indexes, see Category). The newest updated_at of a category is the Last-Modified date
+        # of its page (see store/conditional.py).
+        indexes = [
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True, is_featured=True), name='product_featured_idx'),
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_active=True), name='product_active_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], condition=models.Q(is_active=True), name='product_category_active_idx'),
+            models.Index(fields=['category', '-updated_at'], name='product_category_updated_idx'),
+        ]
 
     # Image property - implemented with try except block to prevent page from crashing if a product image is missing
     # @property   
@@ -83,6 +106,61 @@ class Product(models.Model):
     def __str__(self):
         return self.title
 
+# Cart queries - line totals and cart totals are computed by the database in the same query as the
+# cart lines (joined with their product) instead of dereferencing cart.product once per line in python
+def money_field():
+    return DecimalField(max_digits=12, decimal_places=2)
+
+class CartQuerySet(models.QuerySet):
+    def with_line_totals(self):
+        return self.select_related('product').annotate(
+            line_total=ExpressionWrapper(F('quantity') * F('product__price'), output_field=money_field())
+        )
+
+    # subtotal, shipping, total and number of lines of the cart in a single aggregate query
+    def totals(self, shipping_cost):
+        subtotal = Coalesce(Sum(F('quantity') * F('product__price'), output_field=money_field()), Value(0, output_field=money_field()))
+        shipping = Value(shipping_cost, output_field=money_field())
+        totals = self.aggregate(
+            cart_cost=subtotal,
+            total_cost=ExpressionWrapper(subtotal + shipping, output_field=money_field()),
+            line_count=Count('id'),
+        )
+        totals['shipping_cost'] = shipping_cost
+        return totals
+
+    # Cart changes are single conditional statements, so concurrent clicks never lose an update:
+    # quantities change with UPDATE ... SET quantity = quantity + n, and the unique (user, product)
+    # constraint settles two requests adding the same new product at once. Each returns whether a
+    # cart line was changed.
+    def add_product(self, user, product_id, quantity=1):
+        lines = self.filter(user=user, product_id=product_id)
+        if lines.update(quantity=F('quantity') + quantity, updated_at=timezone.now()):
+            return True
+        if not Product.objects.filter(id=product_id, is_active=True).exists():
+            return False
+        try:
+            with transaction.atomic():
+                self.create(user=user, product_id=product_id, quantity=quantity)
+        except IntegrityError:
+            # added by a concurrent request in the meantime
+            lines.update(quantity=F('quantity') + quantity, updated_at=timezone.now())
+        return True
+
+    def increment(self, user, cart_id):
+        return bool(self.filter(id=cart_id, user=user).update(quantity=F('quantity') + 1, updated_at=timezone.now()))
+
+    # the last one of a product removes the line
+    def decrement(self, user, cart_id):
+        if self.filter(id=cart_id, user=user, quantity__gt=1).update(quantity=F('quantity') - 1, updated_at=timezone.now()):
+            return True
+        deleted, _ = self.filter(id=cart_id, user=user, quantity__lte=1).delete()
+        return bool(deleted)
+
+    def remove(self, user, cart_id):
+        deleted, _ = self.filter(id=cart_id, user=user).delete()
+        return bool(deleted)
+
 # Cart - When purchasing items, users will add cart items to their order
 # each cart item is responsible for one type of product but can have varying quantities
 # of that item, depending on how much the user wishes to purchase
@@ -93,12 +171,23 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created Date")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated Date")
 
+    objects = CartQuerySet.as_manager()
+
+    # a product appears at most once in a user's cart (more of it is more quantity); the constraint's
+    # index also serves the (user, product) lookup of add_to_cart and the per user cart listing
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_cart_user_product'),
+        ]
+
     def __str__(self):
         return str(self.user)
     
-    # total price property of the cart item
+    # total price property of the cart item (uses the database computed line total when available)
     @property
     def total_price(self):
+        if hasattr(self, 'line_total'):
+            return self.line_total
         return self.quantity * self.product.price
 
  # different states that the order is currently in
@@ -111,12 +200,123 @@ STATUS_CHOICES = (
     ('Cancelled', 'Cancelled')
 )
 
-# Order - Keeps track of a user's order and the different status of that order
+# Order - Keeps track of a user's order and the different status of that order. An order is one
+# checkout: the products bought are its lines (OrderLine), and the total is computed once, when the
+# order is placed, from the prices of the lines
 class Order(models.Model):
     status = models.CharField(choices=STATUS_CHOICES, max_length=50, default="Pending")
     user = models.ForeignKey(User, verbose_name="User", on_delete=models.CASCADE)
     address = models.ForeignKey(Address, verbose_name="Shipping Address", on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, verbose_name="Product", on_delete=models.CASCADE)
-    quantity = models.PositiveIntegerField(verbose_name="Quantity")
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Total")
     ordered_date = models.DateTimeField(auto_now_add=True, verbose_name="Ordered Date")
 
+    # order history pages list a user's orders newest first, a page at a time (keyset on ordered_date, id)
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-ordered_date', '-id'], name='order_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return "Order %s" % self.id
+
+    # the values the order was loaded with, so that the sales rollups can move it when it is edited (see sales.py)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded = dict(zip(field_names, values))
+        return instance
+
+# Order line - a product of an order as it was sold: the title, unit price and category are copied from
+# the product at checkout, so order pages and sales figures show what was paid and where it was filed,
+# not today's price or category, without reading the product. Lines are not edited after checkout; the
+# product is kept as a reference only and may be deleted later.
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, verbose_name="Order", related_name="lines", on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, verbose_name="Product", null=True, blank=True, on_delete=models.SET_NULL)
+    category = models.ForeignKey(Category, verbose_name="Category", related_name="+", null=True, blank=True, on_delete=models.SET_NULL)
+    title = models.CharField(max_length=150, verbose_name="Product Title")
+    unit_price = models.DecimalField(max_digits=8, decimal_places=2, verbose_name="Unit Price")
+    quantity = models.PositiveIntegerField(verbose_name="Quantity")
+    line_total = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Line Total")
+
+    class Meta:
+        ordering = ('order_id', 'id')
+
+    def __str__(self):
+        return "%s x %s" % (self.quantity, self.title)
+
+
+# Sales rollups - orders, units and revenue per (UTC day, category, status), kept up to date as orders
+# are placed, edited and deleted (see sales.py) so sales reports read a few rows per day instead of
+# scanning the orders. Revenue is in cents: the increments are done by the database, and SQLite adds
+# decimals as floating point.
+class SalesRollup(models.Model):
+    day = models.DateField(verbose_name="Day (UTC)")
+    category = models.ForeignKey(Category, verbose_name="Category", related_name="+", on_delete=models.CASCADE)
+    status = models.CharField(choices=STATUS_CHOICES, max_length=50)
+    orders = models.IntegerField(default=0, verbose_name="Orders")
+    quantity = models.IntegerField(default=0, verbose_name="Units")
+    revenue_cents = models.BigIntegerField(default=0, verbose_name="Revenue (cents)")
+
+    class Meta:
+        verbose_name = "Sales"
+        verbose_name_plural = "Sales"
+        # also the index of the dashboard's date range scans
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category', 'status'], name='unique_sales_rollup'),
+        ]
+
+    def __str__(self):
+        return "%s %s %s" % (self.day, self.category_id, self.status)
+
+
+# Stock reservation - units of a product held for a customer while they are in their cart, taken off
+# Product.stock when carted and put back when removed or, once expires_at has passed, by
+# `manage.py release_reservations` (see inventory.py)
+class StockReservation(models.Model):
+    user = models.ForeignKey(User, verbose_name="User", on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, verbose_name="Product", related_name="+", on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(verbose_name="Quantity")
+    expires_at = models.DateTimeField(verbose_name="Expires At")
+
+    # one reservation per cart line; the sweeper walks the expiry index
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_reservation_user_product'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return "%s x %s" % (self.quantity, self.product_id)
+
+
+# Related products - a bounded, precomputed list of recommendations per product (co-purchases blended
+# with same category fallbacks), rebuilt by `manage.py refresh_recommendations` so that the detail page
+# reads at most STORE_RELATED_PRODUCTS rows instead of querying the whole category
+class RelatedProduct(models.Model):
+    SOURCE_CHOICES = (
+        ('co-purchase', 'Bought together'),
+        ('category', 'Same category'),
+    )
+
+    product = models.ForeignKey(Product, verbose_name="Product", related_name="recommendations", on_delete=models.CASCADE)
+    related = models.ForeignKey(Product, verbose_name="Related Product", related_name="+", on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField(verbose_name="Rank")
+    score = models.FloatField(verbose_name="Score")
+    source = models.CharField(choices=SOURCE_CHOICES, max_length=20, verbose_name="Source")
+
+    class Meta:
+        ordering = ('product_id', 'rank')
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_related_product_rank'),
+        ]
+
+    def __str__(self):
+        return "%s -> %s" % (self.product_id, self.related_id)
+
+# Bookkeeping of the recommendation refresh: orders up to last_order_id are already reflected
+class RecommendationState(models.Model):
+    last_order_id = models.BigIntegerField(default=0, verbose_name="Last Processed Order")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated Date")
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db.models import Count, Prefetch
+
+from .catalog import paginate
+from .models import Order, OrderLine, STATUS_CHOICES
+
+# A customer's order history. Pages are cut with a cursor on (ordered_date, id) that seeks into the
+# (user, -ordered_date, -id) index; every order comes with its shipping address in the same query and
+# the lines of all orders of the page (with the product, for its image) come in a second one, so a page
+# costs two queries however many orders the customer has placed. Titles, prices and totals are the
+# ones stored at checkout.
+
+
+def user_orders(user):
+    lines = OrderLine.objects.select_related('product')
+    return Order.objects.filter(user=user).select_related('address').prefetch_related(Prefetch('lines', queryset=lines))
+
+
+# One page of the order history, from the request's `after`/`before` cursors
+def order_history_page(request):
+    return paginate(
+        user_orders(request.user), after=request.GET.get('after'), before=request.GET.get('before'),
+        page_size=settings.STORE_ORDERS_PAGE_SIZE, field='ordered_date',
+    )
+
+
+# Compact summary for the profile page: the latest few orders and the number of orders per status
+def order_summary(user, latest=None):
+    latest = latest or settings.STORE_PROFILE_RECENT_ORDERS
+    counts = dict(Order.objects.filter(user=user).order_by().values_list('status').annotate(count=Count('id')))
+    return {
+        'orders': list(user_orders(user).order_by('-ordered_date', '-id')[:latest]),
+        'status_counts': [(label, counts[status]) for status, label in STATUS_CHOICES if counts.get(status)],
+        'order_count': sum(counts.values()),
+    }
@@ -0,0 +1,176 @@
+import contextvars
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+
+# Per request instrumentation: database queries (count, time, duplicates), template rendering time and
+# the time of the navbar context processors, collected while a request is handled and reported as a
+# Server-Timing header and in the 'store.performance' log.
+#
+# The numbers go to the RequestStats of the current context (a context variable, so they follow a request
+# into the threads sync_to_async runs the async ORM in). Queries are recorded by a wrapper installed on
+# every database connection, templates by the TimedDjangoTemplates backend (settings.TEMPLATES).
+
+logger = logging.getLogger('store.performance')
+
+_current = contextvars.ContextVar('store_request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self, parent=None):
+        self.parent = parent        # enclosing collection (e.g. a query budget in a test), gets the queries too
+        self.queries = []           # (sql, milliseconds), sql with placeholders rather than the parameters
+        self.template_ms = 0.0
+        self.timings = Counter()    # milliseconds per instrumented function (context processors)
+        self.rendering = False
+
+    @property
+    def query_ms(self):
+        return sum(ms for _, ms in self.queries)
+
+    def worst_queries(self, count=5):
+        return sorted(self.queries, key=lambda query: query[1], reverse=True)[:count]
+
+    # statements run `threshold` times or more in the request, a sign of a query per row (N+1)
+    def duplicate_queries(self, threshold=None):
+        threshold = threshold or settings.STORE_DUPLICATE_QUERY_THRESHOLD
+        return [(sql, count) for sql, count in Counter(sql for sql, _ in self.queries).most_common() if count >= threshold]
+
+
+@contextmanager
+def collect():
+    stats = RequestStats(parent=_current.get())
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        query = (sql, (time.perf_counter() - start) * 1000)
+        while stats is not None:
+            stats.queries.append(query)
+            stats = stats.parent
+
+
+# connection_created receiver (see StoreConfig.ready)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# Adds the running time of the decorated function (sync or async) to the current request's timings
+def timed(func):
+    name = func.__name__
+
+    if iscoroutinefunction(func):
+        @wraps(func)
+        async def _async_timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _add_timing(name, start)
+        return _async_timed
+
+    @wraps(func)
+    def _timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _add_timing(name, start)
+    return _timed
+
+
+def _add_timing(name, start):
+    stats = _current.get()
+    if stats is not None:
+        stats.timings[name] += (time.perf_counter() - start) * 1000
+
+
+# Template backend that times rendering; templates rendered from within another template (includes,
+# the cached product cards) count towards the outermost one only
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None or stats.rendering:
+            return super().render(context, request)
+        stats.rendering = True
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.rendering = False
+            stats.template_ms += (time.perf_counter() - start) * 1000
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def server_timing(stats, total_ms):
+    metrics = [
+        'db;dur=%.1f;desc="%d queries"' % (stats.query_ms, len(stats.queries)),
+        'tpl;dur=%.1f' % stats.template_ms,
+    ]
+    metrics += ['%s;dur=%.1f' % (name, ms) for name, ms in sorted(stats.timings.items())]
+    metrics.append('total;dur=%.1f' % total_ms)
+    return ', '.join(metrics)
+
+
+def report(request, response, stats, total_ms):
+    if settings.STORE_SERVER_TIMING:
+        response['Server-Timing'] = server_timing(stats, total_ms)
+    duplicates = stats.duplicate_queries()
+    if duplicates:
+        logger.warning("Repeated queries on %s %s: %s", request.method, request.path,
+                       '; '.join('%dx %s' % (count, sql) for sql, count in duplicates))
+    if total_ms >= settings.STORE_SLOW_REQUEST_MS:
+        logger.warning("Slow request %s %s: %.0f ms, %d queries in %.0f ms, templates %.0f ms; slowest queries: %s",
+                       request.method, request.path, total_ms, len(stats.queries), stats.query_ms, stats.template_ms,
+                       '; '.join('%.1f ms %s' % (ms, sql) for sql, ms in stats.worst_queries()))
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with collect() as stats:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            report(request, response, stats, (time.perf_counter() - start) * 1000)
+        return response
+
+    async def __acall__(self, request):
+        with collect() as stats:
+            start = time.perf_counter()
+            response = await self.get_response(request)
+            report(request, response, stats, (time.perf_counter() - start) * 1000)
+        return response
@@ -0,0 +1,140 @@
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from scipy import sparse
+
+from .cache import bump_version
+from .models import Order, OrderLine, Product, RecommendationState, RelatedProduct
+
+# Related product recommendations, computed offline by `manage.py refresh_recommendations`.
+# Purchases are a customer x product matrix B (1 = the customer ordered the product at least once);
+# B.T @ B counts, for every pair of products, the customers who bought both. Pairs are scored by
+# cosine similarity, count / sqrt(buyers(a) * buyers(b)), so best sellers do not show up everywhere.
+# The top STORE_RELATED_PRODUCTS per product are stored in RelatedProduct, topped up with the newest
+# products of the same category when there is not enough purchase history.
+
+# products refreshed per B.T @ B slice and per transaction
+CHUNK_SIZE = 1000
+
+
+def purchase_matrix(max_order_id):
+    pairs = (OrderLine.objects.filter(order_id__lte=max_order_id, product__isnull=False).order_by()
+             .values_list('order__user_id', 'product_id').distinct())
+    pairs = np.fromiter((value for pair in pairs.iterator(chunk_size=10000) for value in pair), dtype=np.int64)
+    pairs = pairs.reshape(-1, 2)
+    users, user_index = np.unique(pairs[:, 0], return_inverse=True)
+    products, product_index = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.float32), (user_index, product_index)),
+        shape=(len(users), len(products)),
+    )
+    return matrix, users, products
+
+
+# {product id: [(related id, score), ...]} best first, for the product ids in `targets`. `candidates`
+# is the purchase matrix without the columns of inactive products, which are never recommended.
+def co_purchases(matrix, candidates, buyers, products, targets, limit):
+    if not len(products):
+        return {}
+    columns = np.searchsorted(products, targets)
+    known = (columns < len(products)) & (products[np.minimum(columns, len(products) - 1)] == targets)
+    targets, columns = targets[known], columns[known]
+    counts = (matrix[:, columns].T @ candidates).tocsr()
+
+    result = {}
+    for row, (product_id, column) in enumerate(zip(targets, columns)):
+        begin, end = counts.indptr[row], counts.indptr[row + 1]
+        related, count = counts.indices[begin:end], counts.data[begin:end]
+        keep = (related != column) & (count > 0)
+        related, count = related[keep], count[keep]
+        if not len(related):
+            continue
+        scores = count / np.sqrt(buyers[column] * buyers[related])
+        if len(scores) > limit:
+            best = np.argpartition(-scores, limit)[:limit]
+            related, scores = related[best], scores[best]
+        order = np.lexsort((products[related], -scores))
+        result[int(product_id)] = [(int(products[related[i]]), float(scores[i])) for i in order]
+    return result
+
+
+# Newest active products of a category, used to fill the lists up to `limit`
+def category_fallbacks(category_id, limit, cache):
+    if category_id not in cache:
+        cache[category_id] = list(
+            Product.objects.filter(is_active=True, category_id=category_id)
+            .order_by('-created_at', '-id').values_list('id', flat=True)[:2 * limit + 1]
+        )
+    return cache[category_id]
+
+
+# Replace the lists of `product_ids`. Rows go in with a plain executemany: building model instances
+# for bulk_create costs more than the insert itself at a few million rows.
+def write_recommendations(product_ids, co_purchased, limit):
+    categories = dict(Product.objects.filter(id__in=product_ids).values_list('id', 'category_id'))
+    fallbacks = {}
+    rows = []
+    for product_id in product_ids:
+        if product_id not in categories:
+            continue
+        related = [(product_id, related_id, rank, score, 'co-purchase') for rank, (related_id, score) in enumerate(co_purchased.get(product_id, []))]
+        seen = {product_id} | {row[1] for row in related}
+        for related_id in category_fallbacks(categories[product_id], limit, fallbacks):
+            if len(related) >= limit:
+                break
+            if related_id not in seen:
+                related.append((product_id, related_id, len(related), 0.0, 'category'))
+        rows.extend(related)
+
+    table = connection.ops.quote_name(RelatedProduct._meta.db_table)
+    with transaction.atomic():
+        RelatedProduct.objects.filter(product_id__in=product_ids).delete()
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO %s (product_id, related_id, rank, score, source) VALUES (%%s, %%s, %%s, %%s, %%s)' % table, rows
+            )
+    return len(rows)
+
+
+# Recompute the recommendations. The incremental (default) run only touches products whose lists can
+# have changed since the last run: everything bought by customers with new orders, plus active products
+# that have no list yet. `full` recomputes every active product, which also drops deactivated ones.
+# Returns (products refreshed, rows written).
+def refresh_recommendations(full=False, limit=None):
+    limit = limit or settings.STORE_RELATED_PRODUCTS
+    state = RecommendationState.objects.first() or RecommendationState()
+    max_order_id = Order.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    active_ids = np.fromiter(Product.objects.filter(is_active=True).values_list('id', flat=True).iterator(), dtype=np.int64)
+
+    matrix, users, products = purchase_matrix(max_order_id)
+    buyers = np.asarray(matrix.sum(axis=0)).ravel()
+    candidates = (matrix @ sparse.diags(np.isin(products, active_ids).astype(np.float32))).tocsc()
+    if full:
+        targets = active_ids
+        RelatedProduct.objects.exclude(product_id__in=Product.objects.filter(is_active=True)).delete()
+    else:
+        # customers with new lines of existing products, the only ones the purchase matrix has rows for
+        # (an order can have no lines, or only lines of deleted products)
+        new_buyers = (OrderLine.objects.filter(order_id__gt=state.last_order_id, order_id__lte=max_order_id, product__isnull=False)
+                      .order_by().values_list('order__user_id', flat=True).distinct())
+        new_buyers = np.fromiter(new_buyers, dtype=np.int64)
+        rows = np.searchsorted(users, new_buyers[np.isin(new_buyers, users)])
+        touched = products[np.unique(matrix[rows].indices)] if len(rows) else np.empty(0, dtype=np.int64)
+        missing = np.fromiter(
+            Product.objects.filter(is_active=True, recommendations__isnull=True).values_list('id', flat=True).iterator(), dtype=np.int64
+        )
+        targets = np.intersect1d(np.union1d(touched, missing), active_ids)
+
+    written = 0
+    for start in range(0, len(targets), CHUNK_SIZE):
+        chunk = targets[start:start + CHUNK_SIZE]
+        co_purchased = co_purchases(matrix, candidates, buyers, products, chunk, limit)
+        written += write_recommendations([int(product_id) for product_id in chunk], co_purchased, limit)
+
+    state.last_order_id = max_order_id
+    state.save()
+    # the related products shown on detail pages changed under their ETags (see store/conditional.py)
+    if full or written:
+        bump_version('catalog')
+    return len(targets), written
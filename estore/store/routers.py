@@ -0,0 +1,44 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+# Catalog reads (products, categories) go to the read replica, STORE_DB_READ_ALIAS, when one is configured
+# (see settings.py); everything else - carts, orders, sessions and all writes - uses the primary, so a
+# customer always reads back their own cart and orders. Reads made inside a transaction on the primary
+# stay there too, as the replica can't see its uncommitted writes.
+# So do reads made to fill a cache keyed by a version (store/cache.py): the version is bumped once the
+# primary has committed, and a replica lagging behind would get its old rows cached under the new
+# version until they expire. Those reads run inside primary_reads().
+
+CATALOG_MODELS = {'store.product', 'store.category'}
+
+_primary_reads = contextvars.ContextVar('store_primary_reads', default=False)
+
+
+@contextmanager
+def primary_reads():
+    token = _primary_reads.set(True)
+    try:
+        yield
+    finally:
+        _primary_reads.reset(token)
+
+
+class CatalogReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if settings.STORE_DB_READ_ALIAS and model._meta.label_lower in CATALOG_MODELS and \
+                not _primary_reads.get() and not connections['default'].in_atomic_block:
+            return settings.STORE_DB_READ_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    # the replica holds the same rows as the primary
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
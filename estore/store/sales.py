@@ -0,0 +1,192 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Max, Sum
+
+from .models import STATUS_CHOICES, Order, OrderLine, SalesRollup
+
+# Sales rollups (SalesRollup: orders, units and revenue per UTC day, category and status).
+#
+# Kept up to date incrementally: checkout records the order it creates (record_order), and the Order
+# signal handlers (signals.py) record single saves - admin edits, including list_editable status
+# changes - and deletes by taking the order's lines off the rows they were counted in and adding them
+# to the rows they belong to now. Changes are applied as one INSERT .. ON CONFLICT DO UPDATE adding to
+# the counters, in the transaction of the order change.
+# QuerySet.update() on orders and changes to order lines bypass all this; run
+# `manage.py backfill_sales_rollups` afterwards.
+#
+# Revenue is the line totals stored at checkout, so it is what was paid whatever the prices are today.
+# Units and revenue go to the category copied to each line at checkout (OrderLine.category), so moving or
+# deleting a product later does not change where its sales were counted and an edited order is taken
+# off the same rows it was added to; lines without a category are left out. An order is counted once,
+# in the row of its first line, so that the order counts of the categories add up to the number of
+# orders.
+
+STATUSES = [status for status, _ in STATUS_CHOICES]
+
+# orders read per backfill batch
+BACKFILL_BATCH_SIZE = 100000
+
+
+def utc_day(value):
+    return value.astimezone(datetime.timezone.utc).date()
+
+
+def cents(amount):
+    return int(amount * 100)
+
+
+# {(day, category id, status): [orders, units, cents]} of order lines, each counted `sign` times.
+# `orders` is {order id: (status, ordered_date)}, `lines` (order id, category id, quantity, line total)
+# tuples in line order.
+def contributions(orders, lines, sign=1):
+    deltas = defaultdict(lambda: [0, 0, 0])
+    counted = set()
+    for order_id, category_id, quantity, line_total in lines:
+        if category_id is None:
+            continue
+        status, ordered_date = orders[order_id]
+        delta = deltas[(utc_day(ordered_date), category_id, status)]
+        if order_id not in counted:
+            counted.add(order_id)
+            delta[0] += sign
+        delta[1] += sign * quantity
+        delta[2] += sign * cents(line_total)
+    return deltas
+
+
+def apply(deltas):
+    rows = [(day, category_id, status) + tuple(delta) for (day, category_id, status), delta in deltas.items() if any(delta)]
+    if not rows:
+        return
+    table = connection.ops.quote_name(SalesRollup._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            '''
+            INSERT INTO {table} (day, category_id, status, orders, quantity, revenue_cents) VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (day, category_id, status) DO UPDATE SET
+                orders = {table}.orders + excluded.orders,
+                quantity = {table}.quantity + excluded.quantity,
+                revenue_cents = {table}.revenue_cents + excluded.revenue_cents
+            '''.format(table=table),
+            [(connection.ops.adapt_datefield_value(row[0]),) + row[1:] for row in rows],
+        )
+
+
+# (order id, category id, quantity, line total) of the lines of an order, one query
+def order_lines(order_id):
+    return list(
+        OrderLine.objects.filter(order_id=order_id).order_by('id')
+        .values_list('order_id', 'category_id', 'quantity', 'line_total')
+    )
+
+
+# An order just placed, with its OrderLines (checkout)
+def record_order(order, lines):
+    apply(contributions(
+        {order.id: (order.status, order.ordered_date)},
+        [(order.id, line.category_id, line.quantity, line.line_total) for line in lines],
+    ))
+
+
+# An order saved on its own; `created` as passed to post_save. A new order has no lines yet (they are
+# recorded with it by checkout), an edited one is moved if its status or date changed.
+def record_order_saved(order, created):
+    loaded = getattr(order, '_loaded', None)
+    new = (order.status, order.ordered_date)
+    if not created:
+        if loaded is None or not {'status', 'ordered_date'} <= loaded.keys():
+            # saved without having been loaded whole: nothing to compare with, leave it to the backfill
+            return
+        old = (loaded['status'], loaded['ordered_date'])
+        if old != new:
+            lines = order_lines(order.id)
+            deltas = contributions({order.id: old}, lines, sign=-1)
+            for key, delta in contributions({order.id: new}, lines).items():
+                deltas[key] = [a + b for a, b in zip(deltas.get(key, [0, 0, 0]), delta)]
+            apply(deltas)
+    order._loaded = dict(zip(('status', 'ordered_date'), new))
+
+
+# An order about to be deleted (pre_delete, while its lines still exist)
+def record_order_deleted(order):
+    loaded = getattr(order, '_loaded', None) or {}
+    values = (loaded.get('status', order.status), loaded.get('ordered_date', order.ordered_date))
+    apply(contributions({order.id: values}, order_lines(order.id), sign=-1))
+
+
+# Recompute all rollups from the order lines, a batch of orders at a time: the lines of each batch are
+# loaded into numpy arrays and summed per (day, category, status) key with np.unique/np.bincount. Runs
+# in one transaction that starts by clearing the rollups, which makes concurrent checkouts wait until
+# it is done. Returns (orders, rollup rows).
+def backfill(batch_size=BACKFILL_BATCH_SIZE, progress=None):
+    # unknown statuses get code 7 and are left out
+    status_codes = {status: code for code, status in enumerate(STATUSES)}
+    totals = defaultdict(lambda: np.zeros(3, dtype=np.int64))
+    counted = 0
+    with transaction.atomic():
+        SalesRollup.objects.all().delete()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for model in (Order, OrderLine):
+                    cursor.execute('LOCK TABLE %s IN SHARE MODE' % connection.ops.quote_name(model._meta.db_table))
+        max_id = Order.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        for start in range(0, max_id, batch_size):
+            rows = list(
+                OrderLine.objects.filter(order_id__gt=start, order_id__lte=start + batch_size, category__isnull=False).order_by('order_id', 'id')
+                .values_list('order_id', 'order__ordered_date', 'category_id', 'order__status', 'quantity', 'line_total')
+            )
+            if not rows:
+                continue
+            order_ids, dates, categories, statuses, quantities, line_totals = zip(*rows)
+            order_ids = np.array(order_ids, dtype=np.int64)
+            days = np.array([utc_day(date) for date in dates], dtype='datetime64[D]').astype(np.int64)
+            categories = np.array(categories, dtype=np.int64)
+            statuses = np.array([status_codes.get(status, 7) for status in statuses], dtype=np.int64)
+            quantities = np.array(quantities, dtype=np.int64)
+            line_cents = np.array([cents(total) for total in line_totals], dtype=np.int64)
+            # the first line of every order counts the order
+            first = np.ones(len(order_ids), dtype=np.int64)
+            first[1:] = order_ids[1:] != order_ids[:-1]
+
+            # one int64 key per (day, category, status): days since 1970 | category id | status
+            keys, index = np.unique((days << 35) | (categories << 3) | (statuses & 7), return_inverse=True)
+            sums = np.stack([
+                np.bincount(index, weights=first, minlength=len(keys)).astype(np.int64),
+                np.bincount(index, weights=quantities, minlength=len(keys)).astype(np.int64),
+                np.bincount(index, weights=line_cents, minlength=len(keys)).astype(np.int64),
+            ], axis=1)
+            for key, values in zip(keys.tolist(), sums):
+                totals[key] += values
+            counted += int(first.sum())
+            if progress:
+                progress(counted)
+
+        epoch = datetime.date(1970, 1, 1)
+        apply({
+            (epoch + datetime.timedelta(days=key >> 35), (key >> 3) & (2 ** 32 - 1), STATUSES[key & 7]): values.tolist()
+            for key, values in totals.items() if key & 7 < len(STATUSES)
+        })
+    return counted, len(totals)
+
+
+# Dashboard numbers for the days from `start` to `end` (inclusive), from the rollups only.
+# Revenue (in dollars) excludes cancelled orders.
+def sales_report(start, end):
+    rollups = SalesRollup.objects.filter(day__gte=start, day__lte=end).order_by()
+    sold = rollups.exclude(status='Cancelled')
+    totals = {'orders': Sum('orders'), 'quantity': Sum('quantity'), 'revenue_cents': Sum('revenue_cents')}
+    report = {
+        'totals': [sold.aggregate(**totals)],
+        'days': list(sold.values('day').annotate(**totals).order_by('-day')),
+        'categories': list(sold.values('category__title').annotate(**totals).order_by('-revenue_cents')),
+        'statuses': list(rollups.values('status').annotate(**totals).order_by('status')),
+    }
+    for rows in report.values():
+        for row in rows:
+            row['revenue'] = Decimal(row['revenue_cents'] or 0) / 100
+    report['totals'] = report['totals'][0]
+    return report
@@ -0,0 +1,108 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+# Product search - ranked full text search over the product title, descriptions and category title.
+# On SQLite it runs against the store_product_fts FTS5 index (see migration 0005_product_search),
+# elsewhere it falls back to icontains filters.
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+# FTS5 query for free text typed by a user: every word must match, each as a prefix so that
+# partially typed words match too ("conv sho" -> "conv"* AND "sho"*). Words are quoted, so FTS5
+# operators in the input (AND, NEAR, column filters, ...) are treated as plain words.
+def fts_query(text):
+    words = WORD_RE.findall(text.lower())
+    return ' '.join('"%s"*' % word for word in words)
+
+
+def has_search_index():
+    return connection.vendor == 'sqlite'
+
+
+def search_products(text, limit=20):
+    query = fts_query(text)
+    if not query:
+        return []
+    if not has_search_index():
+        return list(icontains_search(text)[:limit])
+    # Scoring (bm25, with the column weights set in the migration) is the expensive part for broad queries,
+    # so only the newest STORE_SEARCH_CANDIDATES matches are ranked: selective queries are ranked exactly,
+    # queries for very common words rank the most recent products and stay cheap on any catalog size.
+    # The winners are joined with the products afterwards; a few extra rows are fetched so that inactive
+    # products filtered out there rarely leave a gap.
+    products = Product.objects.raw(
+        '''
+        SELECT p.* FROM (
+            SELECT rowid, rank FROM (
+                SELECT rowid, rank FROM store_product_fts WHERE store_product_fts MATCH %s ORDER BY rowid DESC LIMIT %s
+            ) ORDER BY rank LIMIT %s
+        ) f
+        JOIN store_product p ON p.id = f.rowid
+        WHERE p.is_active
+        ORDER BY f.rank
+        ''',
+        [query, settings.STORE_SEARCH_CANDIDATES, limit + limit // 2 + 5],
+    )
+    return list(products)[:limit]
+
+
+# Titles for the type-ahead box, matched against product titles only
+def suggest_titles(text, limit=8):
+    query = fts_query(text)
+    if not query:
+        return []
+    if not has_search_index():
+        return list(icontains_search(text).values_list('title', 'slug')[:limit])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '''
+            SELECT p.title, p.slug FROM (
+                SELECT rowid, rank FROM (
+                    SELECT rowid, rank FROM store_product_fts WHERE title MATCH %s ORDER BY rowid DESC LIMIT %s
+                ) ORDER BY rank LIMIT %s
+            ) f
+            JOIN store_product p ON p.id = f.rowid
+            WHERE p.is_active
+            ORDER BY f.rank
+            ''',
+            [query, settings.STORE_SEARCH_CANDIDATES, limit],
+        )
+        return cursor.fetchall()
+
+
+# Unindexed search, used on other databases and as the baseline in the search benchmark
+def icontains_search(text):
+    products = Product.objects.filter(is_active=True)
+    for word in WORD_RE.findall(text):
+        products = products.filter(icontains_filter(word))
+    return products
+
+
+def icontains_filter(word):
+    return (Q(title__icontains=word) | Q(short_description__icontains=word)
+            | Q(detail_description__icontains=word) | Q(category__title__icontains=word))
+
+
+# Filter for the products (active or not) matching every word of `text`, for the admin's product search
+# and autocomplete; an id lookup in the FTS index where there is one
+def search_filter(text):
+    if has_search_index():
+        return Q(id__in=RawSQL('SELECT rowid FROM store_product_fts WHERE store_product_fts MATCH %s', [fts_query(text)]))
+    q = Q()
+    for word in WORD_RE.findall(text):
+        q &= icontains_filter(word)
+    return q
+
+
+# Merge the index segments into one b-tree; worth running after large bulk loads or imports
+def optimize_search_index():
+    if has_search_index():
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO store_product_fts (store_product_fts) VALUES ('optimize')")
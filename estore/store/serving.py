@@ -0,0 +1,133 @@
+import mimetypes
+import os
+import re
+from email.utils import formatdate
+
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import parse_http_date_safe
+from django.views.decorators.http import require_http_methods
+
+# Static and media file serving for deployments without a separate web server in front of Django.
+# Compared to django.views.static.serve this adds:
+#  - Cache-Control: far future + immutable for content hashed names, a short max-age otherwise
+#  - ETag / If-None-Match and Last-Modified / If-Modified-Since (304 responses)
+#  - single byte Range requests (206 responses), e.g. for resumed downloads and media seeking
+#  - precompressed .br / .gz variants written by collectstatic, picked by Accept-Encoding
+
+# name.0123456789ab.ext as produced by ManifestStaticFilesStorage
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _accepted_encodings(request):
+    accepted = set()
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _etag(stat, encoding):
+    return '"%x-%x%s"' % (int(stat.st_mtime), stat.st_size, '-' + encoding if encoding else '')
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+# (start, end) of a satisfiable single Range header, None to send the whole file, False when unsatisfiable
+def _byte_range(header, size):
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def _read_range(path, start, length, chunk_size=64 * 1024):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_http_methods(['GET', 'HEAD'])
+def serve(request, path, document_root, max_age):
+    try:
+        fullpath = safe_join(document_root, path)
+    except Exception:  # SuspiciousFileOperation for paths escaping document_root
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+
+    content_type, original_encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    range_header = request.META.get('HTTP_RANGE')
+
+    # ranges are answered from the identity representation only
+    encoding = None
+    if not range_header and not original_encoding:
+        accepted = _accepted_encodings(request)
+        for coding, suffix in ENCODINGS:
+            if coding in accepted and os.path.isfile(fullpath + suffix):
+                encoding, fullpath = coding, fullpath + suffix
+                break
+
+    stat = os.stat(fullpath)
+    etag = _etag(stat, encoding)
+    if HASHED_NAME_RE.search(path):
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'public, max-age=%d' % max_age
+
+    def with_headers(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = formatdate(stat.st_mtime, usegmt=True)
+        response['Cache-Control'] = cache_control
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+    if _not_modified(request, etag, stat.st_mtime):
+        return with_headers(HttpResponseNotModified())
+
+    byte_range = _byte_range(range_header, stat.st_size) if range_header else None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if byte_range and if_range and if_range != etag:
+        byte_range = None
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % stat.st_size
+        return with_headers(response)
+
+    if byte_range:
+        start, end = byte_range
+        response = FileResponse(_read_range(fullpath, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, stat.st_size)
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(stat.st_size)
+    response['Accept-Ranges'] = 'bytes'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return with_headers(response)
@@ -0,0 +1,78 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import bump_version, invalidate_user
+from .carts import merge_guest_cart
+from .images import schedule_derivatives
+from .inventory import release_all
+from .models import Category, Order, Product
+from .sales import record_order_deleted, record_order_saved
+
+# Cache invalidation - bump the version of cached data when the rows it was built from change.
+# Admin edits (including list_editable bulk edits) save each object, so they go through these too.
+# The bump waits for the commit so no request can cache the old rows under the new version.
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version('categories'))
+    transaction.on_commit(lambda: bump_version('catalog'))
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version('catalog'))
+
+
+# Sales rollups follow orders saved or deleted one at a time (checkout records the orders it places itself).
+# Deletes are recorded before the order's lines are deleted with it
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        record_order_saved(instance, created)
+
+@receiver(pre_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    record_order_deleted(instance)
+
+
+# Resized copies of uploaded images are generated in the background once the row is committed
+@receiver(post_save, sender=Category)
+def category_image_saved(sender, instance, **kwargs):
+    if instance.category_image:
+        transaction.on_commit(lambda: schedule_derivatives(instance.category_image.name))
+
+@receiver(post_save, sender=Product)
+def product_image_saved(sender, instance, **kwargs):
+    if instance.product_image:
+        transaction.on_commit(lambda: schedule_derivatives(instance.product_image.name))
+
+
+# What a visitor carted before logging in moves into their cart
+@receiver(user_logged_in)
+def guest_cart_login(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        merge_guest_cart(request.session, user)
+
+
+# Stock held for a customer goes back before their reservations are deleted with them
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    release_all(instance)
+
+
+# Cached users (see auth.py) are dropped when the row changes - a password change makes the sessions
+# made with the old password invalid - and on logout
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_user(instance.pk))
+
+@receiver(user_logged_out)
+def user_logged_out_handler(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_user(user.pk)
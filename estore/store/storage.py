@@ -0,0 +1,57 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip variants are always written
+    brotli = None
+
+# Static files storage used by `collectstatic` in production: files get content hashed names
+# (style.default.css -> style.default.1a2b3c4d5e6f.css) so they can be cached forever, and every
+# compressible file also gets a precompressed .gz (and .br when brotli is installed) copy that
+# store.serving hands out according to the request's Accept-Encoding.
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.json', '.svg', '.html', '.txt', '.xml', '.ico', '.eot', '.ttf', '.otf')
+
+# a precompressed copy is only kept when it saves at least this fraction of the original size
+MIN_SAVING = 0.05
+
+
+def compress_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    written = []
+    encoders = [('.gz', lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        encoders.append(('.br', lambda d: brotli.compress(d, quality=11)))
+    for suffix, encode in encoders:
+        compressed = encode(data)
+        if len(compressed) <= len(data) * (1 - MIN_SAVING):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            written.append(path + suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # a reference to a file that is not shipped (some vendor css points at missing fonts/images)
+    # should not abort collectstatic, the reference is simply left as is
+    manifest_strict = False
+
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for root, _, files in os.walk(self.location):
+            for filename in files:
+                if filename.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+                    compress_file(os.path.join(root, filename))
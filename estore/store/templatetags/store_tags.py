@@ -0,0 +1,44 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.template.loader import render_to_string
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from store.cache import get_version, record
+from store.images import available_variants
+
+register = template.Library()
+
+# Product card fragment shared by the home and category pages. A card depends on its own product row
+# and on which image derivatives exist, so it is cached under the product id and updated_at and the
+# 'images' version (see store/images.py): saving the product or writing derivatives changes the key.
+PRODUCT_CARD_KEY = 'store:fragment:product-card:%s:%s:%s'
+
+
+@register.simple_tag
+def product_card(product):
+    key = PRODUCT_CARD_KEY % (get_version('images'), product.id, product.updated_at.timestamp())
+    html = cache.get(key)
+    if html is None:
+        record('fragment', 'miss')
+        html = render_to_string('partials/_product_card.html', {'product': product})
+        cache.set(key, html, settings.STORE_FRAGMENT_CACHE_TIMEOUT)
+    else:
+        record('fragment', 'hit')
+    return mark_safe(html)
+
+
+# <picture> for an uploaded image using its resized variants: WebP for browsers that accept it and JPEG
+# otherwise, falling back to the original upload while the variants have not been generated yet.
+#   {% picture product.product_image 'card' alt=product.title css_class='img-fluid w-100' %}
+@register.simple_tag
+def picture(image, variant, alt='', css_class='', width=None):
+    variants = available_variants(image.name, variant)
+    src = default_storage.url(variants['jpg']) if 'jpg' in variants else image.url
+    img = format_html('<img class="{}" src="{}" alt="{}"{}>', css_class, src, alt,
+                      format_html(' width="{}"', width) if width else '')
+    if 'webp' not in variants:
+        return img
+    return format_html('<picture><source type="image/webp" srcset="{}">{}</picture>', default_storage.url(variants['webp']), img)
@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+
+from .performance import collect
+
+# Test helpers
+
+
+# Query budgets - fail a test when the code in the block (typically a test client request) runs more
+# queries than its budget, listing them with the repeated (N+1) ones first:
+#   class CartTests(QueryBudgetMixin, TestCase):
+#       def test_cart_page(self):
+#           with self.assertQueryBudget(5):
+#               self.client.get(reverse('store:cart'))
+class QueryBudgetMixin:
+    @contextmanager
+    def assertQueryBudget(self, budget, label=''):
+        with collect() as stats:
+            yield stats
+        if len(stats.queries) <= budget:
+            return
+        lines = ["%s%d queries, budget %d" % (label + ': ' if label else '', len(stats.queries), budget)]
+        lines += ["repeated %dx: %s" % (count, sql) for sql, count in stats.duplicate_queries(threshold=2)]
+        lines += ["%6.1f ms  %s" % (ms, sql) for sql, ms in stats.queries]
+        self.fail('\n'.join(lines))
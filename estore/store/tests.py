@@ -1,3 +1,1280 @@
-from django.test import TestCase
+import datetime
+import os
+import tempfile
+from concurrent.futures import Future
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache, caches
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.utils import ConnectionHandler
+from django.db.models import F, Max
+from django.http import Http404
+from django.test import AsyncRequestFactory, Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from estore import settings as project_settings
+from estore.settings import sqlite_database
+from store import async_views, serving
+from store.cache import get_cached_user, get_guest_cart, get_stats, get_version
+from store.carts import GuestCart
+from store.conditional import category_page_state
+from store.derivatives import derivative_path, generate_derivatives
+from store.inventory import reserve
+from store.images import _derivatives_done, available_variants, derivatives_written, new_executor
+from store.search import search_products
+from store.catalog import filter_products, paginate
+from store.catalog_sync import import_rows
+from store.performance import collect
+from store.recommendations import refresh_recommendations
+from store.sales import sales_report
+from store.storage import CompressedManifestStaticFilesStorage
+from store.routers import CatalogReplicaRouter, primary_reads
+from store.testing import QueryBudgetMixin
+from store.templatetags.store_tags import picture
+from store.views import place_order
+from store.models import Address, Category, Product, Cart, Order, OrderLine, RelatedProduct, SalesRollup, StockReservation
+
+
+# An order of `products` (one line each, at their current price)
+def make_order(user, address, products, quantity=1, **fields):
+    order = Order.objects.create(user=user, address=address, total=sum(product.price * quantity for product in products), **fields)
+    OrderLine.objects.bulk_create([
+        OrderLine(order=order, product=product, category_id=product.category_id, title=product.title, unit_price=product.price,
+                  quantity=quantity, line_total=product.price * quantity)
+        for product in products
+    ])
+    return order
+
+
+# Shared fixtures: one active category with a few products and a logged in customer with an address.
+# Sessions and users are cached as they are with a shared cache (STORE_REDIS_URL); the tests run in one
+# process, where the local memory caches are just as good.
+@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.cached_db", STORE_USER_CACHE_TIMEOUT=60 * 5)
+class StoreTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title="Shoes", slug="shoes", is_active=True, is_featured=True)
+        cls.products = [
+            Product.objects.create(category=cls.category, title="Shoe %d" % i, slug="shoe-%d" % i, sku="SHOE-%d" % i,
+                                   short_description="A shoe", price=Decimal("10.50") * (i + 1), is_active=True, is_featured=True)
+            for i in range(12)
+        ]
+        cls.user = User.objects.create_user(username="customer", password="password")
+        cls.address = Address.objects.create(user=cls.user, location="Home", street_address="1 Main St", city="Town", state="ST")
+
+    def setUp(self):
+        cache.clear()
+        caches["carts"].clear()
+        self.client.force_login(self.user)
+
+    def fill_cart(self, lines):
+        for product in self.products[:lines]:
+            Cart.objects.create(user=self.user, product=product, quantity=2)
+
+
+class CartPageTests(StoreTestCase):
+    def test_totals_are_computed_by_the_database(self):
+        self.fill_cart(3)
+        response = self.client.get(reverse("store:cart"))
+        # 2 x (10.50 + 21.00 + 31.50)
+        self.assertEqual(response.context["cart_cost"], Decimal("126.00"))
+        self.assertEqual(response.context["shipping_cost"], Decimal("10"))
+        self.assertEqual(response.context["total_cost"], Decimal("136.00"))
+
+    def test_empty_cart_totals(self):
+        response = self.client.get(reverse("store:cart"))
+        self.assertEqual(response.context["cart_cost"], Decimal("0"))
+        self.assertEqual(response.context["total_cost"], Decimal("10"))
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        self.fill_cart(1)
+        self.client.get(reverse("store:cart"))
+        with self.assertNumQueries(3):
+            self.client.get(reverse("store:cart"))
+        Cart.objects.all().delete()
+        self.fill_cart(12)
+        with self.assertNumQueries(3):
+            self.client.get(reverse("store:cart"))
+
+
+class CartBadgeTests(StoreTestCase):
+    def test_badge_is_cached(self):
+        self.fill_cart(2)
+        self.assertEqual(self.client.get(reverse("store:home")).context["cart_count"], 2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("store:home"))
+        self.assertEqual(response.context["cart_count"], 2)
+        self.assertFalse([q for q in queries.captured_queries if "store_cart" in q["sql"]])
+
+    def test_cart_changes_invalidate_badge(self):
+        self.fill_cart(1)
+        self.assertEqual(self.client.get(reverse("store:home")).context["cart_count"], 1)
+        self.client.get(reverse("store:add-to-cart"), {"prod_id": self.products[5].id})
+        self.assertEqual(self.client.get(reverse("store:home")).context["cart_count"], 2)
+        cart_item = Cart.objects.get(product=self.products[5])
+        self.client.get(reverse("store:remove-from-cart", args=[cart_item.id]))
+        self.assertEqual(self.client.get(reverse("store:home")).context["cart_count"], 1)
+        self.client.get(reverse("store:checkout"), {"address": self.address.id})
+        self.assertEqual(self.client.get(reverse("store:home")).context["cart_count"], 0)
+
+
+class CategoryMenuTests(StoreTestCase):
+    def test_menu_served_without_queries_when_warm(self):
+        self.client.get(reverse("store:home"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("store:home"))
+        self.assertEqual([c["slug"] for c in response.context["categories_menu"]], ["shoes"])
+        self.assertEqual(len([q for q in queries.captured_queries if "store_category" in q["sql"]]), 1)  # home's featured categories only
+
+    def test_category_changes_bump_menu_version(self):
+        self.client.get(reverse("store:home"))
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(title="Hats", slug="hats", is_active=True, is_featured=False)
+        response = self.client.get(reverse("store:home"))
+        self.assertEqual([c["slug"] for c in response.context["categories_menu"]], ["hats", "shoes"])
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.get(slug="hats").delete()
+        response = self.client.get(reverse("store:home"))
+        self.assertEqual([c["slug"] for c in response.context["categories_menu"]], ["shoes"])
+
+
+class PageCacheTests(StoreTestCase):
+    def setUp(self):
+        cache.clear()
+        caches["carts"].clear()
+
+    def test_anonymous_pages_are_cached_until_the_catalog_changes(self):
+        url = reverse("store:category-products", args=["shoes"])
+        self.assertEqual(self.client.get(url)["X-Page-Cache"], "miss")
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertContains(response, "Shoe 3")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.products[3]
+            product.title = "Renamed shoe"
+            product.save()
+        response = self.client.get(url)
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertContains(response, "Renamed shoe")
+        self.assertEqual(get_stats()["page"]["hits"], 1)
+        self.assertEqual(get_stats()["page"]["misses"], 2)
+
+    def test_logged_in_users_get_fresh_pages_with_cached_cards(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("store:home"))
+        self.assertNotIn("X-Page-Cache", response)
+        self.client.get(reverse("store:home"))
+        self.assertEqual(get_stats()["fragment"]["hits"], 8)
+
+
+class ConditionalGetTests(StoreTestCase):
+    def setUp(self):
+        cache.clear()
+        caches["carts"].clear()
+
+    def test_unchanged_product_page_is_not_rendered(self):
+        url = reverse("store:product-detail", args=["shoe-3"])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "public, max-age=0, s-maxage=60")
+        self.assertEqual(response["Vary"], "Cookie")
+        self.assertEqual(response["Last-Modified"], http_date(self.products[3].updated_at.timestamp()))
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached["ETag"], response["ETag"])
+        self.assertEqual(cached.templates, [])
+        since = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(since.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[3].save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], response["ETag"])
+
+    def test_category_page_changes_with_its_products(self):
+        url = reverse("store:category-products", args=["shoes"])
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.assertNotEqual(self.client.get(url, {"min_price": "20"})["ETag"], response["ETag"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(category=self.category, title="New shoe", slug="new-shoe", sku="SHOE-NEW",
+                                             short_description="", price=Decimal("5.00"), is_active=True, is_featured=False)
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertContains(changed, "New shoe")
+        self.assertEqual(changed["Last-Modified"], http_date(product.updated_at.timestamp()))
+
+    def test_logged_in_pages_are_private_and_follow_the_cart(self):
+        self.client.force_login(self.user)
+        url = reverse("store:product-detail", args=["shoe-3"])
+        response = self.client.get(url)
+        self.assertEqual(response["Cache-Control"], "private, max-age=0")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+        self.client.get(reverse("store:add-to-cart"), {"prod_id": self.products[0].id})
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertContains(changed, 'id="cart-count">(1)')
+
+    def test_another_user_does_not_get_the_previous_users_page(self):
+        url = reverse("store:product-detail", args=["shoe-3"])
+        self.client.force_login(self.user)
+        etag = self.client.get(url)["ETag"]
+        self.client.force_login(User.objects.create_user(username="other", password="password"))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_missing_product(self):
+        self.assertEqual(self.client.get(reverse("store:product-detail", args=["no-such-shoe"])).status_code, 404)
+
+
+class ImageDerivativeTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_variants_are_looked_up_once_per_images_version(self):
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            self.assertEqual(available_variants("product/bag.jpg", "card"), {})
+            target = derivative_path("product/bag.jpg", "card", "webp")
+            os.makedirs(os.path.dirname(target))
+            open(target, "wb").close()
+            self.assertEqual(available_variants("product/bag.jpg", "card"), {})
+            derivatives_written()
+            self.assertEqual(available_variants("product/bag.jpg", "card"), {"webp": "derivatives/product/bag-400w.webp"})
+            self.assertEqual(available_variants("product/bag.jpg", "thumb"), {})
+
+    def test_finished_jobs_invalidate_pages_and_failures_are_logged(self):
+        catalog, images = get_version("catalog"), get_version("images")
+        done = Future()
+        done.set_result(6)
+        _derivatives_done("product/bag.jpg", done)
+        self.assertEqual((get_version("catalog"), get_version("images")), (catalog + 1, images + 1))
+
+        failed = Future()
+        failed.set_exception(OSError("cannot identify image file"))
+        with self.assertLogs("store.images", "ERROR") as logs:
+            _derivatives_done("product/bag.jpg", failed)
+        self.assertIn("product/bag.jpg", logs.output[0])
+        self.assertEqual(get_version("catalog"), catalog + 1)
+
+    def test_derivatives_are_generated_once_per_upload(self):
+        from PIL import Image
+
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            os.makedirs(os.path.join(media, "product"))
+            Image.new("RGBA", (1000, 500), (200, 30, 30, 255)).save(os.path.join(media, "product", "bag.png"))
+            # three widths in two formats
+            self.assertEqual(generate_derivatives("product/bag.png"), 6)
+            with Image.open(derivative_path("product/bag.png", "card", "webp")) as card:
+                self.assertEqual((card.format, card.size), ("WEBP", (400, 200)))
+            with Image.open(derivative_path("product/bag.png", "thumb", "jpg")) as thumb:
+                self.assertEqual((thumb.format, thumb.mode, thumb.size), ("JPEG", "RGB", (160, 80)))
+            self.assertEqual(generate_derivatives("product/bag.png"), 0)
+            self.assertEqual(generate_derivatives("product/bag.png", force=True), 6)
+            self.assertFalse([name for _, _, names in os.walk(media) for name in names if name.endswith(".tmp")])
+
+    def test_picture_falls_back_to_the_original_until_variants_exist(self):
+        image = Product(product_image="product/bag.jpg").product_image
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            self.assertHTMLEqual(picture(image, "card", alt="Bag"), '<img class="" src="/media/product/bag.jpg" alt="Bag">')
+            for ext in ("jpg", "webp"):
+                target = derivative_path("product/bag.jpg", "card", ext)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                open(target, "wb").close()
+            derivatives_written()
+            self.assertHTMLEqual(
+                picture(image, "card", alt="Bag", css_class="img-fluid", width=70),
+                '<picture><source type="image/webp" srcset="/media/derivatives/product/bag-400w.webp">'
+                '<img class="img-fluid" src="/media/derivatives/product/bag-400w.jpg" alt="Bag" width="70"></picture>')
+
+    def test_spawned_workers_run_without_the_app_registry(self):
+        # a fresh interpreter that only imports the worker module, as the pool starts it
+        with new_executor(1) as executor:
+            self.assertEqual(executor.submit(generate_derivatives, "product/missing.jpg").result(timeout=60), 0)
+        self.assertEqual(executor._mp_context.get_start_method(), "spawn")
+
+
+class FileServingTests(TestCase):
+    url = "/media/product/backpack.jpg"
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(len(b"".join(response.streaming_content)), 10)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE="bytes=99999999-").status_code, 416)
+
+    def test_missing_files_and_paths_outside_the_root_are_not_found(self):
+        self.assertEqual(self.client.get("/media/product/missing.jpg").status_code, 404)
+        with tempfile.TemporaryDirectory() as root:
+            with self.assertRaises(Http404):
+                serving.serve(RequestFactory().get("/static/"), "../settings.py", root, 3600)
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag).status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b"".join(response.streaming_content)), int(response["Content-Length"]))
+
+    def serve(self, root, path, **headers):
+        response = serving.serve(RequestFactory().get("/static/" + path, **headers), path, root, 3600)
+        return response, b"".join(response.streaming_content) if response.status_code != 304 else b""
+
+    def test_precompressed_variant_follows_accept_encoding(self):
+        with tempfile.TemporaryDirectory() as root:
+            for suffix, content in (("", b"body { color: red }"), (".gz", b"gzipped"), (".br", b"brotli")):
+                with open(os.path.join(root, "site.css" + suffix), "wb") as f:
+                    f.write(content)
+            response, body = self.serve(root, "site.css", HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+            self.assertEqual((response["Content-Encoding"], body), ("br", b"brotli"))
+            self.assertEqual(response["Content-Type"], "text/css")
+            self.assertEqual(response["Vary"], "Accept-Encoding")
+            response, body = self.serve(root, "site.css", HTTP_ACCEPT_ENCODING="gzip, br;q=0")
+            self.assertEqual((response["Content-Encoding"], body), ("gzip", b"gzipped"))
+            plain, body = self.serve(root, "site.css")
+            self.assertFalse(plain.has_header("Content-Encoding"))
+            self.assertEqual(body, b"body { color: red }")
+            self.assertNotEqual(plain["ETag"], response["ETag"])
+            # ranges are served from the identity file
+            response, body = self.serve(root, "site.css", HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=0-3")
+            self.assertEqual((response.status_code, body), (206, b"body"))
+            self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_collected_files_get_hashed_names_cached_forever(self):
+        with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(source, "css"))
+            with open(os.path.join(source, "css", "site.css"), "w") as f:
+                f.write("body { background: url('../img/missing.png') }\n" * 20)
+            storage = CompressedManifestStaticFilesStorage(location=root, base_url="/static/")
+            with open(os.path.join(source, "css", "site.css"), "rb") as f:
+                storage.save("css/site.css", File(f))
+            list(storage.post_process({"css/site.css": (FileSystemStorage(location=source), "css/site.css")}))
+
+            hashed = storage.stored_name("css/site.css")
+            self.assertRegex(hashed, r"^css/site\.[0-9a-f]{12}\.css$")
+            self.assertTrue(os.path.isfile(os.path.join(root, hashed + ".gz")))
+            response, _ = self.serve(root, hashed, HTTP_ACCEPT_ENCODING="gzip")
+            self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            response, _ = self.serve(root, "css/site.css")
+            self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+
+
+# Query plans of the hot view queries must use an index (and not sort in a temp b-tree). The planner
+# works from ANALYZE statistics, so the catalog size matters; run the full check with
+#   STORE_EXPLAIN_PRODUCTS=1000000 python manage.py test store.tests.QueryPlanTests
+class QueryPlanTests(TestCase):
+    products = int(os.environ.get("STORE_EXPLAIN_PRODUCTS", 5000))
+    categories = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        Category.objects.bulk_create([
+            Category(title="Category %d" % i, slug="category-%d" % i, is_active=i % 10 != 0, is_featured=i % 20 == 0)
+            for i in range(cls.categories)
+        ])
+        category_ids = list(Category.objects.values_list("id", flat=True))
+        batch = []
+        for i in range(cls.products):
+            batch.append(Product(category_id=category_ids[i % cls.categories], title="Product %d" % i, slug="product-%d" % i,
+                                 sku="SKU-%d" % i, short_description="", price=Decimal("1.00"),
+                                 is_active=i % 10 != 0, is_featured=i % 50 == 0))
+            if len(batch) == 10000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+        cls.user = User.objects.create_user(username="customer", password="password")
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan, plan)
+        self.assertNotIn("TEMP B-TREE", plan, plan)
+
+    def test_category_by_slug(self):
+        self.assertUsesIndex(Category.objects.filter(slug="category-7"), "sqlite_autoindex_store_category")
+
+    def test_category_menu(self):
+        self.assertUsesIndex(Category.objects.filter(is_active=True), "category_active_idx")
+
+    def test_home_categories(self):
+        self.assertUsesIndex(Category.objects.filter(is_active=True, is_featured=True)[:3], "category_active_idx")
+
+    def test_home_products(self):
+        self.assertUsesIndex(Product.objects.filter(is_active=True, is_featured=True)[:8], "product_featured_idx")
+
+    def test_category_products_deep_page(self):
+        category = Category.objects.get(slug="category-7")
+        products = filter_products(category).order_by("-created_at", "-id")
+        product = products[products.count() // 2]
+        page = products.filter(created_at__lte=product.created_at).exclude(created_at=product.created_at, id__gte=product.id)[:13]
+        self.assertUsesIndex(page, "product_category_active_idx")
+
+    def test_shop_deep_page(self):
+        products = filter_products().order_by("-created_at", "-id")
+        product = products[self.products // 2]
+        page = products.filter(created_at__lte=product.created_at).exclude(created_at=product.created_at, id__gte=product.id)[:13]
+        self.assertUsesIndex(page, "product_active_idx")
+
+    def test_product_by_slug(self):
+        # get_object_or_404 drops the default ordering, so does this
+        self.assertUsesIndex(Product.objects.filter(slug="product-42").order_by(), "store_product_slug")
+
+    def test_cart_line_lookup(self):
+        # sqlite builds the unique constraint into the table, its index is named sqlite_autoindex_*
+        self.assertUsesIndex(Cart.objects.filter(product=1, user=self.user), "sqlite_autoindex_store_cart")
+
+    def test_order_history(self):
+        self.assertUsesIndex(Order.objects.filter(user=self.user).order_by("-ordered_date"), "order_user_date_idx")
+
+    def test_category_page_state(self):
+        with CaptureQueriesContext(connection) as queries:
+            category_page_state("category-7")
+        plan = connection.cursor().execute("EXPLAIN QUERY PLAN " + queries[0]["sql"]).fetchall()
+        self.assertIn("product_category_updated_idx", str(plan))
+
+
+class SearchTests(StoreTestCase):
+    def test_ranked_prefix_search(self):
+        Product.objects.create(category=self.category, title="Black Converse", slug="black-converse", sku="CONV-1",
+                               short_description="Canvas sneaker", price=Decimal("50"), is_active=True, is_featured=False)
+        Product.objects.create(category=self.category, title="Bag", slug="bag", sku="BAG-1",
+                               short_description="Fits a pair of converse", price=Decimal("20"), is_active=True, is_featured=False)
+        self.assertEqual([p.slug for p in search_products("conv")], ["black-converse", "bag"])
+        self.assertEqual([p.slug for p in search_products("black conv")], ["black-converse"])
+
+    def test_index_follows_product_and_category_changes(self):
+        product = self.products[0]
+        product.title = "Oxford loafer"
+        product.save()
+        self.assertEqual([p.slug for p in search_products("oxford")], ["shoe-0"])
+        Category.objects.filter(id=self.category.id).update(title="Footwear")
+        self.assertEqual(len(search_products("footwear")), 12)
+        product.delete()
+        self.assertEqual(search_products("oxford"), [])
+
+    def test_search_page_and_suggestions(self):
+        response = self.client.get(reverse("store:search"), {"q": "shoe 1"})
+        self.assertContains(response, "Shoe 10")
+        response = self.client.get(reverse("store:search-suggest"), {"q": "sho"})
+        self.assertEqual(len(response.json()["results"]), 8)
+        self.assertEqual(self.client.get(reverse("store:search"), {"q": 'NEAR("a" ") OR *'}).status_code, 200)
+
+
+class CatalogTests(StoreTestCase):
+    def test_keyset_pages_cover_the_category_once(self):
+        seen = []
+        page = paginate(filter_products(self.category), page_size=5)
+        while True:
+            seen += [p.slug for p in page["products"]]
+            if not page["has_next"]:
+                break
+            page = paginate(filter_products(self.category), after=page["next_cursor"], page_size=5)
+        self.assertEqual(sorted(seen), sorted(p.slug for p in self.products))
+        back = paginate(filter_products(self.category), before=page["previous_cursor"], page_size=5)
+        self.assertEqual([p.slug for p in back["products"]], seen[5:10])
+
+    def test_category_page_facets_and_pagination(self):
+        url = reverse("store:category-products", args=["shoes"])
+        response = self.client.get(url, {"min_price": "50", "max_price": "100"})
+        # prices are 10.50 x 1..12, five of them fall in [50, 100)
+        self.assertEqual(response.context["total"], 5)
+        self.assertEqual([r["count"] for r in response.context["facets"]["price_ranges"]], [2, 2, 5, 3, 0])
+        response = self.client.get(url)
+        self.assertEqual(len(response.context["products"]), 12)
+        self.assertFalse(response.context["has_next"])
+
+    def test_price_filters_snap_to_the_facet_buckets(self):
+        url = reverse("store:category-products", args=["shoes"])
+        response = self.client.get(url, {"min_price": "51.5", "max_price": "99"})
+        self.assertEqual((response.context["min_price"], response.context["max_price"]), (50, 100))
+        self.assertEqual(response.context["total"], 5)
+        response = self.client.get(url, {"min_price": "7", "max_price": "1e9"})
+        self.assertEqual((response.context["min_price"], response.context["max_price"]), (None, None))
+
+    def test_page_cache_key_ignores_unknown_parameters(self):
+        self.client.logout()
+        url = reverse("store:category-products", args=["shoes"])
+        self.assertEqual(self.client.get(url, {"min_price": "50"})["X-Page-Cache"], "miss")
+        self.assertEqual(self.client.get(url, {"min_price": "60", "utm_source": "mail"})["X-Page-Cache"], "hit")
+        self.assertEqual(self.client.get(url, {"after": "not-a-cursor", "x": "1"})["X-Page-Cache"], "miss")
+        self.assertEqual(self.client.get(url)["X-Page-Cache"], "hit")
+        self.assertEqual(self.client.get(reverse("store:home"), {"x": "1"})["X-Page-Cache"], "miss")
+        self.assertEqual(self.client.get(reverse("store:home"), {"y": "2"})["X-Page-Cache"], "hit")
+
+    def test_shop_lists_active_products(self):
+        response = self.client.get(reverse("store:shop"), {"after": "not-a-cursor"})
+        self.assertEqual(response.context["total"], 12)
+        self.assertEqual(len(response.context["products"]), 12)
+        self.assertFalse(response.context["has_previous"])
+
+
+class RecommendationTests(StoreTestCase):
+    def buy(self, username, *products):
+        user = User.objects.create_user(username=username)
+        address = Address.objects.create(user=user, location="Home", street_address="1 Main St", city="Town", state="ST")
+        make_order(user, address, products)
+
+    def related(self, product):
+        return list(RelatedProduct.objects.filter(product=product).values_list("related_id", "source"))
+
+    def test_bought_together_ranks_first_then_category(self):
+        shoes = self.products
+        self.buy("a", shoes[0], shoes[1], shoes[2])
+        self.buy("b", shoes[0], shoes[1])
+        self.buy("c", shoes[1], shoes[3])
+        self.assertEqual(refresh_recommendations(full=True), (12, 12 * 8))
+        related = self.related(shoes[0])
+        self.assertEqual(related[:2], [(shoes[1].id, "co-purchase"), (shoes[2].id, "co-purchase")])
+        self.assertEqual({source for _, source in related[2:]}, {"category"})
+        self.assertNotIn(shoes[0].id, [related_id for related_id, _ in related])
+
+        url = reverse("store:product-detail", args=[shoes[0].slug])
+        self.client.get(url)
+        # product (with its category) and the related products
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual([p.id for p in response.context["related_products"]][:2], [shoes[1].id, shoes[2].id])
+
+    def test_incremental_refresh_only_touches_affected_products(self):
+        shoes = self.products
+        self.buy("a", shoes[0], shoes[1])
+        refresh_recommendations(full=True)
+        self.assertEqual(refresh_recommendations(), (0, 0))
+        self.buy("b", shoes[4], shoes[5])
+        self.assertEqual(refresh_recommendations()[0], 2)
+        self.assertEqual(self.related(shoes[4])[0], (shoes[5].id, "co-purchase"))
+
+    def test_orders_without_lines_of_existing_products_are_skipped(self):
+        shoes = self.products
+        self.buy("a", shoes[0], shoes[1])
+        refresh_recommendations(full=True)
+        # an empty order (e.g. made in the admin) and one whose only product was deleted since
+        self.buy("b")
+        self.buy("c", shoes[11])
+        Product.objects.filter(id=shoes[11].id).delete()
+        self.assertEqual(refresh_recommendations(), (0, 0))
+        self.buy("d", shoes[4], shoes[5])
+        self.assertEqual(refresh_recommendations()[0], 2)
+
+    def test_inactive_products_are_not_recommended(self):
+        shoes = self.products
+        self.buy("a", shoes[0], shoes[1])
+        Product.objects.filter(id=shoes[1].id).update(is_active=False)
+        refresh_recommendations(full=True)
+        self.assertNotIn(shoes[1].id, [related_id for related_id, _ in self.related(shoes[0])])
+        self.assertFalse(self.related(shoes[1]))
+
+
+class OrderHistoryTests(StoreTestCase):
+    def place_orders(self, count, status="Pending"):
+        for i in range(count):
+            make_order(self.user, self.address, [self.products[i % 12]], status=status)
+
+    def test_query_count_does_not_depend_on_order_count(self):
+        self.place_orders(3)
+        url = reverse("store:orders")
+        self.client.get(url)
+        # the page of orders with their addresses, and the lines of those orders with their products
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        self.place_orders(60)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["orders"]), 20)
+        self.assertTrue(response.context["has_next"])
+
+    def test_pages_cover_the_history_once(self):
+        self.place_orders(45)
+        url = reverse("store:orders")
+        seen = []
+        response = self.client.get(url)
+        while True:
+            seen += [order.id for order in response.context["orders"]]
+            if not response.context["has_next"]:
+                break
+            response = self.client.get(url, {"after": response.context["next_cursor"]})
+        self.assertEqual(seen, sorted(Order.objects.values_list("id", flat=True), reverse=True))
+
+    def test_profile_summary(self):
+        self.place_orders(8)
+        self.place_orders(2, status="Delivered")
+        url = reverse("store:profile")
+        self.client.get(url)
+        # addresses, status counts, the latest orders and their lines
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["orders"]), 5)
+        self.assertEqual(response.context["order_count"], 10)
+        self.assertEqual(response.context["status_counts"], [("Pending", 8), ("Delivered", 2)])
+
+    def test_orders_require_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("store:orders")).status_code, 302)
+
+
+class InventoryTests(StoreTestCase):
+    def stock(self, product):
+        return Product.objects.get(id=product.id).stock
+
+    def held(self, product):
+        return StockReservation.objects.filter(user=self.user, product=product).values_list("quantity", flat=True).first()
+
+    def test_cart_holds_stock_and_checkout_sells_it(self):
+        shoe = self.products[0]
+        Product.objects.filter(id=shoe.id).update(stock=5)
+        state = self.client.post(reverse("store:api-cart-add"), {"prod_id": shoe.id, "quantity": 2}).json()
+        self.assertEqual((self.stock(shoe), self.held(shoe)), (3, 2))
+        line_url = lambda action: reverse("store:api-cart-line", args=[state["line"]["id"], action])
+        self.client.post(line_url("incr"))
+        self.assertEqual((self.stock(shoe), self.held(shoe)), (2, 3))
+        self.client.post(line_url("decr"))
+        self.assertEqual((self.stock(shoe), self.held(shoe)), (3, 2))
+
+        self.client.get(reverse("store:checkout"), {"address": self.address.id})
+        self.assertEqual((self.stock(shoe), self.held(shoe)), (3, None))
+        self.assertEqual(OrderLine.objects.get().quantity, 2)
+
+    def test_removing_a_line_puts_its_stock_back(self):
+        shoe = self.products[0]
+        Product.objects.filter(id=shoe.id).update(stock=5)
+        self.client.get(reverse("store:add-to-cart"), {"prod_id": shoe.id})
+        self.client.get(reverse("store:remove-from-cart", args=[Cart.objects.get().id]))
+        self.assertEqual((self.stock(shoe), self.held(shoe)), (5, None))
+
+    def test_adding_more_than_in_stock_is_refused(self):
+        shoe = self.products[0]
+        Product.objects.filter(id=shoe.id).update(stock=1)
+        response = self.client.post(reverse("store:api-cart-add"), {"prod_id": shoe.id, "quantity": 2})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["error"], "Only 1 of Shoe 0 left")
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual((self.stock(shoe), self.held(shoe)), (1, None))
+
+        self.client.get(reverse("store:add-to-cart"), {"prod_id": shoe.id})
+        response = self.client.get(reverse("store:incr-cart", args=[Cart.objects.get().id]), follow=True)
+        self.assertContains(response, "Shoe 0 is sold out")
+        self.assertEqual(Cart.objects.get().quantity, 1)
+
+        # guests hold nothing but can't cart more than there is either
+        self.client.logout()
+        response = self.client.post(reverse("store:api-cart-add"), {"prod_id": shoe.id})
+        self.assertEqual(response.status_code, 409)
+
+    def test_short_lines_fail_the_whole_checkout(self):
+        shoe, other = self.products[:2]
+        Product.objects.filter(id=shoe.id).update(stock=1)
+        # carted without a hold (e.g. merged from a guest cart)
+        Cart.objects.create(user=self.user, product=shoe, quantity=2)
+        Cart.objects.create(user=self.user, product=other, quantity=1)
+        response = self.client.get(reverse("store:checkout"), {"address": self.address.id}, follow=True)
+        self.assertRedirects(response, reverse("store:cart"))
+        self.assertContains(response, "Only 1 of Shoe 0 left")
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Cart.objects.count(), 2)
+        self.assertEqual(self.stock(shoe), 1)
+
+        Cart.objects.filter(product=shoe).update(quantity=1)
+        self.client.get(reverse("store:checkout"), {"address": self.address.id})
+        self.assertEqual(self.stock(shoe), 0)
+        self.assertEqual(Order.objects.get().lines.count(), 2)
+
+    def test_expired_reservations_are_released(self):
+        shoe = self.products[0]
+        Product.objects.filter(id=shoe.id).update(stock=3)
+        self.client.get(reverse("store:add-to-cart"), {"prod_id": shoe.id})
+        StockReservation.objects.update(expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        out = StringIO()
+        call_command("release_reservations", batch_size=1, stdout=out)
+        self.assertIn("1 expired reservations released, 1 units back in stock", out.getvalue())
+        self.assertEqual((self.stock(shoe), self.held(shoe)), (3, None))
+
+        # the line is still in the cart and takes its unit at checkout
+        self.client.get(reverse("store:checkout"), {"address": self.address.id})
+        self.assertEqual(self.stock(shoe), 2)
+
+    def test_merged_guest_carts_hold_stock(self):
+        shoe, boot = self.products[:2]
+        Product.objects.filter(id__in=[shoe.id, boot.id]).update(stock=5)
+        self.client.logout()
+        self.client.post(reverse("store:api-cart-add"), {"prod_id": shoe.id, "quantity": 2})
+        self.client.post(reverse("store:api-cart-add"), {"prod_id": boot.id})
+        Product.objects.filter(id=boot.id).update(stock=0)
+        self.client.post(reverse("store:login"), {"username": "customer", "password": "password"})
+        self.assertEqual((self.stock(shoe), self.held(shoe)), (3, 2))
+        # sold out since: carted without a hold, checkout reports it
+        self.assertEqual((self.stock(boot), self.held(boot)), (0, None))
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 2)
+
+    def test_deleting_a_customer_returns_their_held_stock(self):
+        shoe = self.products[0]
+        Product.objects.filter(id=shoe.id).update(stock=5)
+        self.client.post(reverse("store:api-cart-add"), {"prod_id": shoe.id, "quantity": 2})
+        User.objects.filter(id=self.user.id).delete()
+        self.assertEqual(self.stock(shoe), 5)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_guest_lines_of_deactivated_products_are_not_incremented(self):
+        shoe = self.products[0]
+        cart = GuestCart(SessionStore())
+        cart.add(shoe.id)
+        Product.objects.filter(id=shoe.id).update(is_active=False)
+        self.assertFalse(cart.increment(shoe.id))
+        self.assertEqual(cart.count(), 1)
+        self.assertEqual(get_guest_cart(cart.token), {shoe.id: 1})
+
+
+class CartApiTests(StoreTestCase):
+    def test_add_then_change_quantities(self):
+        url = reverse("store:api-cart-add")
+        state = self.client.post(url, {"prod_id": self.products[0].id}).json()
+        self.assertEqual(state["line"]["quantity"], 1)
+        state = self.client.post(url, {"prod_id": self.products[0].id, "quantity": 3}).json()
+        self.assertEqual(state["line"]["quantity"], 4)
+        self.assertEqual(state["line"]["line_total"], "42.00")
+        self.assertEqual((state["cart_count"], state["cart_cost"], state["total_cost"]), (1, "42.00", "52.00"))
+        self.assertEqual(Cart.objects.get().quantity, 4)
+
+        line_url = lambda action: reverse("store:api-cart-line", args=[state["line"]["id"], action])
+        # the line's product (its stock isn't tracked), the conditional update, the changed line and the totals
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.post(line_url("incr")).json()["line"]["quantity"], 5)
+        self.assertEqual(self.client.post(line_url("decr")).json()["line"]["quantity"], 4)
+        state = self.client.post(line_url("remove")).json()
+        self.assertIsNone(state["line"])
+        self.assertEqual((state["cart_count"], state["cart_cost"]), (0, "0.00"))
+
+    def test_decrementing_the_last_one_removes_the_line(self):
+        self.fill_cart(1)
+        line = Cart.objects.get()
+        line.quantity = 1
+        line.save()
+        state = self.client.post(reverse("store:api-cart-line", args=[line.id, "decr"])).json()
+        self.assertIsNone(state["line"])
+        self.assertFalse(Cart.objects.exists())
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.post(reverse("store:api-cart-add"), {"prod_id": 999}).status_code, 404)
+        self.assertEqual(self.client.post(reverse("store:api-cart-add"), {"prod_id": "x"}).status_code, 404)
+        self.assertEqual(self.client.post(reverse("store:api-cart-add"), {"prod_id": self.products[0].id, "quantity": 0}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("store:api-cart-add")).status_code, 405)
+        self.assertEqual(self.client.post(reverse("store:api-cart-line", args=[1, "explode"])).status_code, 404)
+
+    def test_other_users_cart_lines_are_untouched(self):
+        other = User.objects.create_user(username="other")
+        line = Cart.objects.create(user=other, product=self.products[0], quantity=2)
+        for action in ("incr", "decr", "remove"):
+            self.assertEqual(self.client.post(reverse("store:api-cart-line", args=[line.id, action])).status_code, 404)
+        self.client.get(reverse("store:remove-from-cart", args=[line.id]))
+        line.refresh_from_db()
+        self.assertEqual(line.quantity, 2)
+
+
+class GuestCartTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.logout()
+
+    def test_guest_carting_does_not_write_to_the_database(self):
+        self.client.get(reverse("store:add-to-cart"), {"prod_id": self.products[0].id})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("store:add-to-cart"), {"prod_id": self.products[0].id})
+            state = self.client.post(reverse("store:api-cart-add"), {"prod_id": self.products[1].id}).json()
+            self.client.post(reverse("store:api-cart-line", args=[self.products[0].id, "decr"]))
+        writes = [q["sql"] for q in queries.captured_queries if not q["sql"].startswith("SELECT")]
+        self.assertEqual(writes, [])
+        self.assertEqual((state["cart_count"], state["cart_cost"]), (2, "42.00"))
+
+        response = self.client.get(reverse("store:cart"))
+        self.assertEqual([(line.product_id, line.quantity) for line in response.context["cart_products"]],
+                         [(self.products[0].id, 1), (self.products[1].id, 1)])
+        self.assertEqual(response.context["total_cost"], Decimal("41.50"))
+        self.assertContains(response, "Log in to check out")
+        self.assertFalse(Cart.objects.exists())
+
+    def test_guest_cart_is_merged_on_login(self):
+        Cart.objects.create(user=self.user, product=self.products[0], quantity=2)
+        self.client.post(reverse("store:api-cart-add"), {"prod_id": self.products[0].id, "quantity": 3})
+        self.client.post(reverse("store:api-cart-add"), {"prod_id": self.products[1].id})
+        self.client.post(reverse("store:login"), {"username": "customer", "password": "password"})
+        self.assertEqual(dict(Cart.objects.filter(user=self.user).values_list("product_id", "quantity")),
+                         {self.products[0].id: 5, self.products[1].id: 1})
+        self.assertEqual(self.client.get(reverse("store:home")).context["cart_count"], 2)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("store:home")).context["cart_count"], 0)
+
+    def test_guests_with_a_cart_bypass_the_page_cache(self):
+        self.client.get(reverse("store:home"))
+        self.assertEqual(self.client.get(reverse("store:home"))["X-Page-Cache"], "hit")
+        self.client.get(reverse("store:add-to-cart"), {"prod_id": self.products[0].id})
+        response = self.client.get(reverse("store:home"))
+        self.assertFalse(response.has_header("X-Page-Cache"))
+        self.assertEqual(response.context["cart_count"], 1)
+
+
+class AsyncViewTests(StoreTestCase):
+    async def get(self, view, *args, user=None):
+        request = AsyncRequestFactory().get("/")
+        request.user = user or AnonymousUser()
+        request.session = SessionStore()
+        return await view(request, *args)
+
+    async def test_catalog_pages(self):
+        response = await self.get(async_views.home)
+        self.assertContains(response, "Shoe 11")
+        self.assertEqual((await self.get(async_views.home))["X-Page-Cache"], "hit")
+        self.assertContains(await self.get(async_views.all_categories), "Shoes")
+        self.assertContains(await self.get(async_views.category_products, "shoes"), "Shoe 0")
+        response = await self.get(async_views.detail, "shoe-3", user=self.user)
+        self.assertContains(response, "Shoe 3")
+        self.assertContains(response, "Shoe 4")
+
+    async def test_navbar_context(self):
+        await Cart.objects.acreate(user=self.user, product=self.products[0])
+        response = await self.get(async_views.detail, "shoe-0", user=self.user)
+        self.assertContains(response, 'id="cart-count">(1)')
+        self.assertContains(response, 'href="/shoes/"')
+
+    async def test_conditional_get(self):
+        response = await self.get(async_views.detail, "shoe-3")
+        request = AsyncRequestFactory().get("/", headers={"If-None-Match": response["ETag"]})
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        self.assertEqual((await async_views.detail(request, "shoe-3")).status_code, 304)
+
+    async def test_missing_pages(self):
+        with self.assertRaises(Http404):
+            await self.get(async_views.detail, "no-such-shoe")
+        with self.assertRaises(Http404):
+            await self.get(async_views.category_products, "no-such-category")
+
+
+class PerformanceTests(QueryBudgetMixin, StoreTestCase):
+    # queries per page for a logged in customer once the caches are warm (session and user included)
+    QUERY_BUDGETS = [
+        ("store:home", [], 2),
+        ("store:all-categories", [], 1),
+        ("store:category-products", ["shoes"], 2),
+        ("store:product-detail", ["shoe-1"], 3),
+        ("store:shop", [], 1),
+        ("store:search", [], 1),
+        ("store:cart", [], 3),
+        ("store:orders", [], 2),
+        ("store:profile", [], 4),
+    ]
+
+    def test_query_budgets(self):
+        self.fill_cart(3)
+        make_order(self.user, self.address, self.products[:2])
+        for name, args, budget in self.QUERY_BUDGETS:
+            url = reverse(name, args=args)
+            self.client.get(url, {"q": "shoe"})
+            with self.assertQueryBudget(budget, label=name):
+                self.assertEqual(self.client.get(url, {"q": "shoe"}).status_code, 200)
+
+    # (product, stock or None for untracked, units held) lines of two units each; the checkout's queries
+    def checkout_queries(self, lines):
+        Cart.objects.filter(user=self.user).delete()
+        for product, stock, held in lines:
+            Product.objects.filter(id=product.id).update(stock=stock)
+            Cart.objects.create(user=self.user, product=product, quantity=2)
+            if held:
+                reserve(self.user, product.id, held)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIsNotNone(place_order(self.user, self.address))
+        return len(queries)
+
+    def test_checkout_queries_do_not_depend_on_cart_size(self):
+        shoes = self.products
+        # untracked stock: nothing to sell
+        self.assertEqual(self.checkout_queries([(shoes[0], None, 0)]),
+                         self.checkout_queries([(shoe, None, 0) for shoe in shoes]))
+        # tracked stock, all of it held for the customer
+        self.assertEqual(self.checkout_queries([(shoes[0], 10, 2)]),
+                         self.checkout_queries([(shoe, 10, 2) for shoe in shoes[:6]] + [(shoe, None, 0) for shoe in shoes[6:]]))
+        # and partly held: the rest is taken off the stock
+        self.assertEqual(self.checkout_queries([(shoes[0], 10, 1)]),
+                         self.checkout_queries([(shoes[0], 10, 1), (shoes[1], 10, 2), (shoes[2], 10, 0)] + [(shoe, None, 0) for shoe in shoes[3:]]))
+
+    def test_server_timing_header(self):
+        timing = self.client.get(reverse("store:home"))["Server-Timing"]
+        for metric in ("db;dur=", "tpl;dur=", "store_menu;dur=", "cart_menu;dur=", "total;dur="):
+            self.assertIn(metric, timing)
+
+    @override_settings(STORE_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs("store.performance", "WARNING") as logs:
+            self.client.get(reverse("store:cart"))
+        self.assertIn("Slow request GET /cart/", logs.output[0])
+
+    def test_repeated_queries_are_detected(self):
+        with collect() as stats:
+            for product in self.products[:6]:
+                Product.objects.get(id=product.id)
+        [(sql, count)] = stats.duplicate_queries()
+        self.assertEqual(count, 6)
+        self.assertIn("store_product", sql)
+
+
+class GenerateDataTests(TestCase):
+    def test_generates_a_consistent_dataset(self):
+        out = StringIO()
+        call_command("generate_data", users=20, categories=3, products=60, carts=30, orders=100, batch_size=16, stdout=out)
+        self.assertIn("Generated 20 customers", out.getvalue())
+        self.assertEqual(Category.objects.filter(slug__startswith="synthetic-").count(), 3)
+        self.assertEqual(Product.objects.filter(sku__startswith="SYNTHETIC-").count(), 60)
+        self.assertEqual(Address.objects.filter(user__username__startswith="synthetic-").count(), 20)
+        self.assertEqual(Order.objects.count(), 100)
+        self.assertEqual(Order.objects.filter(lines__isnull=False).distinct().count(), 100)
+        self.assertFalse(OrderLine.objects.filter(product__is_active=False).exists())
+        self.assertTrue(all(line.line_total == line.unit_price * line.quantity for line in OrderLine.objects.all()))
+        order = Order.objects.first()
+        self.assertEqual(order.total, sum(line.line_total for line in order.lines.all()))
+        self.assertFalse(Order.objects.exclude(address__user=F("user")).exists())
+        self.assertGreater(len(set(Order.objects.values_list("ordered_date__date", flat=True))), 1)
+        self.assertTrue(0 < Cart.objects.count() <= 30)
+
+        with self.assertRaisesMessage(CommandError, "--prefix"):
+            call_command("generate_data", users=1, categories=1, products=1, carts=0, orders=0, stdout=StringIO())
+        call_command("generate_data", users=1, categories=1, products=1, carts=0, orders=0, prefix="more", stdout=StringIO())
+        self.assertTrue(User.objects.filter(username="more-0").exists())
+
+
+class CatalogSyncTests(StoreTestCase):
+    def run_import(self, text, *args):
+        path = os.path.join(self.tmp, "import.csv")
+        with open(path, "w") as file:
+            file.write(text)
+        out = StringIO()
+        call_command("import_products", path, *args, stdout=out, stderr=out)
+        return out.getvalue()
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def test_export_import_round_trip_changes_nothing(self):
+        for format in ("csv", "jsonl"):
+            path = os.path.join(self.tmp, "products." + format)
+            call_command("export_products", path, stderr=StringIO())
+            out = StringIO()
+            call_command("import_products", path, "--dry-run", stdout=out)
+            self.assertIn("12 rows", out.getvalue())
+            self.assertIn("0 created, 0 updated, 12 unchanged, 0 errors", out.getvalue())
+
+    def test_upsert_by_sku(self):
+        Category.objects.create(title="Boots", slug="boots", is_active=True, is_featured=False)
+        text = ("sku,title,category,price,is_active\n"
+                "SHOE-0,Shoe 0,shoes,99.99,1\n"
+                "SHOE-1,Shoe 1,boots,21.00,0\n"
+                "BOOT-1,Winter Boot,boots,45,yes\n")
+        with CaptureQueriesContext(connection) as queries:
+            out = self.run_import(text, "--batch-size", "10")
+        self.assertIn("1 created, 2 updated, 0 unchanged, 0 errors", out)
+        # categories, the stored products of the batch and one upsert (in a transaction)
+        self.assertEqual(len([q for q in queries if not q["sql"].startswith(("SAVEPOINT", "RELEASE"))]), 3)
+
+        shoe = Product.objects.get(sku="SHOE-0")
+        self.assertEqual((shoe.price, shoe.short_description, shoe.slug), (Decimal("99.99"), "A shoe", "shoe-0"))
+        shoe = Product.objects.select_related("category").get(sku="SHOE-1")
+        self.assertEqual((shoe.category.slug, shoe.is_active), ("boots", False))
+        boot = Product.objects.get(sku="BOOT-1")
+        self.assertEqual((boot.slug, boot.price, boot.is_active, boot.is_featured), ("winter-boot", Decimal("45"), True, False))
+        self.assertTrue(search_products("winter"))
+
+    def test_dry_run_reports_a_diff_and_writes_nothing(self):
+        out = self.run_import("sku,price\nSHOE-0,1.00\nNEW-1,2.00\n", "--dry-run")
+        self.assertIn("~ SHOE-0 price: Decimal('10.50') -> Decimal('1.00')", out)
+        self.assertIn("new product without title, category", out)
+        self.assertEqual(Product.objects.get(sku="SHOE-0").price, Decimal("10.50"))
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        out = self.run_import("sku,title,category,price\n,No sku,shoes,1\nX-1,Bad,shoes,cheap\nX-2,Lost,hats,1\nX-3,Good,shoes,3\n")
+        self.assertIn("1 created, 0 updated, 0 unchanged, 3 errors", out)
+        self.assertIn("line 3 X-1: not a price: 'cheap'", out)
+        self.assertIn("line 4 X-2: unknown category 'hats'", out)
+        self.assertEqual(list(Product.objects.filter(sku__startswith="X-").values_list("sku", flat=True)), ["X-3"])
+
+    def test_invalid_json_lines_are_reported_and_skipped(self):
+        text = '{"sku": "SHOE-0", "price": "1.00"}\n{"sku": "SHOE-1", "price": \n["SHOE-2"]\n"SHOE-3"\n{"sku": "SHOE-4", "price": "4.00"}\n'
+        out = self.run_import(text, "--format", "jsonl")
+        self.assertIn("0 created, 2 updated, 0 unchanged, 3 errors", out)
+        self.assertIn("line 2 : invalid JSON: Expecting value", out)
+        self.assertIn('line 3 : not an object: ["SHOE-2"]', out)
+        self.assertIn('line 4 : not an object: "SHOE-3"', out)
+        self.assertEqual(Product.objects.get(sku="SHOE-4").price, Decimal("4.00"))
+
+    def test_catalog_version_is_bumped_after_every_written_batch(self):
+        version = get_version("catalog")
+        results = import_rows([(1, {"sku": "SHOE-0", "price": "1.00"}), (2, {"sku": "SHOE-1", "price": "2.00"})], batch_size=1)
+        next(results)
+        # the first batch is committed, cached pages must not wait for the rest of the import
+        self.assertEqual(get_version("catalog"), version + 1)
+        next(results)
+        self.assertEqual(get_version("catalog"), version + 2)
+
+    def test_import_invalidates_cached_catalog_pages(self):
+        self.client.logout()
+        url = reverse("store:category-products", args=["shoes"])
+        self.client.get(url)
+        self.run_import("sku,title\nSHOE-11,Renamed Shoe\n")
+        self.assertContains(self.client.get(url), "Renamed Shoe")
+
+    def test_unknown_columns_are_rejected(self):
+        with self.assertRaisesMessage(CommandError, "Unknown columns: colour"):
+            self.run_import("sku,colour\nSHOE-0,red\n")
+
+
+class AdminTests(QueryBudgetMixin, StoreTestCase):
+    # session, user, the navbar context (category menu, cart count), the paginator's estimate and
+    # bounded count and the page of rows with their FKs, plus the category list_filter choices for
+    # products; none of it grows with the rows shown
+    CHANGELIST_BUDGETS = [
+        ("admin:store_product_changelist", 8),
+        ("admin:store_cart_changelist", 7),
+        ("admin:store_order_changelist", 7),
+        ("admin:store_address_changelist", 7),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(self.admin)
+        for i in range(15):
+            user = User.objects.create_user(username="buyer-%d" % i)
+            address = Address.objects.create(user=user, location="Home", street_address="%d Main St" % i, city="Town", state="ST")
+            Cart.objects.create(user=user, product=self.products[i % 12])
+            make_order(user, address, [self.products[i % 12]])
+
+    def test_changelist_query_budgets(self):
+        for name, budget in self.CHANGELIST_BUDGETS:
+            url = reverse(name)
+            with self.assertQueryBudget(budget, label=name):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(STORE_ADMIN_COUNT_LIMIT=5)
+    def test_large_tables_are_not_counted(self):
+        response = self.client.get(reverse("admin:store_order_changelist"))
+        self.assertEqual(response.context["cl"].result_count, Order.objects.aggregate(Max("id"))["id__max"])
+        # a filtered list counts up to the limit only
+        response = self.client.get(reverse("admin:store_order_changelist"), {"status__exact": "Pending"})
+        self.assertEqual(response.context["cl"].result_count, 6)
+        self.assertIsNone(response.context["cl"].full_result_count)
+
+    def test_search_uses_exact_keys_and_full_text(self):
+        url = reverse("admin:store_product_changelist")
+        self.assertEqual(list(self.client.get(url, {"q": "SHOE-3"}).context["cl"].result_list), [self.products[3]])
+        self.assertEqual(self.client.get(url, {"q": "shoe"}).context["cl"].result_count, 12)
+        response = self.client.get(reverse("admin:store_order_changelist"), {"q": "buyer-4"})
+        self.assertEqual([order.user.username for order in response.context["cl"].result_list], ["buyer-4"])
+        response = self.client.get(reverse("admin:store_order_changelist"), {"q": "SHOE-4"})
+        self.assertEqual([order.user.username for order in response.context["cl"].result_list], ["buyer-4"])
+
+    def test_product_autocomplete(self):
+        response = self.client.get(reverse("admin:autocomplete"), {
+            "app_label": "store", "model_name": "cart", "field_name": "product", "term": "shoe 1",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Shoe 1", [result["text"] for result in response.json()["results"]])
+
+
+class SalesRollupTests(QueryBudgetMixin, StoreTestCase):
+    def rollups(self):
+        return {
+            (row.category_id, row.status): (row.orders, row.quantity, row.revenue_cents)
+            for row in SalesRollup.objects.all()
+        }
+
+    def checkout(self, *products):
+        for product in products:
+            Cart.objects.create(user=self.user, product=product, quantity=2)
+        self.client.get(reverse("store:checkout"), {"address": self.address.id})
+        return Order.objects.latest("id")
+
+    def test_checkout_and_status_edits_keep_rollups_in_sync(self):
+        first = self.checkout(*self.products[:3])
+        # one order of 2 each of 10.50, 21.00 and 31.50
+        self.assertEqual(self.rollups(), {(self.category.id, "Pending"): (1, 6, 12600)})
+        second = self.checkout(self.products[1])
+        self.assertEqual(self.rollups(), {(self.category.id, "Pending"): (2, 8, 16800)})
+
+        # moving an order moves what was paid for it, not what it would cost today
+        Product.objects.filter(id=self.products[0].id).update(price=Decimal("99.00"))
+        admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(admin)
+        data = {
+            "form-TOTAL_FORMS": "2", "form-INITIAL_FORMS": "2", "_save": "Save",
+            "form-0-id": second.id, "form-0-status": "Pending",
+            "form-1-id": first.id, "form-1-status": "Delivered",
+        }
+        response = self.client.post(reverse("admin:store_order_changelist"), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.rollups(), {
+            (self.category.id, "Pending"): (1, 2, 4200),
+            (self.category.id, "Delivered"): (1, 6, 12600),
+        })
+
+        Order.objects.get(id=second.id).delete()
+        self.assertEqual(self.rollups()[(self.category.id, "Pending")], (0, 0, 0))
+        self.assertFalse(OrderLine.objects.filter(order_id=second.id).exists())
+
+    def test_orders_are_counted_once_across_categories(self):
+        boots = Category.objects.create(title="Boots", slug="boots", is_active=True, is_featured=False)
+        boot = Product.objects.create(category=boots, title="Boot", slug="boot", sku="BOOT", short_description="A boot",
+                                      price=Decimal("50.00"), is_active=True, is_featured=False)
+        self.checkout(self.products[0], boot)
+        self.assertEqual(self.rollups(), {
+            (self.category.id, "Pending"): (1, 2, 2100),
+            (boots.id, "Pending"): (0, 2, 10000),
+        })
+        report = sales_report(datetime.date.min, datetime.date.max)
+        self.assertEqual((report["totals"]["orders"], report["totals"]["revenue"]), (1, Decimal("121.00")))
+
+    def test_edits_after_products_move_or_go_use_the_checkout_category(self):
+        boots = Category.objects.create(title="Boots", slug="boots", is_active=True, is_featured=False)
+        order = self.checkout(*self.products[:2])
+        moved, deleted = self.products[:2]
+        moved.category = boots
+        moved.save()
+        deleted.delete()
+        order = Order.objects.get(id=order.id)
+        order.status = "Delivered"
+        order.save()
+        self.assertEqual(self.rollups(), {
+            (self.category.id, "Pending"): (0, 0, 0),
+            (self.category.id, "Delivered"): (1, 4, 6300),
+        })
+        call_command("backfill_sales_rollups", stdout=StringIO())
+        self.assertEqual(self.rollups(), {(self.category.id, "Delivered"): (1, 4, 6300)})
+
+    def test_backfill_matches_incremental_rollups(self):
+        order = self.checkout(*self.products[:5])
+        self.checkout(self.products[5])
+        self.checkout(self.products[6], self.products[7])
+        order.status = "Cancelled"
+        order.save()
+        incremental = self.rollups()
+        out = StringIO()
+        call_command("backfill_sales_rollups", batch_size=2, stdout=out)
+        self.assertIn("3 orders summed into 2 rollup rows", out.getvalue())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_dashboard_reads_rollups_only(self):
+        self.fill_cart(2)
+        self.client.get(reverse("store:checkout"), {"address": self.address.id})
+        admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(admin)
+        with self.assertQueryBudget(10) as stats:
+            response = self.client.get(reverse("admin:store_salesrollup_changelist"), {"days": 7})
+        self.assertFalse([sql for sql, _ in stats.queries if "store_order" in sql])
+        self.assertEqual(response.context["report"]["totals"]["revenue"], Decimal("63.00"))
+        self.assertContains(response, "$63.00")
+        self.assertContains(response, "Shoes")
+
+
+@override_settings(STORE_DB_READ_ALIAS="replica")
+class RouterTests(SimpleTestCase):
+    def test_catalog_reads_go_to_the_replica(self):
+        router = CatalogReplicaRouter()
+        self.assertEqual(router.db_for_read(Product), "replica")
+        self.assertEqual(router.db_for_read(Category), "replica")
+        self.assertIsNone(router.db_for_read(Cart))
+        self.assertIsNone(router.db_for_read(Order))
+        self.assertEqual(router.db_for_write(Product), "default")
+        self.assertFalse(router.allow_migrate("replica", "store"))
+
+
+@override_settings(STORE_DB_READ_ALIAS="replica")
+class DatabaseProfileTests(TestCase):
+    def test_reads_in_a_transaction_stay_on_the_primary(self):
+        self.assertIsNone(CatalogReplicaRouter().db_for_read(Product))
+
+    def test_reads_that_fill_caches_stay_on_the_primary(self):
+        with primary_reads():
+            self.assertIsNone(CatalogReplicaRouter().db_for_read(Product))
+
+    def test_tuned_sqlite_connection(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tuned = ConnectionHandler({"default": sqlite_database(os.path.join(directory, "tuned.sqlite3"), "tuned")})["default"]
+            try:
+                with tuned.cursor() as cursor:
+                    cursor.execute("PRAGMA journal_mode")
+                    self.assertEqual(cursor.fetchone()[0], "wal")
+                    cursor.execute("PRAGMA synchronous")
+                    self.assertEqual(cursor.fetchone()[0], 1)
+                    cursor.execute("PRAGMA cache_size")
+                    self.assertEqual(cursor.fetchone()[0], -64000)
+                self.assertEqual(tuned.transaction_mode, "IMMEDIATE")
+            finally:
+                tuned.close()
+
+
+class SessionUserCacheTests(StoreTestCase):
+    def test_logged_in_user_comes_from_the_cache(self):
+        url = reverse("store:all-categories")
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.context["user"], self.user)
+        self.assertFalse([q for q in queries if "django_session" in q["sql"] or "auth_user" in q["sql"]])
+
+    def test_no_session_or_user_caching_without_a_shared_cache(self):
+        if project_settings.STORE_REDIS_URL:
+            self.skipTest("shared cache configured")
+        self.assertEqual(project_settings.SESSION_ENGINE, "django.contrib.sessions.backends.db")
+        self.assertEqual(project_settings.STORE_USER_CACHE_TIMEOUT, 0)
+
+    def test_password_change_logs_out_other_sessions(self):
+        other = Client()
+        other.force_login(self.user)
+        url = reverse("store:profile")
+        self.assertEqual(other.get(url).status_code, 200)
+        response = self.client.post(reverse("store:password-change"), {
+            "old_password": "password", "new_password1": "n3w-Passw0rd!", "new_password2": "n3w-Passw0rd!",
+        })
+        self.assertEqual(response.status_code, 302)
+        # the session that changed the password stays logged in, the other one is logged out
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(other.get(url).status_code, 302)
+
+    def test_logout_and_deactivation_drop_the_cached_user(self):
+        url = reverse("store:profile")
+        self.client.get(url)
+        self.assertIsNotNone(get_cached_user(self.user.id))
+        self.client.post(reverse("store:logout"))
+        self.assertIsNone(get_cached_user(self.user.id))
+
+        self.client.force_login(self.user)
+        self.client.get(url)
+        user = User.objects.get(id=self.user.id)
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertIsNone(get_cached_user(self.user.id))
+        self.assertEqual(self.client.get(url).status_code, 302)
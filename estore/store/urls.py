@@ -1,13 +1,17 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 from store.forms import LoginForm, SetPasswordForm, PasswordResetForm, PasswordChangeForm
 from django.contrib.auth import views as auth_views
 
 app_name = 'store'
 
+# read-only catalog pages, async under ASGI (see estore/asgi.py)
+catalog_views = async_views if settings.STORE_ASYNC_VIEWS else views
+
 urlpatterns = [
     # Home URL
-    path('', views.home, name="home"),
+    path('', catalog_views.home, name="home"),
 
     # Cart and Checkout URL
     path('add-to-cart/', views.add_to_cart, name='add-to-cart'),
@@ -17,12 +21,19 @@ urlpatterns = [
     path('cart/', views.cart, name='cart'),
     path('checkout/', views.checkout, name='checkout'),
     path('orders/', views.orders, name='orders'),
+    path('api/cart/add/', views.cart_add_api, name='api-cart-add'),
+    path('api/cart/<int:cart_id>/<str:action>/', views.cart_line_api, name='api-cart-line'),
+
+    # Monitoring URL
+    path('stats/cache/', views.cache_stats, name='cache-stats'),
 
     # Products URL
-    path('product/<slug:slug>/', views.detail, name='product-detail'),
-    path('categories/', views.all_categories, name='all-categories'),
-    path('<slug:slug>/', views.category_products, name='category-products'),
+    path('product/<slug:slug>/', catalog_views.detail, name='product-detail'),
+    path('categories/', catalog_views.all_categories, name='all-categories'),
+    path('search/', views.search, name='search'),
+    path('search/suggest/', views.search_suggest, name='search-suggest'),
     path('shop/', views.shop, name='shop'),
+    path('<slug:slug>/', catalog_views.category_products, name='category-products'),
 
     # Authentication URL
     path('accounts/register/', views.RegistrationView.as_view(), name='register'),
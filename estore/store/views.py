@@ -1,18 +1,36 @@
 # from django.contrib.auth.models import User
 from django.shortcuts import render, redirect, get_object_or_404
-from store.models import Address, Category, Product, Cart, Order
+from store.models import Address, Category, Product, Cart, Order, OrderLine
 from .forms import RegistrationForm, AddressForm
+from .cache import cache_anonymous_page, get_stats, invalidate_cart_count
+from .carts import get_cart, merge_guest_cart
+from .conditional import category_page_state, conditional_page, product_page_state
+from .inventory import OutOfStock, sell
+from .search import search_products, suggest_titles
+from .catalog import catalog_page, catalog_query
+from .orders import order_history_page, order_summary
+from .sales import record_order
 from django.contrib import messages
 from django.views import View
 import decimal
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_POST
+from django.urls import reverse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 
 # Views - python functions which receive a web request and return a web response
 #         (similar to Node.js's Express routers)
 
+SHIPPING_COST = decimal.Decimal(10) # default shipping cost is $10
+CENTS = decimal.Decimal('0.01')
+
 
 # Home Page
+@cache_anonymous_page('home')
 def home(request):
     # filter based on which categories and products are active AND marked to be featured on homepage
     # up to 3 categories and up to 8 products
@@ -25,10 +43,15 @@ def home(request):
     return render(request, "store/index.html", context)
 
 # Detail Page for a specific Product based on slug; also renders related products to the customer
+@conditional_page('product-detail', product_page_state)
 def detail(request, slug):
-    product = get_object_or_404(Product, slug=slug)
-    # related products are of the same category but not including the current product in detail
-    related_products = Product.objects.exclude(id=product.id).filter(is_active=True, category=product.category)
+    product = get_object_or_404(Product.objects.select_related('category'), slug=slug)
+    # related products are precomputed (bought together, then same category - see store/recommendations.py);
+    # products not covered by the last refresh show the newest products of their category instead
+    limit = settings.STORE_RELATED_PRODUCTS
+    related_products = [r.related for r in product.recommendations.filter(related__is_active=True).select_related('related')[:limit]]
+    if not related_products:
+        related_products = Product.objects.exclude(id=product.id).filter(is_active=True, category=product.category).order_by('-created_at', '-id')[:limit]
     context = {
         "product" : product,
         "related_products" : related_products,
@@ -36,22 +59,36 @@ def detail(request, slug):
     return render(request, "store/detail.html", context)
 
 # Display all active categories in our eStore
+@cache_anonymous_page('all-categories')
 def all_categories(request):
     categories = Category.objects.filter(is_active=True)
     return render(request, "store/categories.html", {'categories' : categories})
 
-# Display all products of a specific category
+# Display the products of a specific category, a page at a time
+@conditional_page('category-products', category_page_state)
+@cache_anonymous_page('category-products', query=catalog_query)
 def category_products(request, slug):
     category = get_object_or_404(Category, slug=slug)
-    products = Product.objects.filter(is_active=True, category=category)
-    categories = Category.objects.filter(is_active=True)
-    context = {
-        "category" : category,
-        "products" : products,
-        "categories" : categories,
-    }
+    # one page of products plus category/price facets (see store/catalog.py)
+    context = catalog_page(request, category)
+    context["category"] = category
     return render(request, "store/category_products.html", context)
 
+# Search active products by title, descriptions and category (ranked, words match as prefixes)
+def search(request):
+    query = request.GET.get('q', '').strip()
+    products = search_products(query, limit=40) if query else []
+    return render(request, "store/search.html", {'query' : query, 'products' : products})
+
+# Type-ahead suggestions for the search box
+def search_suggest(request):
+    query = request.GET.get('q', '').strip()
+    results = [
+        {'title' : title, 'url' : reverse('store:product-detail', args=[slug])}
+        for title, slug in suggest_titles(query)
+    ]
+    return JsonResponse({'results' : results})
+
 # Authentication
 
 # Register a new customer, class-based view
@@ -74,8 +111,10 @@ class RegistrationView(View):
 @login_required
 def profile(request):
     addresses = Address.objects.filter(user=request.user)
-    orders = Order.objects.filter(user=request.user)
-    return render(request, "account/profile.html", {'addresses' : addresses, 'orders' : orders})
+    # latest orders and counts per status only, the full history is paginated on the orders page
+    context = order_summary(request.user)
+    context['addresses'] = addresses
+    return render(request, "account/profile.html", context)
 
 # View User's Address Page (must be logged in)
 @method_decorator(login_required, name='dispatch')
@@ -110,101 +149,165 @@ def remove_address(request, id):
 # of the products' quantity and the total price for that particular product. Thus a user buying multiple
 # products will have multiple cart items
 
-@login_required
 def cart(request):
-    user = request.user
-    cart_products = Cart.objects.filter(user=user)
+    # guests' carts come from the cache, logged in users' from one joined query for the cart lines (with
+    # their products and line totals) and one aggregate query for the totals, however many lines
+    cart = get_cart(request)
+    totals = cart.totals(SHIPPING_COST)
 
-    # Display Total Price
-    cart_cost = decimal.Decimal(0)
-    shipping_cost = decimal.Decimal(10) # default shipping cost is $10
-    for cart_product in cart_products:
-        cart_cost += cart_product.total_price
-
-    addresses = Address.objects.filter(user=user)
+    addresses = Address.objects.filter(user=request.user) if request.user.is_authenticated else []
 
     context = {
-        'cart_products' : cart_products,
-        'cart_cost' : cart_cost,
-        'shipping_cost' : shipping_cost,
-        'total_cost' : cart_cost + shipping_cost,
+        'cart_products' : cart.lines(),
+        'cart_cost' : totals['cart_cost'],
+        'shipping_cost' : totals['shipping_cost'],
+        'total_cost' : totals['total_cost'],
         'addresses' : addresses,
     }
 
     return render(request, 'store/cart.html', context)
 
 
-# Add a new item to cart - performed from store view (must be logged in) 
+# Add a new item to cart - performed from store view (guests get a cart in the cache, see store/carts.py)
 def add_to_cart(request):
-    user = request.user
-    product_id = request.GET.get('prod_id')
-    product = get_object_or_404(Product, id=product_id)
-
-    # Check whether the Product is already in the cart or not
-    item_already_in_cart = Cart.objects.filter(product=product_id, user=user)
-    # if in cart already, increment quantity
-    if item_already_in_cart:
-        item = get_object_or_404(Cart, product=product_id, user=user)
-        item.quantity += 1
-        item.save()
-    else:
-        Cart(user=user, product=product).save()
-
+    product_id = request.GET.get('prod_id', '')
+    try:
+        if not product_id.isdigit() or not get_cart(request).add(product_id):
+            raise Http404("No such product")
+    except OutOfStock as e:
+        messages.error(request, str(e))
     return redirect('store:cart')
 
 # Edit cart functions performed from cart view
 
-# Entirely remove an existing item from cart (must be logged in)
-@login_required
+# Entirely remove an existing item from cart
 def remove_from_cart(request, cart_id):
     if request.method == 'GET':
-        to_remove = get_object_or_404(Cart, id=cart_id)
-        to_remove.delete()
-        messages.success(request, "Product Removed from Cart")
+        if get_cart(request).remove(cart_id):
+            messages.success(request, "Product Removed from Cart")
     return redirect('store:cart')
 
-# Increment the quantity of an existing item in cart (must be logged in)
-@login_required
+# Increment the quantity of an existing item in cart
 def incr_cart_item(request, cart_id):
     if request.method == 'GET':
-        to_incr = get_object_or_404(Cart, id=cart_id)
-        to_incr.quantity += 1
-        to_incr.save()
+        try:
+            get_cart(request).increment(cart_id)
+        except OutOfStock as e:
+            messages.error(request, str(e))
     return redirect('store:cart')
 
-# Decrement the quantity of an existing item in cart (must be logged in)
-@login_required
+# Decrement the quantity of an existing item in cart, removing it if only 1 left
 def decr_cart_item(request, cart_id):
     if request.method == 'GET':
-        to_decr = get_object_or_404(Cart, id=cart_id)
-        # remove if only 1 left
-        if to_decr.quantity == 1:
-            to_decr.delete()
-        else:
-            to_decr.quantity -= 1
-            to_decr.save()
+        get_cart(request).decrement(cart_id)
     return redirect('store:cart')
 
+# JSON cart API used by the cart page to update in place: every call is one change of the cart (an
+# atomic statement for logged in users, see CartQuerySet) and answers with the changed line (null once removed) and the new cart totals
+def cart_state(cart, **line):
+    item = cart.line(**line)
+    totals = cart.totals(SHIPPING_COST)
+    return {
+        'line' : item and {
+            'id' : item.id,
+            'product_id' : item.product_id,
+            'quantity' : item.quantity,
+            'line_total' : item.line_total.quantize(CENTS),
+        },
+        'cart_count' : totals['line_count'],
+        'cart_cost' : totals['cart_cost'].quantize(CENTS),
+        'shipping_cost' : totals['shipping_cost'].quantize(CENTS),
+        'total_cost' : totals['total_cost'].quantize(CENTS),
+    }
+
+@require_POST
+def cart_add_api(request):
+    product_id = request.POST.get('prod_id', '')
+    try:
+        quantity = int(request.POST.get('quantity', 1))
+    except ValueError:
+        quantity = 0
+    if quantity < 1:
+        return JsonResponse({'error' : "Invalid quantity"}, status=400)
+    cart = get_cart(request)
+    try:
+        if not product_id.isdigit() or not cart.add(product_id, quantity):
+            return JsonResponse({'error' : "No such product"}, status=404)
+    except OutOfStock as e:
+        return JsonResponse({'error' : str(e)}, status=409)
+    return JsonResponse(cart_state(cart, product_id=product_id))
+
+@require_POST
+def cart_line_api(request, cart_id, action):
+    cart = get_cart(request)
+    change = {'incr' : cart.increment, 'decr' : cart.decrement, 'remove' : cart.remove}.get(action)
+    try:
+        if change is None or not change(cart_id):
+            return JsonResponse({'error' : "No such cart item"}, status=404)
+    except OutOfStock as e:
+        return JsonResponse({'error' : str(e)}, status=409)
+    return JsonResponse(cart_state(cart, line_id=cart_id))
+
 # Checking out all products in cart
+# The whole cart becomes one order in one transaction: one read of the cart lines with their products'
+# current price and stock, the stock of the tracked products (the units held for the customer and one
+# conditional update for the rest, see inventory.py), the order with its precomputed total, one bulk
+# insert of the order lines, one bulk delete of the cart lines and the sales rollup update, so the
+# number of queries does not grow with the cart size. Returns the order, or None for an empty cart;
+# raises OutOfStock, with nothing sold, when a line can't be filled.
+def place_order(user, address):
+    with transaction.atomic():
+        cart_items = list(Cart.objects.filter(user=user).values_list(
+            'id', 'product_id', 'quantity', 'product__title', 'product__price', 'product__category_id', 'product__stock'))
+        if not cart_items:
+            return None
+        tracked = {item[1]: item[2] for item in cart_items if item[6] is not None}
+        if tracked:
+            sell(user, tracked)
+        lines = [
+            OrderLine(product_id=product_id, category_id=category_id, title=title, unit_price=price, quantity=quantity, line_total=price * quantity)
+            for _, product_id, quantity, title, price, category_id, _ in cart_items
+        ]
+        order = Order.objects.create(user=user, address=address, total=sum(line.line_total for line in lines))
+        for line in lines:
+            line.order = order
+        OrderLine.objects.bulk_create(lines)
+        Cart.objects.filter(id__in=[item[0] for item in cart_items]).delete()
+        record_order(order, lines)
+    invalidate_cart_count(user.id)
+    return order
+
+# Lines that are out of stock stay in the cart, with a message saying what is left
+@login_required
 def checkout(request):
     user = request.user
     address_id = request.GET.get('address')
 
-    address = get_object_or_404(Address, id=address_id)
+    address = get_object_or_404(Address, id=address_id, user=user)
 
-    cart = Cart.objects.filter(user=user)
-    for cart_item in cart:
-        # Saving all products in cart to order
-        Order(user=user, address=address, product=cart_item.product, quantity=cart_item.quantity).save()
-        # Delete cart item after done processing it
-        cart_item.delete()
+    merge_guest_cart(request.session, user)
+    try:
+        place_order(user, address)
+    except OutOfStock as e:
+        for message in e.messages():
+            messages.error(request, message)
+        return redirect('store:cart')
     return redirect('store:orders')
 
-# View all orders
+# View all orders, a page at a time (must be logged in)
+@login_required
 def orders(request):
-    all_orders = Order.objects.filter(user=request.user).order_by('-ordered_date')
-    return render(request, 'store/orders.html', {'orders' : all_orders})
+    context = order_history_page(request)
+    context['orders'] = context.pop('products')
+    return render(request, 'store/orders.html', context)
 
+# Display all active products, a page at a time, filterable by price
+@cache_anonymous_page('shop', query=catalog_query)
 def shop(request):
-    return render(request, 'store/shop.html')
+    return render(request, 'store/shop.html', catalog_page(request))
+
+# Page and fragment cache hit/miss counters for monitoring (staff only)
+@staff_member_required
+def cache_stats(request):
+    return JsonResponse(get_stats())
     
\ No newline at end of file